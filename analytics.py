@@ -0,0 +1,272 @@
+import threading
+import numpy as np
+from datetime import date, timedelta
+from sqlalchemy import select, func, cast, Integer, Float
+from extensions import db
+from models import Sale, SaleItem, Product, Category, ArchivedSaleItem
+from data_versions import get_versions
+
+# Día 4 desde 1970-01-01 es el primer lunes: las semanas empiezan en lunes
+_FIRST_MONDAY = 4
+EPOCH = date(1970, 1, 1)
+
+# Umbrales de ingresos acumulados de la clasificación ABC
+ABC_THRESHOLDS = (0.8, 0.95)
+
+
+class SaleFacts:
+    """
+    Líneas de venta cargadas en arrays de NumPy, una posición por SaleItem.
+
+    Los productos y categorías se codifican como índices 0..n-1 (product_codes,
+    category_codes) sobre los arrays product_ids y category_ids.
+    """
+
+    def __init__(self, product_ids, category_ids, days, quantities, revenues):
+        self.product_ids, self.product_codes = np.unique(product_ids, return_inverse=True)
+        self.category_ids, self.category_codes = np.unique(category_ids, return_inverse=True)
+        self.days = days
+        self.quantities = quantities
+        self.revenues = revenues
+
+    def __len__(self):
+        return len(self.days)
+
+
+def epoch_day(column, model=Sale):
+    """
+    Expresión SQL con el número de día (desde 1970-01-01) de una columna de fecha.
+
+    Se calcula en la base de datos para no convertir millones de fechas en Python. El
+    modelo indica el motor (principal o archivo) cuyo dialecto se usa.
+    """
+    dialect = db.session.get_bind(mapper=model.__mapper__).dialect.name
+    if dialect == 'sqlite':
+        return cast(func.julianday(column) - 2440587.5, Integer)
+    if dialect == 'postgresql':
+        return cast(func.floor(func.extract('epoch', column) / 86400), Integer)
+    return func.datediff(column, EPOCH)
+
+
+def _fetch_chunks(statement, model, batch_size):
+    """
+    Ejecuta la consulta en el motor del modelo y devuelve sus filas como arrays de NumPy por lotes.
+    """
+    connection = db.session.connection(bind_arguments={'mapper': model.__mapper__, 'clause': statement})
+    sql = str(statement.compile(dialect=connection.dialect, compile_kwargs={'literal_binds': True}))
+
+    chunks = []
+    cursor = connection.connection.cursor()
+    try:
+        cursor.execute(sql)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            chunks.append(np.array(rows, dtype=np.float64))
+    finally:
+        cursor.close()
+    return chunks
+
+
+def load_sale_facts(batch_size=100000):
+    """
+    Carga todas las líneas de venta, activas y archivadas, en arrays de NumPy leyendo por lotes.
+
+    Se lee con el cursor DB-API de la conexión de la sesión (respetando el enrutado a la
+    réplica) para evitar crear un objeto Row por línea, que multiplica el tiempo de carga.
+    Las líneas archivadas usan la categoría guardada al archivarlas y se leen del motor
+    del archivo, que puede ser otro.
+
+    Returns:
+        SaleFacts: Hechos de venta (producto, categoría, día, cantidad e importe).
+    """
+    statement = select(
+        SaleItem.product_id,
+        Product.category_id,
+        epoch_day(Sale.date),
+        SaleItem.quantity,
+        cast(SaleItem.quantity * SaleItem.price, Float)
+    ).join(Sale, SaleItem.sale_id == Sale.id) \
+        .join(Product, SaleItem.product_id == Product.id)
+    archived_statement = select(
+        ArchivedSaleItem.product_id,
+        ArchivedSaleItem.category_id,
+        epoch_day(ArchivedSaleItem.date, ArchivedSaleItem),
+        ArchivedSaleItem.quantity,
+        cast(ArchivedSaleItem.quantity * ArchivedSaleItem.price, Float)
+    ).where(ArchivedSaleItem.category_id.isnot(None))
+
+    chunks = _fetch_chunks(statement, Sale, batch_size) + _fetch_chunks(archived_statement, ArchivedSaleItem, batch_size)
+    data = np.concatenate(chunks) if chunks else np.empty((0, 5))
+
+    return SaleFacts(
+        product_ids=data[:, 0].astype(np.int64),
+        category_ids=data[:, 1].astype(np.int64),
+        days=data[:, 2].astype(np.int64),
+        quantities=data[:, 3].astype(np.int64),
+        revenues=data[:, 4]
+    )
+
+
+def week_start(week):
+    """
+    Fecha del lunes de una semana expresada como número de semana desde la época.
+    """
+    return EPOCH + timedelta(days=int(week) * 7 + _FIRST_MONDAY)
+
+
+def category_week_matrix(facts, weeks):
+    """
+    Matriz de ingresos categoría × semana de las últimas semanas con ventas.
+
+    Args:
+        facts (SaleFacts): Hechos de venta.
+        weeks (int): Número de semanas (columnas) a devolver, terminando en la última con ventas.
+
+    Returns:
+        tuple: (matriz de ingresos [categorías, semanas], número de la primera semana)
+    """
+    n_categories = len(facts.category_ids)
+    if len(facts) == 0:
+        return np.zeros((n_categories, weeks)), 0
+
+    week_numbers = (facts.days - _FIRST_MONDAY) // 7
+    last_week = int(week_numbers.max())
+    first_week = last_week - weeks + 1
+    mask = week_numbers >= first_week
+
+    cells = facts.category_codes[mask] * weeks + (week_numbers[mask] - first_week)
+    matrix = np.bincount(cells, weights=facts.revenues[mask], minlength=n_categories * weeks)
+    return matrix.reshape(n_categories, weeks), first_week
+
+
+def growth_rates(matrix):
+    """
+    Crecimiento relativo de cada columna respecto a la anterior (NaN si la anterior es 0).
+    """
+    growth = np.full(matrix.shape, np.nan)
+    previous, current = matrix[:, :-1], matrix[:, 1:]
+    np.divide(current - previous, previous, out=growth[:, 1:], where=previous != 0)
+    return growth
+
+
+def moving_average(matrix, window):
+    """
+    Media móvil por filas con la ventana indicada (NaN hasta completar la primera ventana).
+    """
+    averages = np.full(matrix.shape, np.nan)
+    if window < 1 or matrix.shape[1] < window:
+        return averages
+    cumulative = np.cumsum(np.pad(matrix, ((0, 0), (1, 0))), axis=1)
+    averages[:, window - 1:] = (cumulative[:, window:] - cumulative[:, :-window]) / window
+    return averages
+
+
+def abc_classification(facts):
+    """
+    Clasificación ABC de los productos según su contribución a los ingresos.
+
+    Returns:
+        tuple: (ids de producto ordenados por ingresos, ingresos, clase 'A'/'B'/'C' de cada uno)
+    """
+    revenue = np.bincount(facts.product_codes, weights=facts.revenues, minlength=len(facts.product_ids))
+    order = np.argsort(-revenue, kind='stable')
+    revenue = revenue[order]
+    total = revenue.sum()
+    share = np.cumsum(revenue) / total if total else np.zeros(len(revenue))
+    # Un producto pertenece a la clase en la que empieza su aportación acumulada
+    previous_share = share - (revenue / total if total else 0)
+    classes = np.where(previous_share < ABC_THRESHOLDS[0], 'A',
+                       np.where(previous_share < ABC_THRESHOLDS[1], 'B', 'C'))
+    return facts.product_ids[order], revenue, classes
+
+
+def _nan_to_none(values):
+    return [None if np.isnan(v) else round(float(v), 4) for v in values]
+
+
+def sales_trends(weeks=12, window=4):
+    """
+    Informe de ingresos por categoría y semana con crecimiento y media móvil.
+
+    Returns:
+        dict: Semanas, y por categoría ingresos, crecimiento semanal y media móvil.
+    """
+    facts = load_sale_facts()
+    matrix, first_week = category_week_matrix(facts, weeks)
+    growth = growth_rates(matrix)
+    averages = moving_average(matrix, window)
+
+    names = dict(db.session.query(Category.id, Category.name).filter(Category.id.in_(facts.category_ids.tolist())))
+    order = np.argsort(-matrix.sum(axis=1), kind='stable')
+    return {
+        'weeks': [week_start(first_week + i).isoformat() for i in range(weeks)],
+        'window': window,
+        'categories': [{
+            'id': int(facts.category_ids[i]),
+            'name': names.get(int(facts.category_ids[i])),
+            'revenue': [round(float(v), 2) for v in matrix[i]],
+            'growth': _nan_to_none(growth[i]),
+            'moving_average': _nan_to_none(averages[i])
+        } for i in order]
+    }
+
+
+def abc_report():
+    """
+    Informe de la clasificación ABC de productos.
+
+    Returns:
+        dict: Número de productos e ingresos por clase y la clase de cada producto.
+    """
+    product_ids, revenue, classes = abc_classification(load_sale_facts())
+    names = dict(db.session.query(Product.id, Product.name).filter(Product.id.in_(product_ids.tolist()))
+                 .execution_options(include_deleted=True))
+    return {
+        'summary': {c: {'products': int((classes == c).sum()), 'revenue': round(float(revenue[classes == c].sum()), 2)}
+                    for c in ('A', 'B', 'C')},
+        'products': [{'id': int(pid), 'name': names.get(int(pid)), 'revenue': round(float(r), 2), 'class': str(c)}
+                     for pid, r, c in zip(product_ids, revenue, classes)]
+    }
+
+
+class VersionedCache:
+    """
+    Caché de informes que se invalida cuando cambian las versiones de datos de las que dependen.
+    """
+
+    def __init__(self, scopes):
+        self.scopes = scopes
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def get_or_compute(self, key, compute):
+        versions = tuple(sorted(get_versions(*self.scopes).items()))
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == versions:
+                return entry[1]
+        value = compute()
+        with self.lock:
+            # Se descartan las entradas calculadas con versiones anteriores
+            self.entries = {k: v for k, v in self.entries.items() if v[0] == versions}
+            self.entries[key] = (versions, value)
+        return value
+
+
+report_cache = VersionedCache(('sales', 'catalog'))
+
+
+def cached_sales_trends(weeks=12, window=4):
+    """
+    sales_trends() cacheado hasta la siguiente venta o cambio del catálogo.
+    """
+    return report_cache.get_or_compute(('trends', weeks, window), lambda: sales_trends(weeks, window))
+
+
+def cached_abc_report():
+    """
+    abc_report() cacheado hasta la siguiente venta o cambio del catálogo.
+    """
+    return report_cache.get_or_compute(('abc',), abc_report)
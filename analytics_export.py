@@ -0,0 +1,284 @@
+import heapq
+import json
+import os
+import shutil
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import func
+from extensions import db
+from models import Sale, SaleItem, Product, Category, Supplier, ArchivedSaleItem
+from jobs import job, start_job, is_running
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+MANIFEST_NAME = '_manifest.json'
+LOCK_NAME = '_export.lock'
+
+# Las ventas más recientes que este margen no se exportan todavía, para que la marca de agua
+# no se adelante a transacciones que aún no han confirmado líneas con ids menores
+EXPORT_DELAY = timedelta(minutes=5)
+
+# Columnas del fichero de hechos de ventas (una fila por SaleItem)
+SALES_COLUMNS = ['sale_item_id', 'sale_id', 'sale_date', 'user_id', 'product_id', 'product_name',
+                 'reference_number', 'category_id', 'category_name', 'supplier_id', 'supplier_name',
+                 'quantity', 'unit_price', 'line_total']
+
+
+class ExportInProgress(Exception):
+    """
+    Se lanza cuando ya hay otra exportación en curso sobre el mismo directorio.
+    """
+
+
+@contextmanager
+def _export_lock(export_dir):
+    """
+    Bloqueo exclusivo del directorio de exportación durante toda la exportación.
+
+    Se usa un bloqueo del sistema operativo sobre un fichero del directorio, que se libera
+    solo aunque el proceso muera a mitad de la exportación.
+    """
+    handle = open(os.path.join(export_dir, LOCK_NAME), 'a+')
+    try:
+        try:
+            if fcntl is not None:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                handle.seek(0)
+                msvcrt.locking(handle.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError as e:
+            raise ExportInProgress('Ya hay una exportación de ventas en curso') from e
+        yield
+    finally:
+        handle.close()
+
+
+def export_running(export_dir):
+    """
+    Indica si hay una exportación en curso sobre el directorio (en cualquier proceso).
+    """
+    if not os.path.isdir(export_dir):
+        return False
+    try:
+        with _export_lock(export_dir):
+            return False
+    except ExportInProgress:
+        return True
+
+
+def _require_pyarrow():
+    """
+    Importa pyarrow, dependencia opcional necesaria solo para la exportación.
+    """
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as e:
+        raise RuntimeError('La exportación de analítica necesita el paquete pyarrow (pip install pyarrow)') from e
+    return pyarrow
+
+
+def read_manifest(export_dir):
+    """
+    Lee el manifiesto de la exportación (marca de agua y ficheros generados).
+
+    Returns:
+        dict: Manifiesto; vacío si todavía no se ha exportado nada.
+    """
+    path = os.path.join(export_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {'high_water_mark': 0, 'files': []}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _write_manifest(export_dir, manifest):
+    """
+    Escribe el manifiesto de forma atómica para no dejarlo a medias si el proceso se interrumpe.
+    """
+    path = os.path.join(export_dir, MANIFEST_NAME)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _export_until_id():
+    """
+    Id de línea de venta hasta el que se puede exportar: el mayor de las ventas con más de
+    EXPORT_DELAY de antigüedad o, si es mayor, el de las líneas archivadas.
+    """
+    hot = db.session.query(func.max(SaleItem.id)).join(Sale, SaleItem.sale_id == Sale.id) \
+        .filter(Sale.date <= datetime.utcnow() - EXPORT_DELAY).scalar()
+    archived = db.session.query(func.max(ArchivedSaleItem.id)).scalar()
+    return max(hot or 0, archived or 0)
+
+
+def _sales_facts_query(high_water_mark, until_id, batch_size):
+    """
+    Consulta desnormalizada de los items de venta entre la marca de agua y until_id, leída por lotes.
+    """
+    return db.session.query(
+        SaleItem.id, Sale.id, Sale.date, Sale.user_id, Product.id, Product.name, Product.reference_number,
+        Category.id, Category.name, Supplier.id, Supplier.company_name,
+        SaleItem.quantity, SaleItem.price
+    ).join(Sale, SaleItem.sale_id == Sale.id) \
+        .join(Product, SaleItem.product_id == Product.id) \
+        .join(Category, Product.category_id == Category.id) \
+        .outerjoin(Supplier, SaleItem.supplier_id == Supplier.id) \
+        .filter(SaleItem.id > high_water_mark, SaleItem.id <= until_id) \
+        .order_by(SaleItem.id) \
+        .execution_options(yield_per=batch_size, include_deleted=True)
+
+
+def _archived_facts(high_water_mark, until_id, batch_size):
+    """
+    Hechos de las líneas de venta archivadas entre la marca de agua y until_id, con las mismas
+    columnas que _sales_facts_query() y en orden de id.
+
+    La referencia del producto y el nombre de la categoría se completan desde las tablas
+    activas, que pueden estar en otro motor que el archivo.
+    """
+    references = dict(db.session.query(Product.id, Product.reference_number).execution_options(include_deleted=True))
+    categories = dict(db.session.query(Category.id, Category.name))
+    rows = db.session.query(
+        ArchivedSaleItem.id, ArchivedSaleItem.sale_id, ArchivedSaleItem.date, ArchivedSaleItem.user_id,
+        ArchivedSaleItem.product_id, ArchivedSaleItem.product_name, ArchivedSaleItem.category_id,
+        ArchivedSaleItem.supplier_id, ArchivedSaleItem.supplier_name, ArchivedSaleItem.quantity, ArchivedSaleItem.price
+    ).filter(ArchivedSaleItem.id > high_water_mark, ArchivedSaleItem.id <= until_id) \
+        .order_by(ArchivedSaleItem.id) \
+        .execution_options(yield_per=batch_size)
+    for (item_id, sale_id, sale_date, user_id, product_id, product_name, category_id,
+         supplier_id, supplier_name, quantity, price) in rows:
+        yield (item_id, sale_id, sale_date, user_id, product_id, product_name, references.get(product_id),
+               category_id, categories.get(category_id), supplier_id, supplier_name, quantity, price)
+
+
+def _write_batch(pa, export_dir, rows):
+    """
+    Escribe un lote de filas en un fichero Parquet por mes (partición month=YYYY-MM).
+
+    Returns:
+        list: Rutas relativas de los ficheros escritos.
+    """
+    by_month = defaultdict(list)
+    for row in rows:
+        by_month[row[2].strftime('%Y-%m')].append(row)
+
+    written = []
+    for month, month_rows in sorted(by_month.items()):
+        columns = {name: [] for name in SALES_COLUMNS}
+        for row in month_rows:
+            values = list(row) + [row[11] * row[12]]
+            for name, value in zip(SALES_COLUMNS, values):
+                columns[name].append(value)
+        table = pa.Table.from_pydict(columns)
+
+        partition = os.path.join('sales', f'month={month}')
+        os.makedirs(os.path.join(export_dir, partition), exist_ok=True)
+        relative_path = os.path.join(partition, f'part-{month_rows[0][0]:012d}-{month_rows[-1][0]:012d}.parquet')
+        pa.parquet.write_table(table, os.path.join(export_dir, relative_path), compression='zstd')
+        written.append(relative_path)
+    return written
+
+
+def export_sales(export_dir, batch_size=50000, full=False):
+    """
+    Exporta los hechos de ventas (Sale/SaleItem/Product/Supplier y las líneas archivadas) a
+    ficheros Parquet.
+
+    Las exportaciones sobre un mismo directorio se serializan: si ya hay otra en curso se
+    lanza ExportInProgress en lugar de leer la misma marca de agua y duplicar ficheros.
+
+    La exportación es incremental: solo se leen las líneas con id mayor que la marca de
+    agua del manifiesto, que avanza tras escribir cada lote. Las ventas de los últimos
+    EXPORT_DELAY minutos se dejan para la siguiente exportación. Las líneas archivadas conservan
+    el id de su SaleItem, así que se combinan por id con las activas. Con full=True se
+    empieza de cero.
+
+    Args:
+        export_dir (str): Directorio de destino.
+        batch_size (int): Filas leídas y escritas por lote.
+        full (bool): Si es True ignora la marca de agua y reexporta todo el histórico.
+
+    Returns:
+        dict: Resumen con las filas exportadas, los ficheros nuevos y la marca de agua final.
+    """
+    pa = _require_pyarrow()
+    os.makedirs(export_dir, exist_ok=True)
+    with _export_lock(export_dir):
+        return _export_sales(pa, export_dir, batch_size, full)
+
+
+def _export_sales(pa, export_dir, batch_size, full):
+    """
+    Cuerpo de export_sales(), ejecutado con el bloqueo del directorio adquirido.
+    """
+    if full:
+        # Se eliminan los ficheros anteriores para no duplicar filas en las particiones
+        shutil.rmtree(os.path.join(export_dir, 'sales'), ignore_errors=True)
+        manifest = {'high_water_mark': 0, 'files': []}
+    else:
+        manifest = read_manifest(export_dir)
+
+    exported_rows = 0
+    new_files = []
+    batch = []
+
+    def flush():
+        nonlocal batch, exported_rows
+        files = _write_batch(pa, export_dir, batch)
+        exported_rows += len(batch)
+        new_files.extend(files)
+        manifest['high_water_mark'] = batch[-1][0]
+        manifest['files'].extend(files)
+        manifest['updated_at'] = datetime.utcnow().isoformat()
+        _write_manifest(export_dir, manifest)
+        batch = []
+
+    until_id = _export_until_id()
+    hot_rows = (tuple(row) for row in _sales_facts_query(manifest['high_water_mark'], until_id, batch_size))
+    archived_rows = _archived_facts(manifest['high_water_mark'], until_id, batch_size)
+    for row in heapq.merge(hot_rows, archived_rows, key=lambda row: row[0]):
+        batch.append(row)
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+
+    return {'rows': exported_rows, 'files': new_files, 'high_water_mark': manifest['high_water_mark']}
+
+
+def start_export(app, full=False):
+    """
+    Lanza la exportación en segundo plano (tarea sales-export) y vuelve enseguida, para que
+    la petición que la inicia no ocupe un worker mientras dura.
+
+    Raises:
+        RuntimeError: Si falta pyarrow.
+        ExportInProgress: Si ya hay una exportación en curso.
+    """
+    _require_pyarrow()
+    if export_running(app.config['EXPORT_DIR']) or not start_job(app, 'sales-export', full=full):
+        raise ExportInProgress('Ya hay una exportación de ventas en curso')
+
+
+def export_status(export_dir):
+    """
+    Manifiesto de la exportación junto con si hay una en curso.
+    """
+    return dict(read_manifest(export_dir), running=is_running('sales-export') or export_running(export_dir))
+
+
+@job('sales-export', hour=2)
+def nightly_sales_export(full=False):
+    """
+    Tarea diaria: exporta las ventas nuevas desde la exportación anterior.
+    """
+    return export_sales(current_app.config['EXPORT_DIR'], current_app.config['EXPORT_BATCH_SIZE'], full=full)
@@ -0,0 +1,298 @@
+import heapq
+from datetime import datetime, timedelta
+from itertools import islice
+from flask import current_app
+from flask_sqlalchemy.pagination import Pagination
+from sqlalchemy import delete, func
+from extensions import db
+from models import (User, Product, Supplier, Sale, SaleItem, Purchase, PurchaseItem,
+                    ArchivedSaleItem, ArchivedPurchaseItem)
+from jobs import job
+
+
+def archive_cutoff(now=None):
+    """
+    Fecha límite del archivo: el primer día del mes de hace ARCHIVE_AFTER_DAYS días.
+
+    Se archivan meses completos (periodos cerrados), así que un día nunca queda repartido
+    entre las tablas activas y las de archivo.
+    """
+    now = now or datetime.utcnow()
+    limit = now - timedelta(days=current_app.config['ARCHIVE_AFTER_DAYS'])
+    return datetime(limit.year, limit.month, 1)
+
+
+def _sale_rows(sale_ids):
+    return db.session.query(
+        SaleItem.id,
+        SaleItem.sale_id,
+        Sale.date,
+        Sale.user_id,
+        User.username,
+        User.email,
+        Sale.total.label('sale_total'),
+        Sale.shipping_address,
+        Sale.payment_method,
+        SaleItem.product_id,
+        Product.name.label('product_name'),
+        Product.category_id,
+        SaleItem.supplier_id,
+        Supplier.company_name.label('supplier_name'),
+        SaleItem.quantity,
+        SaleItem.price
+    ).join(Sale, SaleItem.sale_id == Sale.id) \
+        .outerjoin(User, Sale.user_id == User.id) \
+        .outerjoin(Product, SaleItem.product_id == Product.id) \
+        .outerjoin(Supplier, SaleItem.supplier_id == Supplier.id) \
+        .filter(SaleItem.sale_id.in_(sale_ids)) \
+        .execution_options(include_deleted=True).all()
+
+
+def _purchase_rows(purchase_ids):
+    return db.session.query(
+        PurchaseItem.id,
+        PurchaseItem.purchase_id,
+        Purchase.date,
+        Purchase.supplier_id,
+        Supplier.company_name.label('supplier_name'),
+        Purchase.total.label('purchase_total'),
+        PurchaseItem.product_id,
+        Product.name.label('product_name'),
+        PurchaseItem.quantity,
+        PurchaseItem.price
+    ).join(Purchase, PurchaseItem.purchase_id == Purchase.id) \
+        .outerjoin(Supplier, Purchase.supplier_id == Supplier.id) \
+        .outerjoin(Product, PurchaseItem.product_id == Product.id) \
+        .filter(PurchaseItem.purchase_id.in_(purchase_ids)) \
+        .execution_options(include_deleted=True).all()
+
+
+# Para cada historial: cabecera, líneas, columna de la cabecera en las líneas, tabla de archivo
+# y consulta desnormalizada de las líneas de un lote de cabeceras
+HISTORIES = {
+    'sales': (Sale, SaleItem, 'sale_id', ArchivedSaleItem, _sale_rows),
+    'purchases': (Purchase, PurchaseItem, 'purchase_id', ArchivedPurchaseItem, _purchase_rows)
+}
+
+
+def _archive_batch(name, header_ids):
+    """
+    Mueve al archivo las líneas de un lote de cabeceras y después las borra de las tablas activas.
+
+    Cada paso se confirma por separado porque el archivo puede estar en otro motor: si el
+    proceso se interrumpe tras copiar, la siguiente ejecución omite las líneas ya archivadas
+    y completa el borrado.
+
+    Returns:
+        tuple: Cabeceras y líneas archivadas.
+    """
+    header, item, header_column, archived, rows_for = HISTORIES[name]
+    rows = [row._asdict() for row in rows_for(header_ids)]
+    db.session.commit()
+    if not rows:
+        return 0, 0
+
+    existing = set(db.session.scalars(
+        db.select(archived.id).where(archived.id.in_([row['id'] for row in rows]))
+    ))
+    new_rows = [row for row in rows if row['id'] not in existing]
+    if new_rows:
+        db.session.execute(db.insert(archived), new_rows)
+    db.session.commit()
+
+    moved_ids = sorted({row[header_column] for row in rows})
+    db.session.execute(delete(item).where(getattr(item, header_column).in_(moved_ids)))
+    db.session.execute(delete(header).where(header.id.in_(moved_ids)))
+    db.session.commit()
+    return len(moved_ids), len(rows)
+
+
+def _header_batches(header, cutoff, batch_size):
+    """
+    Genera los ids de las cabeceras anteriores a la fecha límite en lotes, recorriéndolas por id.
+
+    La cabecera con el id más alto nunca se incluye: SQLite reutiliza los ids a partir del
+    máximo existente y el archivo conserva los ids originales. Sigue en las tablas activas y
+    HistoryPagination la ordena por fecha junto a las archivadas.
+    """
+    max_id = db.session.query(func.max(header.id)).scalar() or 0
+    last_id = 0
+    while True:
+        header_ids = [header_id for header_id, in db.session.query(header.id)
+                      .filter(header.date < cutoff, header.id > last_id, header.id < max_id)
+                      .order_by(header.id).limit(batch_size)]
+        if not header_ids:
+            return
+        yield header_ids
+        last_id = header_ids[-1]
+
+
+def archive_history(name, cutoff=None, batch_size=None):
+    """
+    Archiva por lotes las ventas o pedidos anteriores a la fecha límite.
+
+    Se recorren las cabeceras por id, de modo que las cabeceras sin líneas se quedan en las
+    tablas activas sin repetirse en cada lote.
+
+    Args:
+        name (str): 'sales' o 'purchases'.
+        cutoff (datetime): Se archivan las cabeceras con fecha anterior. Por defecto archive_cutoff().
+        batch_size (int): Cabeceras por lote. Por defecto ARCHIVE_BATCH_SIZE.
+
+    Returns:
+        dict: Cabeceras ('headers') y líneas ('items') archivadas y lotes ('batches') procesados.
+    """
+    header = HISTORIES[name][0]
+    cutoff = cutoff or archive_cutoff()
+    batch_size = batch_size or current_app.config['ARCHIVE_BATCH_SIZE']
+
+    metrics = {'headers': 0, 'items': 0, 'batches': 0}
+    for header_ids in _header_batches(header, cutoff, batch_size):
+        headers, items = _archive_batch(name, header_ids)
+        metrics['headers'] += headers
+        metrics['items'] += items
+        metrics['batches'] += 1
+    db.session.commit()
+    return metrics
+
+
+def archive_all(cutoff=None):
+    """
+    Archiva las ventas y los pedidos a proveedores anteriores a la fecha límite.
+
+    Returns:
+        dict: Métricas de archive_history() de cada historial y la fecha límite usada.
+    """
+    cutoff = cutoff or archive_cutoff()
+    metrics = {name: archive_history(name, cutoff) for name in HISTORIES}
+    metrics['cutoff'] = cutoff.date().isoformat()
+    current_app.logger.info(
+        f"Archivo anterior a {metrics['cutoff']}: {metrics['sales']['headers']} ventas "
+        f"({metrics['sales']['items']} líneas), {metrics['purchases']['headers']} pedidos "
+        f"({metrics['purchases']['items']} líneas)"
+    )
+    return metrics
+
+
+@job('archive-history', hour=3)
+def nightly_archive():
+    """
+    Tarea periódica: archiva los meses cerrados de ventas y pedidos.
+    """
+    return archive_all()
+
+
+def delete_history(name, cutoff, batch_size=None):
+    """
+    Borra por lotes de las tablas activas las ventas o pedidos anteriores a la fecha límite,
+    sin archivarlos.
+
+    Returns:
+        dict: Cabeceras ('headers') y líneas ('items') borradas y lotes ('batches') procesados.
+    """
+    header, item, header_column = HISTORIES[name][:3]
+    batch_size = batch_size or current_app.config['ARCHIVE_BATCH_SIZE']
+
+    metrics = {'headers': 0, 'items': 0, 'batches': 0}
+    for header_ids in _header_batches(header, cutoff, batch_size):
+        metrics['items'] += db.session.execute(
+            delete(item).where(getattr(item, header_column).in_(header_ids))).rowcount
+        metrics['headers'] += db.session.execute(delete(header).where(header.id.in_(header_ids))).rowcount
+        metrics['batches'] += 1
+        db.session.commit()
+    return metrics
+
+
+def purge_archived(name, cutoff, batch_size=None):
+    """
+    Borra por lotes las líneas archivadas anteriores a la fecha límite.
+
+    Returns:
+        dict: Líneas ('items') borradas y lotes ('batches') procesados.
+    """
+    archived = HISTORIES[name][3]
+    batch_size = batch_size or current_app.config['ARCHIVE_BATCH_SIZE']
+
+    metrics = {'items': 0, 'batches': 0}
+    while True:
+        ids = list(db.session.scalars(
+            db.select(archived.id).where(archived.date < cutoff).order_by(archived.id).limit(batch_size)
+        ))
+        if not ids:
+            break
+        db.session.execute(delete(archived).where(archived.id.in_(ids)))
+        db.session.commit()
+        metrics['items'] += len(ids)
+        metrics['batches'] += 1
+    return metrics
+
+
+# Modos de retención de los pedidos fuera de la ventana activa
+RETENTION_MODES = {
+    'archive': archive_history,
+    'delete': delete_history
+}
+
+
+def apply_purchase_retention(now=None):
+    """
+    Aplica las ventanas de retención del historial de pedidos a proveedores.
+
+    Los pedidos anteriores a PURCHASE_RETENTION_DAYS días se archivan o se borran según
+    PURCHASE_RETENTION_MODE, y las líneas archivadas anteriores a
+    PURCHASE_ARCHIVE_RETENTION_DAYS días se borran del archivo. Una ventana a 0 no se aplica.
+
+    Returns:
+        dict: Métricas de cada paso ('active', 'archived'); None en los pasos desactivados.
+
+    Raises:
+        ValueError: Si PURCHASE_RETENTION_MODE no es válido.
+    """
+    config = current_app.config
+    mode = config['PURCHASE_RETENTION_MODE']
+    if mode not in RETENTION_MODES:
+        raise ValueError(f"PURCHASE_RETENTION_MODE inválido: {mode}")
+    now = now or datetime.utcnow()
+
+    metrics = {'mode': mode, 'active': None, 'archived': None}
+    if config['PURCHASE_RETENTION_DAYS']:
+        cutoff = now - timedelta(days=config['PURCHASE_RETENTION_DAYS'])
+        metrics['active'] = RETENTION_MODES[mode]('purchases', cutoff)
+    if config['PURCHASE_ARCHIVE_RETENTION_DAYS']:
+        cutoff = now - timedelta(days=config['PURCHASE_ARCHIVE_RETENTION_DAYS'])
+        metrics['archived'] = purge_archived('purchases', cutoff)
+    return metrics
+
+
+@job('purchase-retention', hour=4)
+def nightly_purchase_retention():
+    """
+    Tarea periódica: aplica la retención del historial de pedidos a proveedores.
+    """
+    return apply_purchase_retention()
+
+
+class HistoryPagination(Pagination):
+    """
+    Paginación de un historial repartido entre las tablas activas y las de archivo.
+
+    Recibe dos consultas con columnas equivalentes (entre ellas date e id) y el mismo orden
+    descendente por (date, id): hot (tablas activas) y archive (tablas de archivo). Las filas
+    se combinan por fecha, porque en las tablas activas pueden quedar filas anteriores a las
+    archivadas (la última cabecera y las cabeceras sin líneas no se archivan). Cada página lee
+    como mucho offset + per_page filas de cada consulta.
+    """
+
+    @staticmethod
+    def _order_key(row):
+        return row.date, row.id
+
+    def _query_items(self):
+        offset, limit = self._query_offset, self.per_page
+        hot = self._query_args['hot'].limit(offset + limit).all()
+        archive = self._query_args['archive'].limit(offset + limit).all()
+        merged = heapq.merge(hot, archive, key=self._order_key, reverse=True)
+        return list(islice(merged, offset, offset + limit))
+
+    def _query_count(self):
+        return self._query_args['hot'].order_by(None).count() + self._query_args['archive'].order_by(None).count()
@@ -0,0 +1,113 @@
+"""
+Benchmark de rendimiento del login con el servicio de hashing de contraseñas.
+
+Lanza varios clientes que inician sesión en bucle mientras otro cliente hace peticiones
+ligeras (la redirección de la página principal) y mide los logins por segundo y la latencia
+de esas peticiones ligeras. Se ejecuta dos veces: con un pool de hashing tan grande como el
+número de clientes (equivalente a calcular los hashes en cada hilo de petición) y con el
+pool acotado de PASSWORD_HASH_WORKERS hilos.
+
+Uso:
+    python benchmarks/login_throughput.py --clients 16 --seconds 10 --method pbkdf2:sha256:260000
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+N_USERS = 50
+
+
+def make_app(path, method, workers):
+    """
+    Crea una aplicación de pruebas sobre un fichero SQLite con usuarios de ejemplo.
+    """
+    from config import TestingConfig
+    TestingConfig.SQLALCHEMY_DATABASE_URI = f'sqlite:///{path}'
+    TestingConfig.PASSWORD_HASH_METHOD = method
+    TestingConfig.PASSWORD_HASH_WORKERS = workers
+    TestingConfig.PASSWORD_HASH_MAX_QUEUE = 1000
+
+    from main import create_app
+    from extensions import db
+    from models import User
+    from passwords import password_hasher
+
+    app = create_app('testing')
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        users = [User(username=f'user{i}', email=f'user{i}@example.com') for i in range(N_USERS)]
+        for user, password_hash in zip(users, password_hasher.hash_many([f'password{i}' for i in range(N_USERS)])):
+            user.password_hash = password_hash
+        db.session.add_all(users)
+        db.session.commit()
+    return app
+
+
+def login_client(app, index, deadline, counts):
+    """
+    Inicia y cierra sesión en bucle con un usuario hasta el final del benchmark.
+    """
+    client = app.test_client()
+    done = 0
+    user = index % N_USERS
+    while time.time() < deadline:
+        response = client.post('/login', data={'username': f'user{user}', 'password': f'password{user}'})
+        if response.status_code == 302:
+            done += 1
+        client.get('/logout')
+    counts.append(done)
+
+
+def light_client(app, deadline, latencies):
+    """
+    Hace peticiones baratas y anota su latencia para medir si los logins las retrasan.
+    """
+    client = app.test_client()
+    while time.time() < deadline:
+        started = time.perf_counter()
+        client.get('/')
+        latencies.append(time.perf_counter() - started)
+
+
+def run(label, method, workers, clients, seconds):
+    """
+    Ejecuta una ronda del benchmark con el tamaño de pool indicado y muestra los resultados.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        app = make_app(os.path.join(tmp, 'bench.db'), method, workers)
+        counts, latencies = [], []
+        deadline = time.time() + seconds
+        threads = [threading.Thread(target=login_client, args=(app, i, deadline, counts)) for i in range(clients)]
+        threads.append(threading.Thread(target=light_client, args=(app, deadline, latencies)))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    p95 = statistics.quantiles(latencies, n=20)[-1] * 1000 if len(latencies) > 1 else float('nan')
+    print(f"{label:<10} pool: {workers:3d} hilos  logins: {sum(counts) / seconds:8.1f}/s  "
+          f"peticiones ligeras: {len(latencies) / seconds:8.1f}/s (p95 {p95:.1f} ms)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--method', default='pbkdf2:sha256:260000')
+    parser.add_argument('--workers', type=int, default=max((os.cpu_count() or 2) // 2, 1),
+                        help='Hilos del pool acotado (PASSWORD_HASH_WORKERS).')
+    args = parser.parse_args()
+
+    run('unbounded', args.method, args.clients, args.clients, args.seconds)
+    run('bounded', args.method, args.workers, args.clients, args.seconds)
+
+
+if __name__ == '__main__':
+    main()
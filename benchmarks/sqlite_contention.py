@@ -0,0 +1,155 @@
+"""
+Benchmark de contención lectura/escritura sobre SQLite con varios procesos.
+
+Simula workers que realizan checkouts (insertan una venta con sus items y descuentan stock)
+mientras otros procesos consultan los agregados del dashboard de administración. Se ejecuta
+dos veces: con los valores por defecto de SQLite (journal DELETE, sin busy_timeout) y con
+los PRAGMAs configurados en config.py, y muestra el rendimiento y los errores de bloqueo.
+
+Uso:
+    python benchmarks/sqlite_contention.py --writers 4 --readers 4 --seconds 10
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.pool import NullPool
+from config import Config
+from database import sqlite_pragmas, sqlite_pragma_listener
+
+BASELINE_SETTINGS = {'SQLITE_JOURNAL_MODE': 'DELETE', 'SQLITE_BUSY_TIMEOUT_MS': 0, 'SQLITE_SYNCHRONOUS': 'FULL'}
+TUNED_SETTINGS = {
+    'SQLITE_JOURNAL_MODE': Config.SQLITE_JOURNAL_MODE,
+    'SQLITE_BUSY_TIMEOUT_MS': Config.SQLITE_BUSY_TIMEOUT_MS,
+    'SQLITE_SYNCHRONOUS': Config.SQLITE_SYNCHRONOUS,
+    'SQLITE_CACHE_SIZE_KB': Config.SQLITE_CACHE_SIZE_KB,
+    'SQLITE_MMAP_SIZE': Config.SQLITE_MMAP_SIZE
+}
+N_PRODUCTS = 500
+
+
+def make_engine(path, settings):
+    """
+    Crea un motor sobre el fichero indicado aplicando los PRAGMAs de la configuración.
+    """
+    # timeout=0 desactiva la espera propia de pysqlite para medir solo el efecto de los PRAGMAs
+    engine = create_engine(f"sqlite:///{path}", poolclass=NullPool, connect_args={'timeout': 0})
+    event.listen(engine, 'connect', sqlite_pragma_listener(sqlite_pragmas(settings)))
+    return engine
+
+
+def prepare_database(path, settings):
+    """
+    Crea las tablas mínimas del benchmark y carga productos y ventas iniciales.
+    """
+    engine = make_engine(path, settings)
+    now = datetime.utcnow()
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE product (id INTEGER PRIMARY KEY, name TEXT, price REAL, stock INTEGER)"))
+        conn.execute(text("CREATE TABLE sale (id INTEGER PRIMARY KEY, date TIMESTAMP, total REAL, user_id INTEGER)"))
+        conn.execute(text("CREATE TABLE sale_item (id INTEGER PRIMARY KEY, sale_id INTEGER, product_id INTEGER, "
+                          "quantity INTEGER, price REAL)"))
+        conn.execute(text("CREATE INDEX ix_sale_date ON sale (date)"))
+        conn.execute(text("INSERT INTO product (id, name, price, stock) VALUES (:id, :name, :price, 1000000)"),
+                     [{'id': i, 'name': f'Producto {i}', 'price': round(random.uniform(10, 500), 2)}
+                      for i in range(1, N_PRODUCTS + 1)])
+        for sale_id in range(1, 2001):
+            conn.execute(text("INSERT INTO sale (id, date, total, user_id) VALUES (:id, :date, 0, 1)"),
+                         {'id': sale_id, 'date': now - timedelta(minutes=random.randint(0, 43200))})
+            conn.execute(text("INSERT INTO sale_item (sale_id, product_id, quantity, price) VALUES (:s, :p, 1, 10)"),
+                         {'s': sale_id, 'p': random.randint(1, N_PRODUCTS)})
+    engine.dispose()
+
+
+def writer(path, settings, deadline, results):
+    """
+    Simula checkouts: una venta con 1-3 items y la actualización de stock en una transacción.
+    """
+    engine = make_engine(path, settings)
+    done = errors = 0
+    while time.time() < deadline:
+        try:
+            with engine.begin() as conn:
+                sale_id = conn.execute(text("INSERT INTO sale (date, total, user_id) VALUES (:d, 0, 1) RETURNING id"),
+                                       {'d': datetime.utcnow()}).scalar()
+                for _ in range(random.randint(1, 3)):
+                    product_id = random.randint(1, N_PRODUCTS)
+                    conn.execute(text("INSERT INTO sale_item (sale_id, product_id, quantity, price) "
+                                      "VALUES (:s, :p, 1, 10)"), {'s': sale_id, 'p': product_id})
+                    conn.execute(text("UPDATE product SET stock = stock - 1 WHERE id = :p"), {'p': product_id})
+            done += 1
+        except OperationalError:
+            errors += 1
+    engine.dispose()
+    results.put(('write', done, errors))
+
+
+def reader(path, settings, deadline, results):
+    """
+    Simula el refresco del dashboard: ventas diarias y productos más vendidos.
+    """
+    engine = make_engine(path, settings)
+    done = errors = 0
+    while time.time() < deadline:
+        try:
+            with engine.connect() as conn:
+                conn.execute(text("SELECT date(date), sum(total) FROM sale WHERE date >= :d GROUP BY date(date)"),
+                             {'d': datetime.utcnow() - timedelta(days=30)}).all()
+                conn.execute(text("SELECT product_id, sum(quantity) FROM sale_item GROUP BY product_id "
+                                  "ORDER BY 2 DESC LIMIT 10")).all()
+            done += 1
+        except OperationalError:
+            errors += 1
+    engine.dispose()
+    results.put(('read', done, errors))
+
+
+def run(label, settings, writers, readers, seconds):
+    """
+    Ejecuta una ronda del benchmark con la configuración indicada y muestra los resultados.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        prepare_database(path, settings)
+        results = multiprocessing.Queue()
+        deadline = time.time() + seconds
+        processes = [multiprocessing.Process(target=writer, args=(path, settings, deadline, results))
+                     for _ in range(writers)]
+        processes += [multiprocessing.Process(target=reader, args=(path, settings, deadline, results))
+                      for _ in range(readers)]
+        for process in processes:
+            process.start()
+        totals = {'write': [0, 0], 'read': [0, 0]}
+        for _ in processes:
+            kind, done, errors = results.get()
+            totals[kind][0] += done
+            totals[kind][1] += errors
+        for process in processes:
+            process.join()
+
+    print(f"{label:<10} escrituras: {totals['write'][0] / seconds:9.1f}/s ({totals['write'][1]} bloqueos)  "
+          f"lecturas: {totals['read'][0] / seconds:9.1f}/s ({totals['read'][1]} bloqueos)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=10)
+    args = parser.parse_args()
+
+    run('default', BASELINE_SETTINGS, args.writers, args.readers, args.seconds)
+    run('tuned', TUNED_SETTINGS, args.writers, args.readers, args.seconds)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,258 @@
+import time
+from abc import ABC, abstractmethod
+from flask import current_app, g, session
+from flask_login import current_user, user_logged_out
+from werkzeug.utils import import_string
+from extensions import db
+from models import Product, CartItem
+
+# Clave de la sesión con el carrito del SessionCart
+SESSION_KEY = '_cart'
+
+
+class CartFull(Exception):
+    """
+    Se lanza al añadir un producto nuevo a un carrito que ya tiene CART_MAX_LINES líneas.
+    """
+
+
+class CartLine:
+    """
+    Línea del carrito para las vistas y el checkout: producto y cantidad, con la misma
+    interfaz que CartItem (product, product_id, quantity, subtotal, formatted_subtotal).
+    """
+
+    def __init__(self, product, quantity):
+        self.product = product
+        self.product_id = product.id
+        self.quantity = quantity
+
+    @property
+    def subtotal(self):
+        return self.product.price * self.quantity
+
+    @property
+    def formatted_subtotal(self):
+        return f"€{self.subtotal:.2f}"
+
+
+class BaseCart(ABC):
+    """
+    Carrito de un usuario: cantidades por producto y operaciones comunes a todos los almacenes.
+
+    Las subclases cargan y guardan las cantidades (self.items, {product_id: cantidad}) e
+    implementan save() y clear(); un almacén incompleto falla al crearse.
+    """
+
+    def __init__(self, user_id, app_config):
+        self.user_id = user_id
+        self.max_lines = app_config['CART_MAX_LINES']
+        self.items = {}
+
+    def quantity(self, product_id):
+        return self.items.get(product_id, 0)
+
+    def set_quantity(self, product_id, quantity):
+        """
+        Fija la cantidad de un producto; con cantidad 0 o menor se elimina del carrito.
+        """
+        if quantity <= 0:
+            self.items.pop(product_id, None)
+            return
+        if product_id not in self.items and len(self.items) >= self.max_lines:
+            raise CartFull(f'El carrito no admite más de {self.max_lines} productos distintos')
+        self.items[product_id] = quantity
+
+    def add(self, product_id, quantity):
+        self.set_quantity(product_id, self.quantity(product_id) + quantity)
+
+    def remove(self, product_id):
+        self.set_quantity(product_id, 0)
+
+    def lines(self, products=None):
+        """
+        Devuelve las líneas del carrito con sus productos, cargados con una sola consulta.
+
+        Args:
+            products (dict): {product_id: Product} ya cargados (deben incluir todos los del
+                carrito); si no se indican se consultan.
+        """
+        if not self.items:
+            return []
+        if products is None:
+            products = {product.id: product for product in Product.query.filter(Product.id.in_(self.items))}
+        return [CartLine(products[product_id], self.items[product_id])
+                for product_id in sorted(self.items) if product_id in products]
+
+    def total(self, lines=None):
+        return sum(line.subtotal for line in (self.lines() if lines is None else lines))
+
+    def _load_rows(self):
+        return dict(db.session.query(CartItem.product_id, CartItem.quantity).filter_by(user_id=self.user_id))
+
+    def _replace_rows(self):
+        """
+        Sustituye las filas CartItem del usuario por el contenido actual del carrito (sin confirmar).
+        """
+        CartItem.query.filter_by(user_id=self.user_id).delete()
+        if self.items:
+            db.session.execute(db.insert(CartItem), [
+                {'user_id': self.user_id, 'product_id': product_id, 'quantity': quantity}
+                for product_id, quantity in self.items.items()
+            ])
+
+    @abstractmethod
+    def save(self):
+        """
+        Guarda los cambios del carrito.
+        """
+
+    @abstractmethod
+    def clear(self):
+        """
+        Vacía el carrito en la transacción actual; la confirma quien llama (checkout).
+        """
+
+    def forget(self):
+        """
+        Descarta el estado del carrito fuera de la base de datos una vez confirmado clear().
+        """
+
+
+class DatabaseCart(BaseCart):
+    """
+    Carrito guardado directamente en CartItem: cada cambio se confirma en la base de datos.
+    """
+
+    def __init__(self, user_id, app_config):
+        super().__init__(user_id, app_config)
+        self.items = self._load_rows()
+        self.saved = dict(self.items)
+
+    def save(self):
+        """
+        Escribe en CartItem solo los productos cuya cantidad ha cambiado y confirma.
+
+        Las filas cambiadas se sustituyen con un DELETE y un INSERT de varias filas, de modo
+        que un lote de operaciones no genera una sentencia por producto.
+        """
+        changed = {product_id for product_id in set(self.items) | set(self.saved)
+                   if self.items.get(product_id) != self.saved.get(product_id)}
+        if not changed:
+            return
+        CartItem.query.filter(CartItem.user_id == self.user_id, CartItem.product_id.in_(changed)) \
+            .delete(synchronize_session=False)
+        rows = [{'user_id': self.user_id, 'product_id': product_id, 'quantity': self.items[product_id]}
+                for product_id in changed if product_id in self.items]
+        if rows:
+            db.session.execute(db.insert(CartItem), rows)
+        db.session.commit()
+        self.saved = dict(self.items)
+
+    def clear(self):
+        """
+        Vacía el carrito en la transacción actual; la confirma quien llama (checkout).
+        """
+        CartItem.query.filter_by(user_id=self.user_id).delete()
+        self.items = {}
+        self.saved = {}
+
+
+class SessionCart(BaseCart):
+    """
+    Carrito guardado en la cookie de sesión firmada, sin escrituras en la base de datos por
+    cada cambio.
+
+    Se carga de CartItem la primera vez que el usuario lo usa en la sesión y se vuelca a
+    CartItem como mucho una vez cada CART_FLUSH_SECONDS mientras cambia, al cerrar la sesión
+    y al finalizar la compra, de modo que se conserva entre dispositivos. Al viajar en la
+    cookie sirve con varios workers sin caché compartida.
+    """
+
+    def __init__(self, user_id, app_config):
+        super().__init__(user_id, app_config)
+        self.flush_seconds = app_config['CART_FLUSH_SECONDS']
+        data = session.get(SESSION_KEY)
+        if data is not None and data.get('user_id') == user_id:
+            self.items = {int(product_id): quantity for product_id, quantity in data['items'].items()}
+            self.dirty = data['dirty']
+            self.flushed_at = data['flushed_at']
+        else:
+            self.items = self._load_rows()
+            self.dirty = False
+            self.flushed_at = time.time()
+        self.loaded = dict(self.items)
+
+    def save(self):
+        """
+        Guarda el carrito en la sesión y lo vuelca a CartItem si ha pasado el intervalo.
+        """
+        if self.items != self.loaded:
+            self.dirty = True
+        if self.dirty and time.time() - self.flushed_at >= self.flush_seconds:
+            self.flush()
+        self._store()
+
+    def flush(self):
+        """
+        Vuelca el carrito a CartItem y confirma.
+        """
+        self._replace_rows()
+        db.session.commit()
+        self.dirty = False
+        self.flushed_at = time.time()
+
+    def clear(self):
+        """
+        Vacía el carrito borrando sus filas CartItem en la transacción actual (la confirma quien
+        llama). La copia de la sesión se conserva hasta forget(), de modo que si la transacción
+        falla el usuario no pierde el carrito.
+        """
+        CartItem.query.filter_by(user_id=self.user_id).delete()
+        self.items = {}
+        self.dirty = False
+        self.flushed_at = time.time()
+
+    def forget(self):
+        """
+        Deja de guardar el carrito en la sesión; se llama tras confirmar clear().
+        """
+        session.pop(SESSION_KEY, None)
+
+    def _store(self):
+        session[SESSION_KEY] = {
+            'user_id': self.user_id,
+            'items': {str(product_id): quantity for product_id, quantity in self.items.items()},
+            'dirty': self.dirty,
+            'flushed_at': self.flushed_at
+        }
+        self.loaded = dict(self.items)
+
+
+CART_STORES = {
+    'database': DatabaseCart,
+    'session': SessionCart
+}
+
+
+def current_cart():
+    """
+    Devuelve el carrito del usuario actual con el almacén indicado en CART_STORE ('session',
+    'database' o ruta 'modulo.Clase'); se crea una vez por petición.
+    """
+    if 'cart' not in g:
+        store = current_app.config['CART_STORE']
+        cart_class = CART_STORES[store] if store in CART_STORES else import_string(store)
+        g.cart = cart_class(current_user.id, current_app.config)
+    return g.cart
+
+
+@user_logged_out.connect
+def _flush_cart_on_logout(sender, user, **extra):
+    """
+    Vuelca a CartItem el carrito de sesión pendiente antes de cerrar la sesión.
+    """
+    data = session.get(SESSION_KEY)
+    if data is not None and data.get('user_id') == user.id and data['dirty']:
+        SessionCart(user.id, current_app.config).flush()
+    session.pop(SESSION_KEY, None)
@@ -0,0 +1,217 @@
+import sqlite3
+from datetime import datetime
+import click
+from extensions import db
+from db_routing import REPLICA_BIND_KEY
+from database import upgrade_schema
+from summaries import find_product_counter_drift, rebuild_product_counters, rebuild_user_summaries
+from analytics_export import export_sales, ExportInProgress
+from archive import archive_all
+from forecasting import update_forecasts
+from supplier_scores import update_supplier_scores
+from inventory_snapshots import take_snapshot
+from stock_ledger import find_stock_drift, adjust_stock_drift, create_checkpoints
+from jobs import registry, run_job
+
+
+def init_commands(app):
+    """
+    Registra los comandos de línea de órdenes (flask <comando>) de la aplicación.
+
+    Args:
+        app (Flask): La instancia de la aplicación Flask.
+    """
+    @app.cli.command('init-db')
+    @click.option('--drop', is_flag=True, help='Elimina las tablas existentes antes de crearlas.')
+    def init_db(drop):
+        """
+        Crea las tablas de la base de datos.
+
+        Sustituye a la creación automática del esquema en cada arranque de la aplicación.
+        """
+        if drop:
+            db.drop_all()
+        db.create_all()
+        click.echo('Esquema de la base de datos creado.')
+
+    @app.cli.command('upgrade-db')
+    def upgrade_db():
+        """
+        Actualiza el esquema de una base de datos creada con una versión anterior.
+
+        Crea las tablas nuevas, añade las columnas y los índices que falten a las existentes y,
+        si se acaban de añadir los contadores de ventas de Product, los calcula.
+        """
+        added = upgrade_schema()
+        for name in added['columns']:
+            click.echo(f'Columna añadida: {name}')
+        for name in added['indexes']:
+            click.echo(f'Índice creado: {name}')
+        if 'product.units_sold' in added['columns'] or 'product.revenue' in added['columns']:
+            updated = rebuild_product_counters()
+            click.echo(f'Contadores de ventas calculados para {updated} productos.')
+        click.echo('Esquema de la base de datos actualizado.')
+
+    @app.cli.command('sync-replica')
+    def sync_replica():
+        """
+        Copia la base de datos primaria SQLite sobre la réplica de solo lectura.
+
+        Permite probar en local el enrutado de lecturas con dos ficheros SQLite; con un
+        servidor de base de datos real la réplica la mantiene la replicación del servidor.
+        """
+        engines = db.engines
+        if REPLICA_BIND_KEY not in engines:
+            raise click.ClickException('No hay réplica configurada (REPLICA_DATABASE_URL).')
+        primary, replica = engines[None], engines[REPLICA_BIND_KEY]
+        if primary.dialect.name != 'sqlite' or replica.dialect.name != 'sqlite':
+            raise click.ClickException('sync-replica solo está disponible para SQLite.')
+
+        source = sqlite3.connect(primary.url.database)
+        target = sqlite3.connect(replica.url.database)
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
+        click.echo('Réplica sincronizada con el primario.')
+
+    @app.cli.command('sales-counters')
+    @click.option('--rebuild', is_flag=True, help='Recalcula los contadores a partir de SaleItem.')
+    def sales_counters(rebuild):
+        """
+        Verifica (o reconstruye) los contadores de ventas acumulados de los productos.
+
+        Sin opciones informa de los productos cuyos contadores no coinciden con SaleItem y
+        termina con código de salida 1 si hay diferencias.
+        """
+        if rebuild:
+            updated = rebuild_product_counters()
+            click.echo(f'Contadores de ventas recalculados para {updated} productos.')
+            return
+
+        drift = find_product_counter_drift()
+        for product_id, stored, expected in drift:
+            click.echo(f'Producto {product_id}: almacenado {stored}, real {expected}')
+        if drift:
+            raise click.ClickException(f'{len(drift)} productos con contadores desalineados.')
+        click.echo('Contadores de ventas correctos.')
+
+    @app.cli.command('user-summaries')
+    def user_summaries():
+        """
+        Recalcula los resúmenes de compras por usuario (gasto diario y productos comprados).
+
+        Necesario una vez tras actualizar una base de datos existente; después el checkout
+        los mantiene de forma incremental.
+        """
+        daily, products = rebuild_user_summaries()
+        click.echo(f'Resúmenes regenerados: {daily} días de gasto, {products} productos por usuario.')
+
+    @app.cli.command('export-sales')
+    @click.option('--full', is_flag=True, help='Reexporta todo el histórico ignorando la marca de agua.')
+    @click.option('--output', default=None, help='Directorio de destino (por defecto EXPORT_DIR).')
+    def export_sales_command(full, output):
+        """
+        Exporta el histórico de ventas a ficheros Parquet particionados por mes.
+
+        Cada ejecución añade solo las ventas nuevas desde la anterior exportación.
+        """
+        try:
+            result = export_sales(output or app.config['EXPORT_DIR'], app.config['EXPORT_BATCH_SIZE'], full=full)
+        except (ExportInProgress, RuntimeError) as e:
+            raise click.ClickException(str(e))
+        click.echo(f"{result['rows']} filas exportadas en {len(result['files'])} ficheros "
+                   f"(marca de agua: {result['high_water_mark']}).")
+
+    @app.cli.command('archive-history')
+    @click.option('--before', default=None, help='Archiva lo anterior a esta fecha (AAAA-MM-DD) en lugar de '
+                                                  'los meses cerrados de hace ARCHIVE_AFTER_DAYS días.')
+    def archive_history_command(before):
+        """
+        Mueve por lotes las ventas y pedidos antiguos a las tablas de archivo.
+        """
+        try:
+            cutoff = datetime.strptime(before, '%Y-%m-%d') if before else None
+        except ValueError:
+            raise click.ClickException('Fecha inválida: usa el formato AAAA-MM-DD.')
+        result = archive_all(cutoff)
+        click.echo(f"Archivado anterior a {result['cutoff']}: "
+                   f"{result['sales']['headers']} ventas ({result['sales']['items']} líneas), "
+                   f"{result['purchases']['headers']} pedidos ({result['purchases']['items']} líneas).")
+
+    @app.cli.command('forecasts')
+    @click.option('--refit', is_flag=True, help='Reajusta todos los modelos desde cero.')
+    def forecasts(refit):
+        """
+        Actualiza los pronósticos de demanda con las ventas de los días nuevos.
+        """
+        result = update_forecasts(refit=refit)
+        click.echo(f"Pronósticos: {result['fitted']} productos ajustados, {result['updated']} actualizados.")
+
+    @app.cli.command('supplier-scores')
+    @click.option('--rebuild', is_flag=True, help='Recalcula los resúmenes desde el principio.')
+    def supplier_scores(rebuild):
+        """
+        Actualiza las puntuaciones de proveedores con los pedidos y ventas nuevos.
+        """
+        result = update_supplier_scores(rebuild=rebuild)
+        click.echo(f"Proveedores puntuados: {result['suppliers']} ({result['purchases']} pedidos nuevos).")
+
+    @app.cli.command('inventory-snapshot')
+    def inventory_snapshot():
+        """
+        Guarda la foto del inventario del día (si no se ha tomado ya).
+        """
+        result = take_snapshot()
+        if result is None:
+            click.echo('La foto del inventario de hoy ya existe.')
+            return
+        click.echo(f"Foto del {result['day']}: {result['products']} productos con cambios, {result['categories']} categorías.")
+
+    @app.cli.command('stock-reconcile')
+    @click.option('--adjust', is_flag=True, help='Anota ajustes para que el registro coincida con el stock.')
+    def stock_reconcile(adjust):
+        """
+        Verifica el stock de todos los productos frente al registro de movimientos.
+
+        Sin opciones informa de las diferencias y termina con código de salida 1 si las hay.
+        Con --adjust anota un movimiento de ajuste por producto; en una base de datos
+        existente abre así el registro con el stock actual.
+        """
+        if adjust:
+            adjusted = adjust_stock_drift()
+            click.echo(f'Movimientos de ajuste anotados para {adjusted} productos.')
+            return
+
+        drift = find_stock_drift()
+        for product_id, stock, ledger in drift:
+            click.echo(f'Producto {product_id}: stock {stock}, registro {ledger}')
+        if drift:
+            raise click.ClickException(f'{len(drift)} productos con stock distinto del registro.')
+        click.echo('El stock coincide con el registro de movimientos.')
+
+    @app.cli.command('stock-checkpoints')
+    def stock_checkpoints():
+        """
+        Crea los puntos de control del registro de stock.
+        """
+        click.echo(f'{create_checkpoints()} puntos de control creados.')
+
+    @app.cli.command('run-job')
+    @click.argument('name', required=False)
+    def run_job_command(name):
+        """
+        Ejecuta una tarea periódica por su nombre (sin nombre, lista las disponibles).
+
+        Pensado para programarse desde cron cuando el planificador interno está desactivado.
+        """
+        if name is None:
+            for registered in registry.values():
+                when = f'cada día a las {registered.hour}:00 UTC' if registered.hour is not None \
+                    else f'cada {registered.interval} s'
+                click.echo(f'{registered.name}: {when}')
+            return
+        if name not in registry:
+            raise click.ClickException(f'Tarea desconocida: {name}')
+        click.echo(f'Resultado: {run_job(app, name)}')
@@ -0,0 +1,304 @@
+import os
+from sqlalchemy.engine import make_url
+
+
+def _env_bool(name, default):
+    """
+    Lee una variable de entorno booleana ('1', 'true', 'yes', 'on' se consideran verdaderos).
+    """
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def _env_int(name, default):
+    """
+    Lee una variable de entorno entera, devolviendo el valor por defecto si no está definida.
+    """
+    value = os.environ.get(name)
+    return int(value) if value not in (None, '') else default
+
+
+class Config:
+    """
+    Configuración base compartida por todos los entornos.
+
+    Todos los valores pueden sobrescribirse mediante variables de entorno con el mismo nombre,
+    de modo que los workers se ajustan sin necesidad de editar el código.
+    """
+    DEBUG = False
+    TESTING = False
+    SECRET_KEY = os.environ.get('SECRET_KEY', 'una_clave_secreta_muy_segura')
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'sqlite:///suministros.db')
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    ITEMS_PER_PAGE = 10
+
+    # Creación del esquema: en producción se realiza con "flask init-db" y no en cada arranque
+    AUTO_CREATE_SCHEMA = _env_bool('AUTO_CREATE_SCHEMA', False)
+
+    # Configuración del motor de base de datos
+    DB_POOL_SIZE = _env_int('DB_POOL_SIZE', 5)
+    DB_MAX_OVERFLOW = _env_int('DB_MAX_OVERFLOW', 10)
+    DB_POOL_TIMEOUT = _env_int('DB_POOL_TIMEOUT', 30)
+    DB_POOL_RECYCLE = _env_int('DB_POOL_RECYCLE', 1800)
+    DB_POOL_PRE_PING = _env_bool('DB_POOL_PRE_PING', True)
+    DB_STATEMENT_TIMEOUT_MS = _env_int('DB_STATEMENT_TIMEOUT_MS', 30000)
+
+    # Réplica de solo lectura: si se define, los endpoints de solo lectura consultan este bind
+    REPLICA_DATABASE_URL = os.environ.get('REPLICA_DATABASE_URL')
+    # Segundos durante los que un cliente lee del primario tras escribir (retraso de replicación)
+    DB_READ_YOUR_WRITES_SECONDS = _env_int('DB_READ_YOUR_WRITES_SECONDS', 5)
+
+    # PRAGMAs aplicados a cada conexión SQLite nueva
+    SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')
+    SQLITE_BUSY_TIMEOUT_MS = _env_int('SQLITE_BUSY_TIMEOUT_MS', 5000)
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+    SQLITE_CACHE_SIZE_KB = _env_int('SQLITE_CACHE_SIZE_KB', 64 * 1024)
+    SQLITE_MMAP_SIZE = _env_int('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)
+
+    # Eventos del dashboard (Server-Sent Events)
+    EVENTS_BACKEND = os.environ.get('EVENTS_BACKEND', 'local')
+    EVENTS_QUEUE_SIZE = _env_int('EVENTS_QUEUE_SIZE', 100)
+    SSE_HEARTBEAT_SECONDS = _env_int('SSE_HEARTBEAT_SECONDS', 15)
+    # Cada conexión SSE ocupa un hilo: máximo de conexiones abiertas por proceso y duración
+    # máxima de cada una antes de que el navegador reconecte
+    SSE_MAX_CONNECTIONS = _env_int('SSE_MAX_CONNECTIONS', 50)
+    SSE_MAX_SECONDS = _env_int('SSE_MAX_SECONDS', 300)
+
+    # Caché LRU de fragmentos de plantilla ({% cache %})
+    FRAGMENT_CACHE_ENABLED = _env_bool('FRAGMENT_CACHE_ENABLED', True)
+    FRAGMENT_CACHE_SIZE = _env_int('FRAGMENT_CACHE_SIZE', 2000)
+
+    # Compresión gzip/brotli de las respuestas JSON
+    COMPRESS_ENABLED = _env_bool('COMPRESS_ENABLED', True)
+    COMPRESS_LEVEL = _env_int('COMPRESS_LEVEL', 6)
+    COMPRESS_MIN_SIZE = _env_int('COMPRESS_MIN_SIZE', 1024)
+    COMPRESS_MIMETYPES = ('application/json',)
+    # Filas leídas por lote al generar respuestas en streaming
+    STREAM_BATCH_SIZE = _env_int('STREAM_BATCH_SIZE', 500)
+
+    # Exportación columnar (Parquet) del histórico de ventas para analítica
+    EXPORT_DIR = os.environ.get('EXPORT_DIR', 'exports')
+    EXPORT_BATCH_SIZE = _env_int('EXPORT_BATCH_SIZE', 50000)
+
+    # Tareas periódicas (pronósticos, resúmenes...): planificador en segundo plano
+    JOBS_SCHEDULER_ENABLED = _env_bool('JOBS_SCHEDULER_ENABLED', False)
+    JOBS_POLL_SECONDS = _env_int('JOBS_POLL_SECONDS', 60)
+
+    # Pronóstico de demanda por producto
+    FORECAST_HISTORY_DAYS = _env_int('FORECAST_HISTORY_DAYS', 365)
+    FORECAST_HORIZON_DAYS = _env_int('FORECAST_HORIZON_DAYS', 14)
+    FORECAST_PARALLEL_MIN_PRODUCTS = _env_int('FORECAST_PARALLEL_MIN_PRODUCTS', 5000)
+    FORECAST_WORKERS = _env_int('FORECAST_WORKERS', 0)  # 0: tantos procesos como CPUs
+
+    # Hashing de contraseñas (método de werkzeug: 'pbkdf2:<hash>:<iteraciones>'). Al cambiar
+    # el método o el coste, los hashes existentes se regeneran en el siguiente login
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:260000')
+    PASSWORD_SALT_LENGTH = _env_int('PASSWORD_SALT_LENGTH', 16)
+    PASSWORD_HASH_WORKERS = _env_int('PASSWORD_HASH_WORKERS', max((os.cpu_count() or 2) // 2, 1))
+    PASSWORD_HASH_MAX_QUEUE = _env_int('PASSWORD_HASH_MAX_QUEUE', 64)
+    PASSWORD_HASH_QUEUE_TIMEOUT = _env_int('PASSWORD_HASH_QUEUE_TIMEOUT', 10)
+
+    # Caché de identidad del usuario autenticado (user_loader de Flask-Login)
+    IDENTITY_CACHE_ENABLED = _env_bool('IDENTITY_CACHE_ENABLED', True)
+    IDENTITY_CACHE_SIZE = _env_int('IDENTITY_CACHE_SIZE', 1000)
+    IDENTITY_CACHE_TTL = _env_int('IDENTITY_CACHE_TTL', 60)
+    # Credenciales firmadas en la cookie de sesión: autentican sin consultar la base de datos,
+    # pero un cambio de permisos hecho desde otra sesión tarda hasta IDENTITY_CLAIMS_TTL en aplicarse
+    IDENTITY_SESSION_CLAIMS = _env_bool('IDENTITY_SESSION_CLAIMS', False)
+    IDENTITY_CLAIMS_TTL = _env_int('IDENTITY_CLAIMS_TTL', 300)
+
+    # Limitación de peticiones con cubetas de tokens: 'N/segundos' permite ráfagas de N peticiones
+    # y las repone a lo largo de ese periodo. Backend 'local' (memoria de cada proceso) o 'modulo.Clase'
+    RATE_LIMIT_ENABLED = _env_bool('RATE_LIMIT_ENABLED', True)
+    RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'local')
+    RATE_LIMIT_MAX_KEYS = _env_int('RATE_LIMIT_MAX_KEYS', 100000)
+    RATE_LIMITS = {
+        'login:ip': os.environ.get('RATE_LIMIT_LOGIN_IP', '20/60'),
+        # Solo cuentan los intentos de login fallidos
+        'login:username': os.environ.get('RATE_LIMIT_LOGIN_USERNAME', '5/60'),
+        'register:ip': os.environ.get('RATE_LIMIT_REGISTER_IP', '5/600'),
+        'cart:user': os.environ.get('RATE_LIMIT_CART_USER', '120/60'),
+        'cart:ip': os.environ.get('RATE_LIMIT_CART_IP', '300/60'),
+        'checkout:user': os.environ.get('RATE_LIMIT_CHECKOUT_USER', '10/60'),
+    }
+
+    # Almacén del carrito: 'session' (cookie de sesión, volcado a CartItem cada CART_FLUSH_SECONDS
+    # mientras cambia, al cerrar sesión y en el checkout), 'database' (CartItem en cada cambio)
+    # o ruta 'modulo.Clase'
+    CART_STORE = os.environ.get('CART_STORE', 'session')
+    CART_FLUSH_SECONDS = _env_int('CART_FLUSH_SECONDS', 300)
+    # Productos distintos por carrito (limita el tamaño de la cookie de sesión)
+    CART_MAX_LINES = _env_int('CART_MAX_LINES', 50)
+    # Operaciones admitidas en una petición a /api/cart/batch
+    CART_BATCH_MAX_OPERATIONS = _env_int('CART_BATCH_MAX_OPERATIONS', 100)
+
+    # Tiempo durante el que se guarda la respuesta de una petición con clave de idempotencia
+    # (checkout, notify_supplier) para devolverla en los reintentos
+    IDEMPOTENCY_WINDOW_SECONDS = _env_int('IDEMPOTENCY_WINDOW_SECONDS', 24 * 3600)
+    # Segundos que una petición puede tener reservada su clave sin guardar la respuesta; debe
+    # superar la duración máxima de un checkout
+    IDEMPOTENCY_PROCESSING_TIMEOUT = _env_int('IDEMPOTENCY_PROCESSING_TIMEOUT', 300)
+
+    # Archivo del histórico: las ventas y pedidos anteriores al mes de hace ARCHIVE_AFTER_DAYS días
+    # se mueven por lotes a tablas de archivo desnormalizadas del bind 'archive', que por defecto
+    # está en la base de datos principal (en SQLite conviene indicar un fichero propio)
+    ARCHIVE_DATABASE_URL = os.environ.get('ARCHIVE_DATABASE_URL')
+    ARCHIVE_AFTER_DAYS = _env_int('ARCHIVE_AFTER_DAYS', 730)
+    ARCHIVE_BATCH_SIZE = _env_int('ARCHIVE_BATCH_SIZE', 500)
+
+    # Retención del historial de pedidos a proveedores (tarea purchase-retention): los pedidos
+    # anteriores a PURCHASE_RETENTION_DAYS días se archivan ('archive') o se borran ('delete') y
+    # las líneas archivadas se borran pasados PURCHASE_ARCHIVE_RETENTION_DAYS días. 0 desactiva la ventana
+    PURCHASE_RETENTION_DAYS = _env_int('PURCHASE_RETENTION_DAYS', 0)
+    PURCHASE_RETENTION_MODE = os.environ.get('PURCHASE_RETENTION_MODE', 'archive')
+    PURCHASE_ARCHIVE_RETENTION_DAYS = _env_int('PURCHASE_ARCHIVE_RETENTION_DAYS', 0)
+
+    # Configuración de Flask-Mail
+    # Nota: Estos valores deben ser reemplazados con la configuración real del servidor SMTP
+    MAIL_SERVER = os.environ.get('MAIL_SERVER', 'smtp.example.com')
+    MAIL_PORT = _env_int('MAIL_PORT', 587)
+    MAIL_USE_TLS = _env_bool('MAIL_USE_TLS', True)
+    MAIL_USERNAME = os.environ.get('MAIL_USERNAME', 'your-email@example.com')
+    MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD', 'your-password')
+
+    # Configuración del sistema de logging
+    LOG_DIR = os.environ.get('LOG_DIR', 'logs')
+    LOG_FILE = os.environ.get('LOG_FILE', 'app.log')
+    LOG_MAX_BYTES = _env_int('LOG_MAX_BYTES', 10 * 1024 * 1024)
+    LOG_BACKUP_COUNT = _env_int('LOG_BACKUP_COUNT', 10)
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+    LOG_TO_STDOUT = _env_bool('LOG_TO_STDOUT', False)
+
+    @staticmethod
+    def init_app(app):
+        """
+        Permite a cada entorno validar o completar la configuración una vez cargada.
+        """
+
+
+class DevelopmentConfig(Config):
+    """
+    Configuración para desarrollo local: modo debug y creación automática del esquema.
+    """
+    DEBUG = True
+    AUTO_CREATE_SCHEMA = _env_bool('AUTO_CREATE_SCHEMA', True)
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'DEBUG')
+
+
+class TestingConfig(Config):
+    """
+    Configuración para pruebas: base de datos en memoria, sin CSRF y sin fichero de log.
+    """
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = os.environ.get('TEST_DATABASE_URL', 'sqlite://')
+    WTF_CSRF_ENABLED = False
+    AUTO_CREATE_SCHEMA = True
+    LOG_FILE = None
+    # Hashes baratos para que las pruebas no dependan del coste de producción
+    PASSWORD_HASH_METHOD = 'pbkdf2:sha256:1000'
+    # Las pruebas hacen muchas peticiones desde la misma IP
+    RATE_LIMIT_ENABLED = False
+
+
+class ProductionConfig(Config):
+    """
+    Configuración para producción: sin debug, pool más amplio y logs rotados de mayor tamaño.
+    """
+    DB_POOL_SIZE = _env_int('DB_POOL_SIZE', 10)
+    DB_MAX_OVERFLOW = _env_int('DB_MAX_OVERFLOW', 20)
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'WARNING')
+
+    @staticmethod
+    def init_app(app):
+        """
+        Impide arrancar en producción con la clave secreta de ejemplo.
+        """
+        if app.config['SECRET_KEY'] == 'una_clave_secreta_muy_segura':
+            raise RuntimeError('Define la variable de entorno SECRET_KEY antes de arrancar en producción')
+
+
+config = {
+    'development': DevelopmentConfig,
+    'testing': TestingConfig,
+    'production': ProductionConfig,
+    'default': DevelopmentConfig
+}
+
+
+def get_config(config_name=None):
+    """
+    Devuelve la clase de configuración para el entorno indicado.
+
+    Args:
+        config_name (str, optional): Nombre del entorno. Si no se indica se usa la variable
+            de entorno APP_CONFIG y, en su defecto, 'default'.
+
+    Returns:
+        type: La clase de configuración correspondiente.
+    """
+    config_name = config_name or os.environ.get('APP_CONFIG', 'default')
+    if config_name not in config:
+        raise ValueError(f"Configuración desconocida: {config_name}")
+    return config[config_name]
+
+
+def build_engine_options(app_config, uri=None):
+    """
+    Construye SQLALCHEMY_ENGINE_OPTIONS a partir de los valores DB_* de la configuración.
+
+    Args:
+        app_config (dict): La configuración de la aplicación.
+        uri (str, optional): URI del motor. Por defecto SQLALCHEMY_DATABASE_URI.
+
+    Returns:
+        dict: Opciones para create_engine.
+    """
+    url = make_url(uri or app_config['SQLALCHEMY_DATABASE_URI'])
+    options = {'pool_pre_ping': app_config['DB_POOL_PRE_PING']}
+    connect_args = {}
+    timeout_ms = app_config['DB_STATEMENT_TIMEOUT_MS']
+
+    if url.get_backend_name() == 'sqlite':
+        # Las bases de datos en memoria usan StaticPool, que no admite dimensionado
+        if url.database not in (None, '', ':memory:'):
+            options['pool_size'] = app_config['DB_POOL_SIZE']
+            options['max_overflow'] = app_config['DB_MAX_OVERFLOW']
+            options['pool_timeout'] = app_config['DB_POOL_TIMEOUT']
+        return options
+
+    options['pool_size'] = app_config['DB_POOL_SIZE']
+    options['max_overflow'] = app_config['DB_MAX_OVERFLOW']
+    options['pool_timeout'] = app_config['DB_POOL_TIMEOUT']
+    options['pool_recycle'] = app_config['DB_POOL_RECYCLE']
+
+    if timeout_ms:
+        if url.get_backend_name() == 'postgresql':
+            connect_args['options'] = f"-c statement_timeout={timeout_ms}"
+        elif url.get_backend_name() == 'mysql':
+            connect_args['init_command'] = f"SET SESSION max_execution_time={timeout_ms}"
+    if connect_args:
+        options['connect_args'] = connect_args
+    return options
+
+
+def build_binds(app_config):
+    """
+    Construye SQLALCHEMY_BINDS con los motores adicionales configurados (réplica de lectura y
+    archivo del histórico, que sin ARCHIVE_DATABASE_URL usa la base de datos principal).
+
+    Args:
+        app_config (dict): La configuración de la aplicación.
+
+    Returns:
+        dict: Binds con la URL y las opciones de cada motor.
+    """
+    binds = dict(app_config.get('SQLALCHEMY_BINDS') or {})
+    replica_url = app_config.get('REPLICA_DATABASE_URL')
+    if replica_url and 'replica' not in binds:
+        binds['replica'] = dict(build_engine_options(app_config, replica_url), url=replica_url)
+    archive_url = app_config.get('ARCHIVE_DATABASE_URL') or app_config['SQLALCHEMY_DATABASE_URI']
+    if 'archive' not in binds:
+        binds['archive'] = dict(build_engine_options(app_config, archive_url), url=archive_url)
+    return binds
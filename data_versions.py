@@ -0,0 +1,131 @@
+from sqlalchemy import event, update
+from sqlalchemy.exc import IntegrityError
+from extensions import db
+from models import (User, Product, Supplier, Category, Sale, SaleItem, Purchase, PurchaseItem,
+                    UserDailySpend, UserProductSummary, DataVersion)
+
+# Ámbito de datos al que pertenece cada modelo
+MODEL_SCOPES = {
+    Product: 'catalog',
+    Supplier: 'catalog',
+    Category: 'catalog',
+    Sale: 'sales',
+    SaleItem: 'sales',
+    UserDailySpend: 'sales',
+    UserProductSummary: 'sales',
+    Purchase: 'purchases',
+    PurchaseItem: 'purchases',
+    User: 'users'
+}
+
+
+def _scope_of(obj_or_class):
+    """
+    Devuelve el ámbito de datos de una instancia o clase, o None si no se versiona.
+    """
+    cls = obj_or_class if isinstance(obj_or_class, type) else type(obj_or_class)
+    return MODEL_SCOPES.get(cls)
+
+
+def bump(connection, scopes):
+    """
+    Incrementa la versión de los ámbitos indicados en la transacción de la conexión.
+
+    Args:
+        connection (Connection): Conexión con una transacción abierta.
+        scopes (iterable): Nombres de los ámbitos modificados.
+    """
+    table = DataVersion.__table__
+    for scope in sorted(set(scopes)):
+        result = connection.execute(
+            update(table).where(table.c.name == scope).values(version=table.c.version + 1)
+        )
+        if result.rowcount == 0:
+            savepoint = connection.begin_nested()
+            try:
+                connection.execute(table.insert().values(name=scope, version=1))
+                savepoint.commit()
+            except IntegrityError:
+                # Otro proceso creó la fila a la vez: basta con incrementarla
+                savepoint.rollback()
+                connection.execute(
+                    update(table).where(table.c.name == scope).values(version=table.c.version + 1)
+                )
+
+
+def get_versions(*scopes):
+    """
+    Devuelve la versión actual de cada ámbito con una sola consulta.
+
+    Args:
+        *scopes (str): Nombres de los ámbitos.
+
+    Returns:
+        dict: {ámbito: versión}; los ámbitos nunca modificados tienen versión 0.
+    """
+    rows = db.session.query(DataVersion.name, DataVersion.version).filter(DataVersion.name.in_(scopes)).all()
+    versions = dict.fromkeys(scopes, 0)
+    versions.update(rows)
+    return versions
+
+
+# Clave de session.info con los ámbitos modificados en la transacción en curso
+PENDING_SCOPES = 'data_version_scopes'
+
+
+def _mark(session, scopes):
+    """
+    Anota en la sesión los ámbitos modificados para incrementarlos al confirmar.
+    """
+    session.info.setdefault(PENDING_SCOPES, set()).update(scopes)
+
+
+@event.listens_for(db.session, 'before_flush')
+def _mark_flushed_scopes(session, flush_context, instances):
+    """
+    Anota los ámbitos con objetos nuevos, modificados o borrados en el flush.
+    """
+    scopes = {_scope_of(obj) for obj in list(session.new) + list(session.deleted)}
+    scopes |= {_scope_of(obj) for obj in session.dirty if session.is_modified(obj)}
+    scopes.discard(None)
+    if scopes:
+        _mark(session, scopes)
+
+
+@event.listens_for(db.session, 'do_orm_execute')
+def _mark_bulk_scopes(orm_execute_state):
+    """
+    Anota el ámbito afectado por sentencias masivas (INSERT/UPDATE/DELETE ejecutadas con
+    session.execute o query.update() / query.delete()), que no pasan por el flush.
+    """
+    if not (orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    mapper = orm_execute_state.bind_mapper
+    scope = _scope_of(mapper.class_) if mapper is not None else None
+    if scope:
+        _mark(orm_execute_state.session, [scope])
+
+
+@event.listens_for(db.session, 'after_commit')
+def _bump_committed_scopes(session):
+    """
+    Incrementa la versión de los ámbitos modificados una vez confirmada la transacción.
+
+    El UPDATE de las filas de versión va en una transacción propia para que no bloquee las
+    escrituras concurrentes durante toda la transacción de negocio. Un lector que llegue entre
+    la confirmación y el incremento verá datos nuevos con la versión anterior, que se invalida
+    en cuanto termina el incremento; nunca datos antiguos con la versión nueva.
+    """
+    scopes = session.info.pop(PENDING_SCOPES, None)
+    if scopes:
+        with db.engine.begin() as connection:
+            bump(connection, scopes)
+
+
+@event.listens_for(db.session, 'after_transaction_end')
+def _discard_scopes(session, transaction):
+    """
+    Descarta los ámbitos anotados si la transacción principal termina sin confirmarse.
+    """
+    if transaction.parent is None:
+        session.info.pop(PENDING_SCOPES, None)
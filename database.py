@@ -0,0 +1,125 @@
+from sqlalchemy import event, inspect, text
+from sqlalchemy.schema import CreateColumn
+from extensions import db
+
+SQLITE_JOURNAL_MODES = {'DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF'}
+SQLITE_SYNCHRONOUS_MODES = {'OFF', 'NORMAL', 'FULL', 'EXTRA'}
+
+
+def sqlite_pragmas(app_config):
+    """
+    Devuelve la lista de PRAGMAs a ejecutar en cada conexión SQLite según la configuración.
+
+    Un valor vacío o None en la configuración deja el PRAGMA con el valor por defecto de SQLite.
+
+    Args:
+        app_config (dict): La configuración de la aplicación.
+
+    Returns:
+        list: Pares (nombre, valor) en el orden en que deben aplicarse.
+
+    Raises:
+        ValueError: Si el modo de journal o de sincronización no es válido.
+    """
+    pragmas = []
+
+    journal_mode = app_config.get('SQLITE_JOURNAL_MODE')
+    if journal_mode:
+        if journal_mode.upper() not in SQLITE_JOURNAL_MODES:
+            raise ValueError(f"SQLITE_JOURNAL_MODE inválido: {journal_mode}")
+        pragmas.append(('journal_mode', journal_mode.upper()))
+
+    # busy_timeout debe ir antes que el resto para que las esperas por bloqueo se respeten
+    if app_config.get('SQLITE_BUSY_TIMEOUT_MS') is not None:
+        pragmas.insert(0, ('busy_timeout', int(app_config['SQLITE_BUSY_TIMEOUT_MS'])))
+
+    synchronous = app_config.get('SQLITE_SYNCHRONOUS')
+    if synchronous:
+        if synchronous.upper() not in SQLITE_SYNCHRONOUS_MODES:
+            raise ValueError(f"SQLITE_SYNCHRONOUS inválido: {synchronous}")
+        pragmas.append(('synchronous', synchronous.upper()))
+
+    # Un cache_size negativo se interpreta en KiB en lugar de en páginas
+    if app_config.get('SQLITE_CACHE_SIZE_KB'):
+        pragmas.append(('cache_size', -int(app_config['SQLITE_CACHE_SIZE_KB'])))
+
+    if app_config.get('SQLITE_MMAP_SIZE') is not None:
+        pragmas.append(('mmap_size', int(app_config['SQLITE_MMAP_SIZE'])))
+
+    return pragmas
+
+
+def sqlite_pragma_listener(pragmas):
+    """
+    Crea un listener para el evento 'connect' que aplica los PRAGMAs indicados.
+
+    Args:
+        pragmas (list): Pares (nombre, valor) devueltos por sqlite_pragmas().
+
+    Returns:
+        callable: Función compatible con event.listen(engine, 'connect', ...).
+    """
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas:
+                cursor.execute(f"PRAGMA {name}={value}")
+        finally:
+            cursor.close()
+
+    return set_sqlite_pragmas
+
+
+def init_engine_events(app):
+    """
+    Registra los eventos de conexión de los motores de base de datos de la aplicación.
+
+    Para SQLite aplica los PRAGMAs configurados (WAL, busy_timeout, synchronous, cache_size
+    y mmap_size) en cada conexión nueva del pool, de modo que los lectores no se bloqueen
+    detrás de los escritores y las esperas por bloqueo no terminen en "database is locked".
+
+    Args:
+        app (Flask): La instancia de la aplicación Flask.
+    """
+    pragmas = sqlite_pragmas(app.config)
+    if not pragmas:
+        return
+
+    listener = sqlite_pragma_listener(pragmas)
+    with app.app_context():
+        for engine in db.engines.values():
+            if engine.dialect.name == 'sqlite':
+                event.listen(engine, 'connect', listener)
+
+
+def upgrade_schema():
+    """
+    Actualiza el esquema de una base de datos existente al de los modelos.
+
+    db.create_all() solo crea las tablas que faltan; a las tablas que ya existen se les
+    añaden con ALTER TABLE las columnas nuevas y se crean los índices que les falten. Las
+    columnas nuevas deben admitir NULL o tener server_default para añadirse a tablas con filas.
+
+    Returns:
+        dict: Columnas ('columns') e índices ('indexes') añadidos, como 'tabla.nombre'.
+    """
+    db.create_all()
+    added = {'columns': [], 'indexes': []}
+    for bind_key, metadata in db.metadatas.items():
+        with db.engines[bind_key].begin() as connection:
+            inspector = inspect(connection)
+            preparer = connection.dialect.identifier_preparer
+            for table in metadata.sorted_tables:
+                existing = {column['name'] for column in inspector.get_columns(table.name)}
+                for column in table.columns:
+                    if column.name not in existing:
+                        ddl = CreateColumn(column).compile(dialect=connection.dialect)
+                        connection.execute(text(f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN {ddl}"))
+                        added['columns'].append(f"{table.name}.{column.name}")
+
+                existing = {index['name'] for index in inspector.get_indexes(table.name)}
+                for index in table.indexes:
+                    if index.name not in existing:
+                        index.create(connection)
+                        added['indexes'].append(f"{table.name}.{index.name}")
+    return added
@@ -0,0 +1,112 @@
+import time
+from functools import wraps
+from flask import current_app, g, has_request_context, session as flask_session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.sql import Select
+
+# Clave del bind de SQLALCHEMY_BINDS que apunta a la réplica de solo lectura
+REPLICA_BIND_KEY = 'replica'
+
+# Clave de la sesión de Flask con el instante hasta el que el cliente lee del primario
+PRIMARY_UNTIL_SESSION_KEY = '_db_primary_until'
+
+
+class RoutingSession(Session):
+    """
+    Sesión de SQLAlchemy que envía las lecturas de los endpoints de solo lectura a la réplica.
+
+    Las consultas SELECT se dirigen al bind 'replica' cuando la vista actual está marcada con
+    @read_only, la sesión no tiene cambios pendientes y el cliente no acaba de escribir
+    (lectura de sus propias escrituras). Todo lo demás usa el primario.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        """
+        Selecciona el motor para la operación, sustituyendo el primario por la réplica
+        cuando la lectura puede servirse desde ella.
+        """
+        engine = super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+        if bind is not None or not self._can_use_replica(clause):
+            return engine
+
+        engines = self._db.engines
+        if engine is engines.get(None) and REPLICA_BIND_KEY in engines:
+            return engines[REPLICA_BIND_KEY]
+        return engine
+
+    def _can_use_replica(self, clause):
+        """
+        Indica si la sentencia puede leerse desde la réplica en el contexto actual.
+        """
+        if not has_request_context() or not g.get('db_read_only', False):
+            return False
+        if g.get('db_use_primary', False) or wants_primary():
+            return False
+        if self._flushing or self.new or self.dirty or self.deleted:
+            return False
+        return isinstance(clause, Select)
+
+
+def wants_primary():
+    """
+    Indica si el cliente está dentro de la ventana de lectura de sus propias escrituras.
+    """
+    return flask_session.get(PRIMARY_UNTIL_SESSION_KEY, 0) > time.time()
+
+
+def read_only(view):
+    """
+    Decorador que marca una vista como de solo lectura, permitiendo servir sus consultas
+    desde la réplica.
+    """
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        g.db_read_only = True
+        return view(*args, **kwargs)
+    return wrapped
+
+
+def use_primary():
+    """
+    Fuerza que el resto de la petición actual lea del primario.
+    """
+    g.db_use_primary = True
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _mark_write(session, flush_context):
+    """
+    Anota que la transacción actual ha escrito en el primario.
+    """
+    session.info['db_wrote'] = True
+
+
+@event.listens_for(RoutingSession, 'after_bulk_update')
+@event.listens_for(RoutingSession, 'after_bulk_delete')
+def _mark_bulk_write(update_context):
+    """
+    Anota las escrituras masivas (query.update() / query.delete()), que no pasan por el flush.
+    """
+    update_context.session.info['db_wrote'] = True
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _route_to_primary(session):
+    """
+    Tras un commit con escrituras, la petición actual deja de usar la réplica y el cliente lee
+    del primario durante DB_READ_YOUR_WRITES_SECONDS, tiempo que debe cubrir el retraso de
+    replicación.
+    """
+    if not session.info.pop('db_wrote', False) or not has_request_context():
+        return
+    g.db_use_primary = True
+    flask_session[PRIMARY_UNTIL_SESSION_KEY] = time.time() + current_app.config['DB_READ_YOUR_WRITES_SECONDS']
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _forget_write(session):
+    """
+    Descarta la marca de escritura de una transacción deshecha.
+    """
+    session.info.pop('db_wrote', None)
@@ -1,4 +1,4 @@
-from flask import render_template
+from flask import render_template, make_response
 from werkzeug.exceptions import HTTPException
 
 def init_error_handlers(app):
@@ -37,6 +37,22 @@ def init_error_handlers(app):
         """
         return render_template('errors/404.html'), 404
 
+    @app.errorhandler(429)
+    def too_many_requests_error(error):
+        """
+        Maneja errores 429 (Demasiadas Peticiones) del limitador de peticiones.
+
+        Args:
+            error: El objeto de error capturado.
+
+        Returns:
+            Response: La plantilla genérica de error con el código 429 y la cabecera Retry-After.
+        """
+        response = make_response(render_template('errors/generic.html', error=error), 429)
+        if getattr(error, 'retry_after', None) is not None:
+            response.headers['Retry-After'] = str(error.retry_after)
+        return response
+
     @app.errorhandler(500)
     def internal_error(error):
         """
@@ -0,0 +1,232 @@
+import json
+import queue
+import threading
+from datetime import datetime, timedelta
+from werkzeug.utils import import_string
+from sqlalchemy import func
+from extensions import db
+from models import Product, Sale, Purchase, UserDailySpend
+
+
+class Subscription:
+    """
+    Suscripción a uno o varios canales; los mensajes se leen con get().
+    """
+
+    def __init__(self, backend, channels, maxsize):
+        self.backend = backend
+        self.channels = channels
+        self.queue = queue.Queue(maxsize=maxsize)
+
+    def get(self, timeout=None):
+        """
+        Devuelve el siguiente mensaje (canal, evento, datos) o None si vence el timeout.
+        """
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        """
+        Cancela la suscripción.
+        """
+        self.backend.unsubscribe(self)
+
+
+class LocalBackend:
+    """
+    Backend de difusión en memoria: reparte los mensajes entre los suscriptores del proceso.
+
+    Para varios workers debe sustituirse por un backend compartido (Redis, PostgreSQL
+    LISTEN/NOTIFY...) que implemente publish(), subscribe() y unsubscribe().
+    """
+
+    def __init__(self, app_config):
+        self.queue_size = app_config['EVENTS_QUEUE_SIZE']
+        self.subscribers = {}
+        self.lock = threading.Lock()
+
+    def publish(self, channel, event, data):
+        with self.lock:
+            subscriptions = list(self.subscribers.get(channel, ()))
+        for subscription in subscriptions:
+            try:
+                subscription.queue.put_nowait((channel, event, data))
+            except queue.Full:
+                # Un cliente lento no debe bloquear al que publica: se descarta el mensaje
+                pass
+
+    def subscribe(self, channels):
+        subscription = Subscription(self, channels, self.queue_size)
+        with self.lock:
+            for channel in channels:
+                self.subscribers.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            for channel in subscription.channels:
+                self.subscribers.get(channel, set()).discard(subscription)
+
+
+BACKENDS = {
+    'local': LocalBackend
+}
+
+
+class EventBroker:
+    """
+    Pub/sub de eventos del dashboard con un backend de difusión intercambiable.
+
+    Recuerda el último valor publicado por clave para enviar solo los cambios reales y
+    cuenta las conexiones SSE abiertas en el proceso.
+    """
+
+    def __init__(self):
+        self.backend = None
+        self.last_published = {}
+        self.open_streams = 0
+        self.lock = threading.Lock()
+
+    def init_app(self, app):
+        """
+        Crea el backend indicado en EVENTS_BACKEND ('local' o ruta 'modulo.Clase').
+        """
+        backend = app.config['EVENTS_BACKEND']
+        backend_class = BACKENDS[backend] if backend in BACKENDS else import_string(backend)
+        self.backend = backend_class(app.config)
+        app.extensions['event_broker'] = self
+
+    def publish(self, channel, event, data):
+        self.backend.publish(channel, event, data)
+
+    def publish_if_changed(self, channel, event, data, key=None):
+        """
+        Publica el evento solo si sus datos difieren de los últimos publicados con la misma
+        clave (por defecto, el canal y el nombre del evento).
+        """
+        key = (channel, event, key)
+        with self.lock:
+            if self.last_published.get(key) == data:
+                return
+            self.last_published[key] = data
+        self.publish(channel, event, data)
+
+    def subscribe(self, channels):
+        return self.backend.subscribe(channels)
+
+    def acquire_stream(self, limit):
+        """
+        Reserva una conexión SSE si hay menos de limit abiertas en el proceso.
+
+        Returns:
+            bool: True si se ha reservado; debe liberarse con release_stream().
+        """
+        with self.lock:
+            if self.open_streams >= limit:
+                return False
+            self.open_streams += 1
+            return True
+
+    def release_stream(self):
+        with self.lock:
+            self.open_streams -= 1
+
+
+broker = EventBroker()
+
+
+def format_sse(event, data):
+    """
+    Formatea un mensaje según el protocolo Server-Sent Events.
+    """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+# Canales: administradores, todos los clientes y cada cliente individual
+ADMIN_CHANNEL = 'admin'
+CLIENTS_CHANNEL = 'clients'
+
+
+def user_channel(user_id):
+    """
+    Devuelve el canal privado de un cliente.
+    """
+    return f'user:{user_id}'
+
+
+def _today_range():
+    """
+    Devuelve el inicio y el fin (UTC) del día actual.
+    """
+    start = datetime.combine(datetime.utcnow().date(), datetime.min.time())
+    return start, start + timedelta(days=1)
+
+
+def _publish_daily_totals():
+    """
+    Publica a los administradores los totales de ventas y compras del día actual.
+    """
+    start, end = _today_range()
+    sales = db.session.query(func.sum(Sale.total)).filter(Sale.date >= start, Sale.date < end).scalar() or 0
+    purchases = db.session.query(func.sum(Purchase.total)).filter(Purchase.date >= start, Purchase.date < end).scalar() or 0
+    broker.publish(ADMIN_CHANNEL, 'daily_totals', {
+        'date': start.strftime('%Y-%m-%d'),
+        'sales': float(sales),
+        'purchases': float(purchases),
+        'profit': float(sales) - float(purchases)
+    })
+
+
+def _publish_low_stock(product_ids):
+    """
+    Publica el stock de los productos modificados cuando entran, siguen o salen del stock bajo.
+    """
+    for p in Product.query.filter(Product.id.in_(product_ids)).execution_options(include_deleted=True):
+        change = {'id': p.id, 'name': p.name, 'stock': p.stock, 'min_stock': p.min_stock,
+                  'is_low_stock': bool(p.is_low_stock) and not p.is_deleted}
+        # Los productos con stock normal solo se publican si antes estaban en stock bajo
+        if change['is_low_stock'] or broker.last_published.get((ADMIN_CHANNEL, 'low_stock', p.id)):
+            broker.publish_if_changed(ADMIN_CHANNEL, 'low_stock', change, key=p.id)
+
+
+def _publish_top_products():
+    """
+    Publica los rankings de productos si han cambiado (lectura por índice de los contadores).
+    """
+    top_selling = [{'id': p.id, 'name': p.name, 'total_quantity': p.units_sold} for p in Product.top_selling(10)]
+    most_profitable = [{'id': p.id, 'name': p.name, 'total_sales': float(p.revenue)} for p in Product.most_profitable(10)]
+    broker.publish_if_changed(ADMIN_CHANNEL, 'top_products',
+                              {'top_selling_products': top_selling, 'most_profitable_products': most_profitable})
+    broker.publish_if_changed(CLIENTS_CHANNEL, 'top_products', {'top_sold_products': top_selling})
+
+
+def publish_sale(sale, product_ids):
+    """
+    Publica los cambios del dashboard tras confirmar (commit) una venta.
+    """
+    _publish_daily_totals()
+    _publish_low_stock(product_ids)
+    _publish_top_products()
+
+    spend = UserDailySpend.query.filter_by(user_id=sale.user_id, day=sale.date.date()).first()
+    if spend is not None:
+        broker.publish(user_channel(sale.user_id), 'daily_spend',
+                       {'date': spend.day.strftime('%Y-%m-%d'), 'total': float(spend.total)})
+
+
+def publish_purchase(product_ids):
+    """
+    Publica los cambios del dashboard tras confirmar un pedido a proveedor.
+    """
+    _publish_daily_totals()
+    _publish_low_stock(product_ids)
+
+
+def publish_product_change(product_ids):
+    """
+    Publica los cambios del dashboard tras editar o eliminar productos.
+    """
+    _publish_low_stock(product_ids)
+    _publish_top_products()
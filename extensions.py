@@ -3,10 +3,12 @@ from flask_migrate import Migrate
 from flask_login import LoginManager
 from flask_wtf.csrf import CSRFProtect
 from flask_mail import Mail
+from db_routing import RoutingSession
 
 # Inicialización de la extensión SQLAlchemy
 # Esta extensión proporciona integración ORM (Object-Relational Mapping) para la aplicación Flask
-db = SQLAlchemy()
+# La sesión enruta las lecturas de los endpoints de solo lectura a la réplica (ver db_routing.py)
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 # Inicialización de la extensión Migrate
 # Esta extensión facilita la gestión de migraciones de base de datos
@@ -0,0 +1,239 @@
+import multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import func
+from extensions import db
+from models import Product, Sale, SaleItem, ProductForecast
+from analytics import epoch_day, EPOCH
+from jobs import job
+
+# Valores de alpha probados al ajustar el suavizado exponencial simple
+ALPHA_GRID = np.array([0.05, 0.1, 0.2, 0.3, 0.5, 0.7, 0.9])
+SEASON = 7
+
+
+def daily_quantities(product_ids, first_day, last_day):
+    """
+    Matriz de unidades vendidas por producto y día (ambos días incluidos).
+
+    Args:
+        product_ids (ndarray): Ids de producto ordenados; fijan las filas de la matriz.
+        first_day (date): Primer día (columna 0).
+        last_day (date): Último día.
+
+    Returns:
+        ndarray: Matriz [productos, días] con ceros en los días sin ventas.
+    """
+    n_days = (last_day - first_day).days + 1
+    matrix = np.zeros((len(product_ids), max(n_days, 0)))
+    if n_days <= 0 or not len(product_ids):
+        return matrix
+
+    day = epoch_day(Sale.date)
+    start = datetime.combine(first_day, datetime.min.time())
+    end = datetime.combine(last_day + timedelta(days=1), datetime.min.time())
+    rows = db.session.query(SaleItem.product_id, day, func.sum(SaleItem.quantity)) \
+        .join(Sale, SaleItem.sale_id == Sale.id) \
+        .filter(Sale.date >= start, Sale.date < end) \
+        .group_by(SaleItem.product_id, day).all()
+    if not rows:
+        return matrix
+
+    data = np.array([tuple(row) for row in rows], dtype=np.int64)
+    rows_index = np.searchsorted(product_ids, data[:, 0])
+    known = (rows_index < len(product_ids)) & (product_ids[np.minimum(rows_index, len(product_ids) - 1)] == data[:, 0])
+    columns = data[:, 1] - (first_day - EPOCH).days
+    np.add.at(matrix, (rows_index[known], columns[known]), data[known, 2])
+    return matrix
+
+
+def fit_models(history):
+    """
+    Ajusta a la vez, para todos los productos, el suavizado exponencial simple (eligiendo
+    alpha por producto) y el modelo estacional ingenuo semanal.
+
+    Función pura sobre arrays para poder repartirse entre procesos.
+
+    Args:
+        history (ndarray): Unidades diarias [productos, días].
+
+    Returns:
+        dict: Arrays con el estado y los errores acumulados de cada producto.
+    """
+    n_products, n_days = history.shape
+    alphas = ALPHA_GRID[:, None]
+    levels = np.repeat(history[None, :, 0], len(ALPHA_GRID), axis=0)
+    errors = np.zeros((len(ALPHA_GRID), n_products))
+    for t in range(1, n_days):
+        y = history[:, t]
+        errors += np.abs(y - levels)
+        levels = alphas * y + (1 - alphas) * levels
+
+    best = np.argmin(errors, axis=0)
+    columns = np.arange(n_products)
+    naive_errors = np.abs(history[:, SEASON:] - history[:, :-SEASON]).sum(axis=1) if n_days > SEASON \
+        else np.zeros(n_products)
+
+    recent = np.zeros((n_products, SEASON))
+    tail = history[:, -SEASON:]
+    recent[:, SEASON - tail.shape[1]:] = tail
+    return {
+        'alpha': ALPHA_GRID[best],
+        'level': levels[best, columns],
+        'recent': recent,
+        'ses_error': errors[best, columns],
+        'ses_count': np.full(n_products, n_days - 1),
+        'naive_error': naive_errors,
+        'naive_count': np.full(n_products, max(n_days - SEASON, 0))
+    }
+
+
+def update_models(state, values, valid):
+    """
+    Incorpora días nuevos al estado ajustado sin reajustar alpha.
+
+    Args:
+        state (dict): Arrays de estado con el formato de fit_models().
+        values (ndarray): Unidades diarias [productos, días nuevos].
+        valid (ndarray): Máscara [productos, días] con los días que cada producto aún no ha visto.
+
+    Returns:
+        dict: Estado actualizado.
+    """
+    alpha, level, recent = state['alpha'], state['level'].copy(), state['recent'].copy()
+    ses_error, naive_error = state['ses_error'].copy(), state['naive_error'].copy()
+    ses_count, naive_count = state['ses_count'].copy(), state['naive_count'].copy()
+    for t in range(values.shape[1]):
+        y, mask = values[:, t], valid[:, t]
+        ses_error += np.where(mask, np.abs(y - level), 0)
+        ses_count += mask
+        naive_error += np.where(mask, np.abs(y - recent[:, 0]), 0)
+        naive_count += mask
+        level = np.where(mask, alpha * y + (1 - alpha) * level, level)
+        recent = np.where(mask[:, None], np.column_stack([recent[:, 1:], y]), recent)
+    return dict(state, level=level, recent=recent, ses_error=ses_error, ses_count=ses_count,
+                naive_error=naive_error, naive_count=naive_count)
+
+
+def _fit_in_parallel(history, workers, chunk_size):
+    """
+    Reparte el ajuste de un catálogo grande entre varios procesos por bloques de productos.
+    """
+    chunks = [history[i:i + chunk_size] for i in range(0, len(history), chunk_size)]
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+        results = list(executor.map(fit_models, chunks))
+    return {key: np.concatenate([r[key] for r in results]) for key in results[0]}
+
+
+def _fit_products(product_ids, last_day):
+    """
+    Ajusta desde cero los modelos de los productos indicados con el histórico configurado.
+    """
+    config = current_app.config
+    first_day = last_day - timedelta(days=config['FORECAST_HISTORY_DAYS'] - 1)
+    history = daily_quantities(product_ids, first_day, last_day)
+    workers = config['FORECAST_WORKERS'] or multiprocessing.cpu_count()
+    if len(product_ids) >= config['FORECAST_PARALLEL_MIN_PRODUCTS'] and workers > 1:
+        return _fit_in_parallel(history, workers, -(-len(product_ids) // workers))
+    return fit_models(history)
+
+
+def _state_rows(product_ids, state, last_day):
+    """
+    Convierte los arrays de estado en filas para insertar o actualizar ProductForecast.
+    """
+    now = datetime.utcnow()
+    return [{
+        'product_id': int(product_id),
+        'alpha': float(state['alpha'][i]),
+        'level': float(state['level'][i]),
+        'recent': [int(v) for v in state['recent'][i]],
+        'ses_error': float(state['ses_error'][i]),
+        'ses_count': int(state['ses_count'][i]),
+        'naive_error': float(state['naive_error'][i]),
+        'naive_count': int(state['naive_count'][i]),
+        'last_day': last_day,
+        'updated_at': now
+    } for i, product_id in enumerate(product_ids)]
+
+
+def update_forecasts(refit=False, last_day=None):
+    """
+    Ajusta los modelos de los productos nuevos y actualiza los existentes con los días
+    transcurridos desde su última actualización.
+
+    Args:
+        refit (bool): Si es True reajusta todos los productos desde cero.
+        last_day (date): Último día completo a incorporar (por defecto, ayer en UTC).
+
+    Returns:
+        dict: Número de productos ajustados y actualizados.
+    """
+    last_day = last_day or datetime.utcnow().date() - timedelta(days=1)
+    active_ids = np.array(sorted(pid for (pid,) in db.session.query(Product.id)),
+                          dtype=np.int64)
+    existing = {} if refit else {f.product_id: f for f in ProductForecast.query.all()}
+
+    to_fit = np.array([pid for pid in active_ids if pid not in existing], dtype=np.int64)
+    active = set(active_ids.tolist())
+    stale = sorted((f for f in existing.values() if f.last_day < last_day and f.product_id in active),
+                   key=lambda f: f.product_id)
+
+    if refit:
+        ProductForecast.query.delete()
+    if len(to_fit):
+        state = _fit_products(to_fit, last_day)
+        db.session.execute(db.insert(ProductForecast), _state_rows(to_fit, state, last_day))
+
+    if stale:
+        stale_ids = np.array([f.product_id for f in stale], dtype=np.int64)
+        first_day = min(f.last_day for f in stale) + timedelta(days=1)
+        values = daily_quantities(stale_ids, first_day, last_day)
+        seen_until = np.array([(f.last_day - first_day).days for f in stale])
+        valid = np.arange(values.shape[1])[None, :] > seen_until[:, None]
+        state = update_models({
+            'alpha': np.array([f.alpha for f in stale]),
+            'level': np.array([f.level for f in stale]),
+            'recent': np.array([f.recent for f in stale], dtype=np.float64),
+            'ses_error': np.array([f.ses_error for f in stale]),
+            'ses_count': np.array([f.ses_count for f in stale]),
+            'naive_error': np.array([f.naive_error for f in stale]),
+            'naive_count': np.array([f.naive_count for f in stale])
+        }, values, valid)
+        db.session.execute(db.update(ProductForecast), _state_rows(stale_ids, state, last_day))
+
+    db.session.commit()
+    return {'fitted': len(to_fit), 'updated': len(stale)}
+
+
+def product_forecast(product_id, horizon=None):
+    """
+    Pronóstico de demanda diaria de un producto a partir de sus parámetros guardados.
+
+    Returns:
+        dict: Método, error medio y unidades previstas por día; None si no hay modelo ajustado.
+    """
+    horizon = horizon or current_app.config['FORECAST_HORIZON_DAYS']
+    forecast = db.session.get(ProductForecast, product_id)
+    if forecast is None:
+        return None
+    values = forecast.predict(horizon)
+    return {
+        'product_id': product_id,
+        'method': forecast.method,
+        'mae': round(forecast.mae, 3) if forecast.mae is not None else None,
+        'fitted_until': forecast.last_day.isoformat(),
+        'total': round(sum(values), 2),
+        'daily': [{'date': (forecast.last_day + timedelta(days=i + 1)).isoformat(), 'quantity': round(v, 2)}
+                  for i, v in enumerate(values)]
+    }
+
+
+@job('forecasts', hour=2)
+def nightly_forecasts():
+    """
+    Tarea nocturna: incorpora las ventas del día anterior a los pronósticos.
+    """
+    return update_forecasts()
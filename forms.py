@@ -2,6 +2,7 @@ from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField, SubmitField, EmailField, TextAreaField, FloatField, IntegerField, SelectField, HiddenField, SelectMultipleField
 from wtforms.validators import DataRequired, Optional, Email, EqualTo, Length, NumberRange, Regexp, ValidationError
 import re
+import uuid
 
 def validate_username(form, field):
     """
@@ -49,6 +50,8 @@ class CheckoutForm(FlaskForm):
     card_number = StringField('Número de tarjeta', validators=[DataRequired(), Length(min=16, max=16)], default="4111111111111111")
     expiration_date = StringField('Fecha de expiración (MM/YY)', validators=[DataRequired(), Length(min=5, max=5)], default="12/25")
     cvv = StringField('CVV', validators=[DataRequired(), Length(min=3, max=4)], default="123")
+    # Clave de idempotencia: un doble envío del mismo formulario no crea una segunda venta
+    idempotency_key = HiddenField(default=lambda: uuid.uuid4().hex)
     submit = SubmitField('Realizar compra')
 
 class RegistrationForm(FlaskForm):
@@ -0,0 +1,186 @@
+import threading
+from collections import OrderedDict
+from flask import current_app, has_app_context
+from jinja2 import nodes
+from jinja2.ext import Extension
+from sqlalchemy import event
+from extensions import db
+from models import Product, Category
+
+
+class LRUCache:
+    """
+    Caché LRU en memoria, segura entre hilos, con etiquetas para invalidar grupos de entradas.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.tags = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        Devuelve el valor de la clave (marcándolo como usado recientemente) o None.
+        """
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key][0]
+
+    def set(self, key, value, tags=()):
+        """
+        Guarda un valor con sus etiquetas, expulsando la entrada menos usada si se supera maxsize.
+        """
+        with self.lock:
+            self.entries[key] = (value, tuple(tags))
+            self.entries.move_to_end(key)
+            for tag in tags:
+                self.tags.setdefault(tag, set()).add(key)
+            while len(self.entries) > self.maxsize:
+                old_key, (_, old_tags) = self.entries.popitem(last=False)
+                self._untag(old_key, old_tags)
+
+    def invalidate_tag(self, tag):
+        """
+        Elimina todas las entradas marcadas con la etiqueta indicada.
+        """
+        with self.lock:
+            for key in self.tags.pop(tag, ()):
+                entry = self.entries.pop(key, None)
+                if entry is not None:
+                    self._untag(key, entry[1])
+
+    def clear(self):
+        """
+        Vacía la caché.
+        """
+        with self.lock:
+            self.entries.clear()
+            self.tags.clear()
+
+    def _untag(self, key, tags):
+        for tag in tags:
+            keys = self.tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.tags[tag]
+
+
+class FragmentCacheExtension(Extension):
+    """
+    Extensión de Jinja que cachea fragmentos de plantilla ya renderizados.
+
+    Uso en las plantillas:
+
+        {% cache fragment_key, ['product:%d' % product.id] %}
+            ... HTML común a todos los clientes ...
+        {% endcache %}
+
+    La clave debe incluir todo lo que cambia el HTML del fragmento (id y updated_at del
+    producto, firma de la consulta del listado, rol del usuario...). Lo que es propio de
+    cada usuario, como el token CSRF o el formulario de añadir al carrito, debe quedar
+    fuera del bloque {% cache %}.
+    """
+    tags = {'cache'}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache=None)
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        if parser.stream.skip_if('comma'):
+            args.append(parser.parse_expression())
+        else:
+            args.append(nodes.Const(()))
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        return nodes.CallBlock(self.call_method('_cache_support', args), [], [], body).set_lineno(lineno)
+
+    def _cache_support(self, key, tags, caller):
+        cache = self.environment.fragment_cache
+        if cache is None:
+            return caller()
+        key = tuple(key) if isinstance(key, list) else key
+        value = cache.get(key)
+        if value is None:
+            value = caller()
+            cache.set(key, value, tags)
+        return value
+
+
+def product_fragment_key(product_id, version, show_stock):
+    """
+    Clave del fragmento de detalle de un producto.
+
+    version debe cubrir el updated_at del producto y el de sus proveedores, que también se
+    muestran en el detalle.
+    """
+    return ('product_detail', product_id, version, show_stock)
+
+
+def listing_fragment_key(catalog_version, page, search, category_id, low_stock, is_admin):
+    """
+    Clave del fragmento del listado de productos: firma de la consulta y versión del catálogo.
+    """
+    return ('product_listing', catalog_version, page, search, category_id, low_stock, is_admin)
+
+
+def init_fragment_cache(app):
+    """
+    Registra la extensión {% cache %} y crea la caché LRU de fragmentos de la aplicación.
+
+    Las entradas de un producto (etiqueta 'product:<id>') y las del listado (etiqueta
+    'listing') se eliminan tras cada commit que modifique productos o categorías.
+
+    Args:
+        app (Flask): La instancia de la aplicación Flask.
+    """
+    app.jinja_env.add_extension(FragmentCacheExtension)
+    if app.config['FRAGMENT_CACHE_ENABLED']:
+        app.jinja_env.fragment_cache = LRUCache(app.config['FRAGMENT_CACHE_SIZE'])
+    app.extensions['fragment_cache'] = app.jinja_env.fragment_cache
+
+
+@event.listens_for(db.session, 'after_flush')
+def _collect_catalog_changes(session, flush_context):
+    """
+    Anota los productos y categorías modificados en la transacción actual.
+    """
+    changed = session.info.setdefault('fragment_cache_tags', set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Product):
+            changed.update({f'product:{obj.id}', 'listing'})
+        elif isinstance(obj, Category):
+            changed.add('listing')
+
+
+@event.listens_for(db.session, 'after_commit')
+def _invalidate_catalog_fragments(session):
+    """
+    Invalida los fragmentos afectados por la transacción confirmada.
+    """
+    tags = session.info.pop('fragment_cache_tags', None)
+    if not tags:
+        return
+    if not has_app_context():
+        return
+    cache = current_app.extensions.get('fragment_cache')
+    if cache is not None:
+        for tag in tags:
+            cache.invalidate_tag(tag)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _forget_catalog_changes(session):
+    """
+    Descarta los cambios anotados de una transacción deshecha.
+    """
+    session.info.pop('fragment_cache_tags', None)
@@ -0,0 +1,109 @@
+import hashlib
+import time
+from functools import wraps
+from flask import current_app, request, session, make_response
+from flask_login import current_user
+
+
+def make_etag(*parts):
+    """
+    Genera un ETag a partir de las partes que identifican la versión de una respuesta.
+    """
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+
+
+def encoded_etag(etag, encoding):
+    """
+    ETag de la representación comprimida con la codificación indicada ('gzip', 'br').
+
+    Un validador fuerte debe distinguir cada representación, así que el cuerpo comprimido no
+    puede llevar el mismo ETag que el original.
+    """
+    return f'{etag}-{encoding}'
+
+
+def _base_etag(etag):
+    """
+    Quita de un ETag el sufijo de codificación añadido por encoded_etag().
+    """
+    base, _, encoding = etag.rpartition('-')
+    return base if base and encoding in ('gzip', 'br') else etag
+
+
+def _page_parts():
+    """
+    Devuelve las partes del ETag que dependen del usuario y no de los datos.
+
+    Incluye el usuario (las páginas muestran datos distintos a administradores y clientes) y
+    el periodo de validez del token CSRF embebido en los formularios, para no responder 304
+    con una página cuyo token pueda haber caducado.
+    """
+    parts = [current_user.get_id()]
+    time_limit = current_app.config.get('WTF_CSRF_TIME_LIMIT', 3600)
+    if current_app.config.get('WTF_CSRF_ENABLED', True) and time_limit:
+        parts.append((session.get('csrf_token'), int(time.time()) // max(time_limit // 2, 1)))
+    return parts
+
+
+def _is_not_modified(etag, last_modified):
+    """
+    Comprueba las cabeceras condicionales de la petición frente al ETag y la fecha actuales.
+
+    Returns:
+        str: El ETag de la petición que coincide con la versión actual (con su sufijo de
+        codificación), o None si la respuesta ha cambiado.
+    """
+    if request.if_none_match:
+        if request.if_none_match.star_tag:
+            return etag
+        return next((tag for tag in request.if_none_match.as_set(include_weak=True)
+                     if _base_etag(tag) == etag), None)
+    if last_modified is not None and request.if_modified_since is not None:
+        if last_modified.replace(microsecond=0) <= request.if_modified_since.replace(tzinfo=None):
+            return etag
+    return None
+
+
+def conditional(version_func):
+    """
+    Decorador que añade ETag/Last-Modified a una vista GET y responde 304 sin ejecutarla
+    cuando el cliente ya tiene la versión actual.
+
+    version_func recibe los mismos argumentos que la vista y devuelve una tupla
+    (partes_de_version, last_modified) obtenida con consultas baratas, o None si no puede
+    determinarse (por ejemplo, si el recurso no existe), en cuyo caso la vista se ejecuta
+    normalmente.
+
+    Args:
+        version_func (callable): Función que calcula la versión del recurso.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapped(*args, **kwargs):
+            # Los mensajes flash pendientes se consumen al renderizar: no se puede responder 304
+            if request.method not in ('GET', 'HEAD') or session.get('_flashes'):
+                return view(*args, **kwargs)
+
+            version = version_func(*args, **kwargs)
+            if version is None:
+                return view(*args, **kwargs)
+
+            parts, last_modified = version
+            etag = make_etag(request.full_path, *_page_parts(), *parts)
+            cached_etag = _is_not_modified(etag, last_modified)
+            if cached_etag is not None:
+                # El 304 repite el ETag de la representación (comprimida o no) que tiene el cliente
+                response = make_response('', 304)
+                response.set_etag(cached_etag)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                response.set_etag(etag)
+            if last_modified is not None:
+                response.last_modified = last_modified
+            # Respuestas por usuario: el navegador puede guardarlas pero debe revalidarlas
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        return wrapped
+    return decorator
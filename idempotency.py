@@ -0,0 +1,173 @@
+import hashlib
+from datetime import datetime, timedelta
+from functools import wraps
+from flask import current_app, request, jsonify, make_response, abort, g
+from flask_login import current_user
+from sqlalchemy import update, or_, and_
+from sqlalchemy.exc import IntegrityError
+from extensions import db
+from models import IdempotencyKey
+from jobs import job
+
+# La clave se lee de la cabecera (clientes de la API, balanceador) o del formulario (checkout)
+HEADER = 'Idempotency-Key'
+FORM_FIELD = 'idempotency_key'
+
+
+def _request_key():
+    key = (request.headers.get(HEADER) or request.form.get(FORM_FIELD) or '').strip()
+    return key[:64] or None
+
+
+def _fingerprint():
+    """
+    Huella de la ruta y los datos de la petición, sin el token CSRF ni la propia clave.
+    """
+    form = sorted((name, value) for name, value in request.form.items(multi=True)
+                  if name not in ('csrf_token', FORM_FIELD))
+    digest = hashlib.sha256()
+    digest.update(request.path.encode())
+    digest.update(repr(form).encode())
+    if not request.form:
+        digest.update(request.get_data())
+    return digest.hexdigest()
+
+
+def _error(status_code, message, json):
+    if json:
+        return jsonify({'success': False, 'error': message}), status_code
+    abort(status_code, message)
+
+
+def _replay(record):
+    """
+    Reconstruye la respuesta guardada de la petición original.
+    """
+    response = make_response(record.response_body or '', record.status_code)
+    if record.content_type:
+        response.content_type = record.content_type
+    if record.location:
+        response.headers['Location'] = record.location
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _finish(record_id, response=None):
+    """
+    Guarda la respuesta de la petición original o, sin respuesta, libera la clave para que
+    un reintento pueda volver a ejecutarla.
+    """
+    db.session.rollback()
+    table = IdempotencyKey.__table__
+    if response is None:
+        db.session.execute(table.delete().where(table.c.id == record_id))
+    else:
+        db.session.execute(update(table).where(table.c.id == record_id).values(
+            status_code=response.status_code,
+            response_body=response.get_data(as_text=True),
+            content_type=response.content_type,
+            location=response.headers.get('Location')
+        ))
+    db.session.commit()
+
+
+def mark_completed():
+    """
+    Indica que la vista idempotente ha confirmado su escritura. Debe llamarse justo después
+    del commit: solo entonces se guarda la respuesta para los reintentos.
+    """
+    g.idempotent_completed = True
+
+
+def idempotent(endpoint, json=False):
+    """
+    Decorador que hace idempotentes las peticiones POST enviadas con clave de idempotencia.
+
+    La primera petición con una clave reserva la clave, ejecuta la vista y, si la vista
+    llamó a mark_completed() y respondió con 2xx/3xx, guarda su respuesta; los reintentos del mismo usuario con la misma clave dentro de
+    IDEMPOTENCY_WINDOW_SECONDS reciben esa respuesta sin ejecutar de nuevo la vista. Un
+    reintento mientras la original se procesa recibe 409 y una clave reutilizada con otros
+    datos, 422. Cualquier otra respuesta (formulario con errores, CSRF caducado, error al
+    guardar) y las excepciones liberan la clave, de modo que el envío corregido con la misma
+    clave se ejecuta normalmente. Si la petición
+    original no termina en IDEMPOTENCY_PROCESSING_TIMEOUT segundos (el worker murió antes
+    de guardar la respuesta) la reserva caduca y el reintento vuelve a ejecutar la vista.
+    Las peticiones sin clave se procesan como siempre.
+
+    Debe colocarse debajo de @login_required.
+
+    Args:
+        endpoint (str): Nombre con el que se agrupan las claves de la vista.
+        json (bool): Si es True los errores 409/422 se devuelven como JSON.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapped(*args, **kwargs):
+            key = _request_key() if request.method == 'POST' else None
+            if key is None:
+                return view(*args, **kwargs)
+
+            fingerprint = _fingerprint()
+            now = datetime.utcnow()
+            since = now - timedelta(seconds=current_app.config['IDEMPOTENCY_WINDOW_SECONDS'])
+            lease = now - timedelta(seconds=current_app.config['IDEMPOTENCY_PROCESSING_TIMEOUT'])
+            keys = IdempotencyKey.query.filter_by(user_id=current_user.id, endpoint=endpoint, key=key)
+            # Claves caducadas o reservas sin respuesta cuyo plazo de procesamiento ha vencido
+            expired = or_(IdempotencyKey.created_at < since,
+                          and_(IdempotencyKey.status_code.is_(None), IdempotencyKey.created_at < lease))
+            record = keys.filter(~expired).first()
+            if record is not None:
+                if record.fingerprint != fingerprint:
+                    return _error(422, 'La clave de idempotencia ya se usó con otros datos', json)
+                if record.status_code is None:
+                    return _error(409, 'La petición original con esta clave aún se está procesando', json)
+                return _replay(record)
+
+            # Reservar la clave (sustituyendo una caducada) antes de ejecutar la vista. Solo se
+            # borran las filas caducadas: si otro reintento acaba de reservarla, el INSERT falla
+            keys.filter(expired).delete(synchronize_session=False)
+            record = IdempotencyKey(user_id=current_user.id, endpoint=endpoint, key=key, fingerprint=fingerprint)
+            db.session.add(record)
+            try:
+                db.session.commit()
+            except IntegrityError:
+                # Otra petición con la misma clave la ha reservado a la vez
+                db.session.rollback()
+                return _error(409, 'La petición original con esta clave aún se está procesando', json)
+            record_id = record.id
+
+            g.idempotent_completed = False
+            try:
+                response = make_response(view(*args, **kwargs))
+            except Exception:
+                _finish(record_id)
+                raise
+            if g.idempotent_completed and response.status_code < 400 \
+                    and not response.is_streamed and not response.direct_passthrough:
+                _finish(record_id, response)
+            else:
+                _finish(record_id)
+            return response
+        return wrapped
+    return decorator
+
+
+def purge_idempotency_keys():
+    """
+    Borra las claves de idempotencia más antiguas que IDEMPOTENCY_WINDOW_SECONDS.
+
+    Returns:
+        int: Número de claves borradas.
+    """
+    until = datetime.utcnow() - timedelta(seconds=current_app.config['IDEMPOTENCY_WINDOW_SECONDS'])
+    deleted = IdempotencyKey.query.filter(IdempotencyKey.created_at < until).delete()
+    db.session.commit()
+    return deleted
+
+
+@job('idempotency-keys', interval=3600)
+def hourly_idempotency_purge():
+    """
+    Tarea periódica: borra las claves de idempotencia caducadas.
+    """
+    return purge_idempotency_keys()
@@ -0,0 +1,160 @@
+import time
+from flask import current_app, has_app_context, has_request_context, session
+from flask_login import user_logged_in, user_logged_out
+from sqlalchemy import event
+from sqlalchemy.orm import make_transient_to_detached
+from extensions import db
+from fragment_cache import LRUCache
+from models import User
+
+# Columnas del usuario que se guardan en la caché y en las credenciales de la sesión
+USER_FIELDS = ('id', 'username', 'email', 'is_admin')
+
+# Clave de la sesión con las credenciales firmadas del usuario
+CLAIMS_KEY = '_identity'
+
+
+class IdentityCache:
+    """
+    Caché en memoria de los datos básicos de los usuarios autenticados.
+
+    Cada entrada caduca a los IDENTITY_CACHE_TTL segundos y se elimina en cuanto se confirma
+    un cambio del usuario en este proceso; en el resto de procesos el dato puede quedar
+    desactualizado como mucho hasta su caducidad.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.entries = LRUCache(maxsize)
+        self.ttl = ttl
+
+    def get(self, user_id):
+        """
+        Devuelve los campos del usuario en caché, o None si no están o han caducado.
+        """
+        entry = self.entries.get(user_id)
+        if entry is None:
+            return None
+        expires, fields = entry
+        if expires < time.monotonic():
+            self.invalidate(user_id)
+            return None
+        return fields
+
+    def set(self, user_id, fields):
+        self.entries.set(user_id, (time.monotonic() + self.ttl, fields), tags=(f'user:{user_id}',))
+
+    def invalidate(self, user_id):
+        self.entries.invalidate_tag(f'user:{user_id}')
+
+    def clear(self):
+        self.entries.clear()
+
+
+def _user_fields(user):
+    return {field: getattr(user, field) for field in USER_FIELDS}
+
+
+def _attach(fields):
+    """
+    Devuelve un User de la sesión actual construido con los campos indicados, sin consultar
+    la base de datos. El resto de columnas (password_hash) se cargan al acceder a ellas.
+    """
+    user = User(**fields)
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
+
+
+def load_identity(user_id):
+    """
+    Carga el usuario de la sesión para Flask-Login.
+
+    Por orden, usa las credenciales firmadas de la cookie de sesión (si IDENTITY_SESSION_CLAIMS
+    está activado y no han caducado), la caché de identidad del proceso y, solo si ninguna
+    tiene al usuario, la base de datos.
+
+    Args:
+        user_id (str): El ID del usuario guardado en la sesión.
+
+    Returns:
+        User: El usuario correspondiente, o None si no existe.
+    """
+    user_id = int(user_id)
+    use_claims = current_app.config['IDENTITY_SESSION_CLAIMS']
+    if use_claims:
+        claims = session.get(CLAIMS_KEY)
+        if claims and claims.get('id') == user_id and claims.get('exp', 0) > time.time():
+            return _attach({field: claims[field] for field in USER_FIELDS})
+
+    cache = current_app.extensions.get('identity_cache')
+    fields = cache.get(user_id) if cache is not None else None
+    if fields is not None:
+        user = _attach(fields)
+    else:
+        user = db.session.get(User, user_id)
+        if user is None:
+            return None
+        fields = _user_fields(user)
+        if cache is not None:
+            cache.set(user_id, fields)
+
+    if use_claims:
+        session[CLAIMS_KEY] = dict(fields, exp=int(time.time()) + current_app.config['IDENTITY_CLAIMS_TTL'])
+    return user
+
+
+def init_identity_cache(app):
+    """
+    Crea la caché de identidad de la aplicación si está activada en la configuración.
+
+    Args:
+        app (Flask): La instancia de la aplicación Flask.
+    """
+    if app.config['IDENTITY_CACHE_ENABLED']:
+        app.extensions['identity_cache'] = IdentityCache(app.config['IDENTITY_CACHE_SIZE'],
+                                                         app.config['IDENTITY_CACHE_TTL'])
+
+
+@user_logged_in.connect
+def _reset_claims_on_login(sender, user, **extra):
+    session.pop(CLAIMS_KEY, None)
+
+
+@user_logged_out.connect
+def _reset_claims_on_logout(sender, user, **extra):
+    session.pop(CLAIMS_KEY, None)
+
+
+@event.listens_for(db.session, 'after_flush')
+def _collect_user_changes(session_, flush_context):
+    """
+    Anota los usuarios creados, modificados (permisos, contraseña...) o borrados en la transacción.
+    """
+    changed = session_.info.setdefault('identity_cache_users', set())
+    for obj in list(session_.dirty) + list(session_.deleted):
+        if isinstance(obj, User):
+            changed.add(obj.id)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _invalidate_identities(session_):
+    """
+    Elimina de la caché los usuarios modificados en la transacción confirmada y, si es el
+    usuario de la petición actual, también sus credenciales de sesión.
+    """
+    user_ids = session_.info.pop('identity_cache_users', None)
+    if not user_ids or not has_app_context():
+        return
+    cache = current_app.extensions.get('identity_cache')
+    if cache is not None:
+        for user_id in user_ids:
+            cache.invalidate(user_id)
+    if has_request_context() and session.get(CLAIMS_KEY, {}).get('id') in user_ids:
+        session.pop(CLAIMS_KEY, None)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _forget_user_changes(session_):
+    """
+    Descarta los usuarios anotados de una transacción deshecha.
+    """
+    session_.info.pop('identity_cache_users', None)
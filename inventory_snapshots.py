@@ -0,0 +1,146 @@
+from datetime import datetime
+from sqlalchemy import func, and_
+from extensions import db
+from models import Product, Category, InventorySnapshot, CategoryInventorySnapshot
+from jobs import job
+
+
+def _latest_product_snapshots(day, product_id=None):
+    """
+    Subconsulta con la última foto (day <= fecha) de cada producto.
+    """
+    latest = db.session.query(
+        InventorySnapshot.product_id,
+        func.max(InventorySnapshot.day).label('day')
+    ).filter(InventorySnapshot.day <= day)
+    if product_id is not None:
+        latest = latest.filter(InventorySnapshot.product_id == product_id)
+    return latest.group_by(InventorySnapshot.product_id).subquery()
+
+
+def take_snapshot(day=None):
+    """
+    Guarda la foto del inventario de un día: los productos cuyo stock o valor han cambiado
+    desde su foto anterior y los totales de todas las categorías.
+
+    Los productos eliminados cuentan con stock y valor 0. Si ya existe la foto del día no
+    se hace nada, de modo que la tarea puede repetirse sin duplicar datos.
+
+    Args:
+        day (date): Fecha de la foto (por defecto, hoy en UTC).
+
+    Returns:
+        dict: Fecha, productos con fila nueva y categorías guardadas; None si ya existía.
+    """
+    day = day or datetime.utcnow().date()
+    if db.session.query(CategoryInventorySnapshot.query.filter_by(day=day).exists()).scalar():
+        return None
+
+    latest = _latest_product_snapshots(day)
+    previous = dict(
+        (product_id, (stock, value)) for product_id, stock, value in db.session.query(
+            InventorySnapshot.product_id, InventorySnapshot.stock, InventorySnapshot.value
+        ).join(latest, and_(InventorySnapshot.product_id == latest.c.product_id, InventorySnapshot.day == latest.c.day))
+    )
+
+    changed = []
+    categories = {}
+    for product_id, category_id, stock, price, is_deleted in db.session.query(
+            Product.id, Product.category_id, Product.stock, Product.price, Product.is_deleted) \
+            .execution_options(include_deleted=True):
+        stock, value = (0, 0.0) if is_deleted else (stock, round(stock * price, 2))
+        if previous.get(product_id) != (stock, value):
+            changed.append({'product_id': product_id, 'day': day, 'stock': stock, 'value': value})
+        if not is_deleted:
+            totals = categories.setdefault(category_id, [0, 0, 0.0])
+            totals[0] += 1
+            totals[1] += stock
+            totals[2] += value
+
+    category_rows = [
+        {'day': day, 'category_id': category_id, 'products': count, 'stock': stock, 'value': round(value, 2)}
+        for category_id, (count, stock, value) in categories.items()
+    ]
+    if changed:
+        db.session.execute(db.insert(InventorySnapshot), changed)
+    if category_rows:
+        db.session.execute(db.insert(CategoryInventorySnapshot), category_rows)
+    db.session.commit()
+    return {'day': day.isoformat(), 'products': len(changed), 'categories': len(category_rows)}
+
+
+def _snapshot_day(day):
+    """
+    Fecha de la última foto tomada en o antes del día indicado (None si no hay ninguna).
+    """
+    return db.session.query(func.max(CategoryInventorySnapshot.day)) \
+        .filter(CategoryInventorySnapshot.day <= day).scalar()
+
+
+def inventory_at(day):
+    """
+    Valor y stock del inventario, total y por categoría, en una fecha pasada.
+
+    Returns:
+        dict: Datos de la última foto en o antes de la fecha; None si no hay fotos anteriores.
+    """
+    snapshot_day = _snapshot_day(day)
+    if snapshot_day is None:
+        return None
+    rows = db.session.query(CategoryInventorySnapshot, Category.name) \
+        .join(Category, CategoryInventorySnapshot.category_id == Category.id) \
+        .filter(CategoryInventorySnapshot.day == snapshot_day) \
+        .order_by(CategoryInventorySnapshot.value.desc()).all()
+    return {
+        'date': day.isoformat(),
+        'snapshot_date': snapshot_day.isoformat(),
+        'total_value': round(sum(row.value for row, _ in rows), 2),
+        'total_stock': sum(row.stock for row, _ in rows),
+        'categories': [{'id': row.category_id, 'name': name, 'products': row.products,
+                        'stock': row.stock, 'value': row.value} for row, name in rows]
+    }
+
+
+def inventory_history(start, end, category_id=None):
+    """
+    Serie de valor y stock por fecha de foto entre dos fechas (incluidas).
+
+    Args:
+        start (date): Primera fecha.
+        end (date): Última fecha.
+        category_id (int): Si se indica, la serie es solo de esa categoría.
+
+    Returns:
+        list: Un punto por foto con su fecha, stock y valor.
+    """
+    query = db.session.query(
+        CategoryInventorySnapshot.day,
+        func.sum(CategoryInventorySnapshot.stock),
+        func.sum(CategoryInventorySnapshot.value)
+    ).filter(CategoryInventorySnapshot.day >= start, CategoryInventorySnapshot.day <= end)
+    if category_id is not None:
+        query = query.filter(CategoryInventorySnapshot.category_id == category_id)
+    rows = query.group_by(CategoryInventorySnapshot.day).order_by(CategoryInventorySnapshot.day).all()
+    return [{'date': day.isoformat(), 'stock': int(stock), 'value': round(float(value), 2)} for day, stock, value in rows]
+
+
+def product_inventory_at(product_id, day):
+    """
+    Stock y valor de un producto en una fecha pasada (None si no hay fotos anteriores).
+    """
+    latest = _latest_product_snapshots(day, product_id)
+    row = db.session.query(InventorySnapshot) \
+        .join(latest, and_(InventorySnapshot.product_id == latest.c.product_id, InventorySnapshot.day == latest.c.day)) \
+        .first()
+    if row is None:
+        return None
+    return {'product_id': product_id, 'date': day.isoformat(), 'snapshot_date': row.day.isoformat(),
+            'stock': row.stock, 'value': row.value}
+
+
+@job('inventory-snapshot', hour=0)
+def daily_inventory_snapshot():
+    """
+    Tarea diaria: guarda la foto del inventario del día.
+    """
+    return take_snapshot()
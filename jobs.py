@@ -0,0 +1,155 @@
+import threading
+import time
+from datetime import datetime
+from extensions import db
+
+
+class Job:
+    """
+    Tarea periódica registrada: se ejecuta cada día a una hora (UTC) o cada cierto intervalo.
+    """
+
+    def __init__(self, name, func, hour=None, interval=None):
+        self.name = name
+        self.func = func
+        self.hour = hour
+        self.interval = interval
+
+    def is_due(self, now, last_run):
+        """
+        Indica si la tarea debe ejecutarse en el instante now dada su última ejecución.
+        """
+        if self.interval is not None:
+            return last_run is None or (now - last_run).total_seconds() >= self.interval
+        return now.hour >= self.hour and (last_run is None or last_run.date() < now.date())
+
+
+# Registro de tareas por nombre, rellenado con el decorador @job
+registry = {}
+
+# Tareas lanzadas con start_job() que aún se están ejecutando en este proceso
+_running = set()
+_running_lock = threading.Lock()
+
+
+def job(name, hour=None, interval=None):
+    """
+    Decorador que registra una función como tarea periódica.
+
+    Args:
+        name (str): Nombre de la tarea (flask run-job <nombre>).
+        hour (int): Hora UTC a la que se ejecuta cada día.
+        interval (int): Alternativa a hour: segundos entre ejecuciones.
+    """
+    if (hour is None) == (interval is None):
+        raise ValueError('Hay que indicar hour o interval')
+
+    def decorator(func):
+        registry[name] = Job(name, func, hour=hour, interval=interval)
+        return func
+    return decorator
+
+
+def run_job(app, name, **kwargs):
+    """
+    Ejecuta una tarea registrada en un contexto de aplicación y devuelve su resultado.
+
+    La sesión se deshace y se libera al terminar, aunque la tarea falle.
+    """
+    registered = registry[name]
+    with app.app_context():
+        started = time.monotonic()
+        try:
+            result = registered.func(**kwargs)
+        except Exception:
+            db.session.rollback()
+            app.logger.exception(f"Error en la tarea {name}")
+            raise
+        finally:
+            db.session.remove()
+        app.logger.info(f"Tarea {name} completada en {time.monotonic() - started:.1f}s: {result}")
+        return result
+
+
+def start_job(app, name, **kwargs):
+    """
+    Lanza una tarea registrada en un hilo en segundo plano y vuelve enseguida.
+
+    Sirve para que una petición inicie una tarea larga sin ocupar el worker mientras dura.
+
+    Returns:
+        bool: False si la tarea ya se está ejecutando en este proceso (no se lanza otra vez).
+    """
+    with _running_lock:
+        if name in _running:
+            return False
+        _running.add(name)
+
+    def run():
+        try:
+            run_job(app, name, **kwargs)
+        except Exception:
+            pass
+        finally:
+            with _running_lock:
+                _running.discard(name)
+
+    threading.Thread(target=run, name=f'job-{name}', daemon=True).start()
+    return True
+
+
+def is_running(name):
+    """
+    Indica si una tarea lanzada con start_job() sigue ejecutándose en este proceso.
+    """
+    with _running_lock:
+        return name in _running
+
+
+class JobScheduler(threading.Thread):
+    """
+    Hilo en segundo plano que ejecuta las tareas registradas cuando les toca.
+
+    Solo debe activarse en un proceso (JOBS_SCHEDULER_ENABLED); con varios workers es
+    preferible programar flask run-job desde cron.
+    """
+
+    def __init__(self, app, poll_seconds):
+        super().__init__(name='job-scheduler', daemon=True)
+        self.app = app
+        self.poll_seconds = poll_seconds
+        self.last_runs = {}
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.poll_seconds):
+            self.run_pending()
+
+    def run_pending(self):
+        """
+        Ejecuta las tareas pendientes; el fallo de una tarea no detiene a las demás.
+        """
+        now = datetime.utcnow()
+        for name, registered in list(registry.items()):
+            if registered.is_due(now, self.last_runs.get(name)):
+                self.last_runs[name] = now
+                try:
+                    run_job(self.app, name)
+                except Exception:
+                    pass
+
+    def stop(self):
+        self.stopped.set()
+
+
+def init_jobs(app):
+    """
+    Arranca el planificador de tareas si está activado en la configuración.
+
+    Args:
+        app (Flask): La instancia de la aplicación Flask.
+    """
+    if app.config['JOBS_SCHEDULER_ENABLED']:
+        scheduler = JobScheduler(app, app.config['JOBS_POLL_SECONDS'])
+        scheduler.start()
+        app.extensions['job_scheduler'] = scheduler
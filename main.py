@@ -1,20 +1,62 @@
 from flask import Flask, request
 from flask_sqlalchemy import SQLAlchemy
 from extensions import db, migrate, login_manager, csrf, mail
-from models import User
 from routes import init_routes
 from error_handlers import init_error_handlers
+from commands import init_commands
+from config import get_config, build_engine_options, build_binds
+from database import init_engine_events
+from events import broker
+from fragment_cache import init_fragment_cache
+from streaming import init_compression
+from jobs import init_jobs
+from passwords import password_hasher
+from identity_cache import init_identity_cache, load_identity
+from rate_limit import limiter
 import logging
 from logging.handlers import RotatingFileHandler
 import os
 
-def create_app():
+def configure_logging(app):
+    """
+    Configura el sistema de logging según los valores LOG_* de la configuración.
+
+    En producción puede enviarse el log a la salida estándar (LOG_TO_STDOUT) en lugar de
+    a un fichero rotado.
+
+    Args:
+        app (Flask): La instancia de la aplicación Flask.
+    """
+    formatter = logging.Formatter('%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')
+    level = logging.getLevelName(app.config['LOG_LEVEL'].upper())
+
+    if app.config['LOG_TO_STDOUT']:
+        handler = logging.StreamHandler()
+    elif app.config['LOG_FILE']:
+        os.makedirs(app.config['LOG_DIR'], exist_ok=True)
+        handler = RotatingFileHandler(os.path.join(app.config['LOG_DIR'], app.config['LOG_FILE']),
+                                      maxBytes=app.config['LOG_MAX_BYTES'],
+                                      backupCount=app.config['LOG_BACKUP_COUNT'])
+    else:
+        handler = None
+
+    if handler is not None:
+        handler.setFormatter(formatter)
+        handler.setLevel(level)
+        app.logger.addHandler(handler)
+    app.logger.setLevel(level)
+
+def create_app(config_name=None):
     """
     Crea y configura la aplicación Flask.
 
     Esta función es el punto de entrada principal para configurar la aplicación Flask.
-    Configura la base de datos, el sistema de logging, las extensiones de Flask,
-    y registra las rutas y los manejadores de errores.
+    Carga la configuración del entorno, configura la base de datos, el sistema de logging,
+    las extensiones de Flask, y registra las rutas y los manejadores de errores.
+
+    Args:
+        config_name (str, optional): Nombre del entorno ('development', 'testing' o
+            'production'). Si no se indica se usa la variable de entorno APP_CONFIG.
 
     Returns:
         Flask: La aplicación Flask configurada.
@@ -22,31 +64,15 @@ def create_app():
     # Crear la instancia de la aplicación Flask
     app = Flask(__name__)
 
-    # Configuración básica de la aplicación
-    app.config['DEBUG'] = True
-    app.config['SECRET_KEY'] = 'una_clave_secreta_muy_segura'
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///suministros.db'
-    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-    app.config['ITEMS_PER_PAGE'] = 10
-
-    # Configuración de Flask-Mail
-    # Nota: Estos valores deben ser reemplazados con la configuración real del servidor SMTP
-    app.config['MAIL_SERVER'] = 'smtp.example.com'
-    app.config['MAIL_PORT'] = 587
-    app.config['MAIL_USE_TLS'] = True
-    app.config['MAIL_USERNAME'] = 'your-email@example.com'
-    app.config['MAIL_PASSWORD'] = 'your-password'
+    # Cargar la configuración del entorno seleccionado
+    config_class = get_config(config_name)
+    app.config.from_object(config_class)
+    config_class.init_app(app)
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', build_engine_options(app.config))
+    app.config['SQLALCHEMY_BINDS'] = build_binds(app.config)
 
     # Configuración del sistema de logging
-    if not os.path.exists('logs'):
-        os.mkdir('logs')
-    file_handler = RotatingFileHandler('logs/app.log', maxBytes=10240, backupCount=10)
-    file_handler.setFormatter(logging.Formatter(
-        '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'
-    ))
-    file_handler.setLevel(logging.INFO)
-    app.logger.addHandler(file_handler)
-    app.logger.setLevel(logging.INFO)
+    configure_logging(app)
     app.logger.info('Aplicación iniciada')
 
     # Inicialización de extensiones con la aplicación
@@ -56,11 +82,18 @@ def create_app():
     login_manager.login_view = 'auth.login'
     csrf.init_app(app)
     mail.init_app(app)
+    init_engine_events(app)
+    broker.init_app(app)
+    password_hasher.init_app(app)
+    init_identity_cache(app)
+    limiter.init_app(app)
+    init_fragment_cache(app)
+    init_compression(app)
 
     @login_manager.user_loader
     def load_user(user_id):
         """
-        Carga un usuario desde la base de datos.
+        Carga un usuario desde la caché de identidad o, si no está, desde la base de datos.
 
         Esta función es utilizada por Flask-Login para cargar el usuario actual.
 
@@ -70,7 +103,7 @@ def create_app():
         Returns:
             User: El objeto User correspondiente al user_id, o None si no se encuentra.
         """
-        return db.session.get(User, int(user_id))
+        return load_identity(user_id)
 
     @app.before_request
     def before_request():
@@ -99,15 +132,21 @@ def create_app():
             response.headers['Content-Type'] = 'application/json'
         return response
 
-    # Inicializar rutas, manejadores de errores y crear tablas de la base de datos
-    with app.app_context():
-        init_routes(app)
-        init_error_handlers(app)
-        db.create_all()
+    # Inicializar rutas, manejadores de errores y comandos
+    init_routes(app)
+    init_error_handlers(app)
+    init_commands(app)
+
+    # La creación del esquema solo se hace al arrancar si el entorno lo pide (ver "flask init-db")
+    if app.config['AUTO_CREATE_SCHEMA']:
+        with app.app_context():
+            db.create_all()
+
+    init_jobs(app)
 
     return app
 
 if __name__ == '__main__':
     # Crear y ejecutar la aplicación si este script se ejecuta directamente
     app = create_app()
-    app.run(debug=True)
\ No newline at end of file
+    app.run(debug=app.config['DEBUG'])
\ No newline at end of file
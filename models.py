@@ -2,8 +2,10 @@ from extensions import db
 from datetime import datetime
 from flask_login import UserMixin
 from sqlalchemy.ext.hybrid import hybrid_property
-from werkzeug.security import generate_password_hash, check_password_hash
-from sqlalchemy import desc
+from passwords import password_hasher
+from sqlalchemy import desc, update, event, inspect
+from sqlalchemy.orm import with_loader_criteria, MANYTOONE
+from sqlalchemy.sql.expression import ClauseElement
 
 # Tabla de asociación para la relación muchos a muchos entre Product y Supplier
 supplier_product = db.Table('supplier_product',
@@ -17,12 +19,89 @@ class SoftDeleteMixin:
     """
     is_deleted = db.Column(db.Boolean, default=False)
 
+    # Filas por sentencia en los borrados en bloque (límite de parámetros de SQLite)
+    SOFT_DELETE_CHUNK = 500
+
     @classmethod
     def get_active(cls):
         """
         Devuelve una consulta para obtener solo los registros activos (no borrados).
+
+        Equivale a cls.query, que ya excluye los registros borrados (ver _exclude_deleted).
+        """
+        return cls.query
+
+    @staticmethod
+    def active_index(name, *columns):
+        """
+        Índice parcial sobre las filas activas (is_deleted = false) en SQLite y PostgreSQL;
+        en el resto de motores es un índice normal.
+        """
+        return db.Index(name, *columns,
+                        sqlite_where=db.text('is_deleted = 0'),
+                        postgresql_where=db.text('is_deleted = false'))
+
+    @classmethod
+    def soft_delete_many(cls, ids):
+        """
+        Borrado lógico en bloque: libera las relaciones de todos los registros con sentencias
+        DELETE masivas y los marca como borrados con un único UPDATE por bloque de ids.
+
+        No confirma la transacción.
+
+        Args:
+            ids (iterable): Ids de los registros a borrar.
+
+        Returns:
+            int: Número de registros que estaban activos y se han borrado.
+        """
+        ids = sorted(set(ids))
+        deleted = 0
+        for start in range(0, len(ids), cls.SOFT_DELETE_CHUNK):
+            chunk = ids[start:start + cls.SOFT_DELETE_CHUNK]
+            cls._release_relations(chunk)
+            result = db.session.execute(
+                update(cls).where(cls.id.in_(chunk), cls.is_deleted == False).values(is_deleted=True)
+            )
+            deleted += result.rowcount
+        return deleted
+
+    @classmethod
+    def _release_relations(cls, ids):
+        """
+        Elimina las filas relacionadas que no deben sobrevivir al borrado lógico.
         """
-        return cls.query.filter_by(is_deleted=False)
+
+    def soft_delete(self):
+        """
+        Realiza un borrado lógico del registro y actualiza las relaciones necesarias.
+        """
+        type(self).soft_delete_many([self.id])
+        db.session.commit()
+
+@event.listens_for(db.session, 'do_orm_execute')
+def _exclude_deleted(orm_execute_state):
+    """
+    Añade a todas las consultas ORM el criterio is_deleted = false de los modelos con borrado
+    lógico, tanto en el FROM como en los JOIN y en las colecciones cargadas después
+    (Product.suppliers, Supplier.products, Category.products...).
+
+    Las consultas que necesitan los registros borrados (histórico de ventas y pedidos,
+    exportaciones, conciliaciones) lo indican con .execution_options(include_deleted=True).
+    Las cargas many-to-one (SaleItem.product, Purchase.supplier...) y los refrescos de
+    atributos de objetos ya cargados no se filtran: una línea de venta debe seguir viendo su
+    producto aunque se haya borrado.
+    """
+    if (not orm_execute_state.is_select or orm_execute_state.is_column_load
+            or orm_execute_state.execution_options.get('include_deleted', False)):
+        return
+    if orm_execute_state.is_relationship_load \
+            and orm_execute_state.loader_strategy_path.prop.direction is MANYTOONE:
+        return
+    orm_execute_state.statement = orm_execute_state.statement.options(
+        with_loader_criteria(SoftDeleteMixin, lambda cls: cls.is_deleted == False,
+                             include_aliases=True, propagate_to_loaders=False)
+    )
 
 class User(UserMixin, db.Model):
     """
@@ -39,13 +118,13 @@ class User(UserMixin, db.Model):
         """
         Establece la contraseña del usuario, almacenándola como hash.
         """
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = password_hasher.hash(password)
 
     def check_password(self, password):
         """
         Verifica si la contraseña proporcionada coincide con el hash almacenado.
         """
-        return check_password_hash(self.password_hash, password)
+        return password_hasher.verify(self.password_hash, password)
 
 class Category(db.Model):
     """
@@ -73,13 +152,24 @@ class Product(SoftDeleteMixin, db.Model):
     manufacturer = db.Column(db.String(100), nullable=True)
     category_id = db.Column(db.Integer, db.ForeignKey('category.id'), nullable=False)
     category = db.relationship('Category', back_populates='products')
-    suppliers = db.relationship('Supplier', secondary=supplier_product, back_populates='products',
-                                primaryjoin="and_(Product.id==supplier_product.c.product_id, Supplier.is_deleted==False)")
+    suppliers = db.relationship('Supplier', secondary=supplier_product, back_populates='products')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     sale_items = db.relationship('SaleItem', back_populates='product', cascade="all, delete-orphan")
     purchase_items = db.relationship('PurchaseItem', back_populates='product', cascade="all, delete-orphan")
     cart_items = db.relationship('CartItem', back_populates='product', cascade="all, delete-orphan")
+    # Totales acumulados de ventas, mantenidos en la misma transacción que el checkout
+    units_sold = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    revenue = db.Column(db.Float, nullable=False, default=0, server_default='0')
+
+    # Índices para leer los rankings de productos activos en orden de índice con LIMIT
+    __table_args__ = (
+        db.Index('ix_product_active_units_sold', 'is_deleted', 'units_sold'),
+        db.Index('ix_product_active_revenue', 'is_deleted', 'revenue'),
+        # Índices parciales del listado de productos activos (por nombre y por categoría)
+        SoftDeleteMixin.active_index('ix_product_active_name', 'name'),
+        SoftDeleteMixin.active_index('ix_product_active_category_name', 'category_id', 'name'),
+    )
 
     @hybrid_property
     def is_low_stock(self):
@@ -118,17 +208,76 @@ class Product(SoftDeleteMixin, db.Model):
             return 'low'
         return 'normal'
 
-    def soft_delete(self):
+    def record_sale(self, quantity, price):
         """
-        Realiza un borrado lógico del producto y actualiza las relaciones necesarias.
+        Suma una venta a los totales acumulados del producto.
+
+        Se asigna una expresión SQL para que el incremento se haga de forma atómica en el
+        UPDATE del flush, sin perder ventas concurrentes. Si ya hay un incremento pendiente
+        de este flush se encadena sobre él.
         """
-        self.is_deleted = True
-        for cart_item in self.cart_items:
-            db.session.delete(cart_item)
-        for supplier in list(self.suppliers):  # Crear una copia de la lista
-            if self in supplier.products:  # Verificar si el producto está en la lista del proveedor
-                supplier.products.remove(self)
-        db.session.commit()
+        pending_units = self.__dict__.get('units_sold')
+        pending_revenue = self.__dict__.get('revenue')
+        units_base = pending_units if isinstance(pending_units, ClauseElement) else Product.units_sold
+        revenue_base = pending_revenue if isinstance(pending_revenue, ClauseElement) else Product.revenue
+        self.units_sold = units_base + quantity
+        self.revenue = revenue_base + quantity * price
+
+    def change_stock(self, delta, reason, sale=None, purchase=None):
+        """
+        Modifica el stock del producto y anota el movimiento en el registro de stock.
+
+        Args:
+            delta (int): Unidades que entran (positivo) o salen (negativo).
+            reason (str): Motivo del movimiento (StockMovement.SALE, PURCHASE, ...).
+            sale (Sale): Venta que origina el movimiento, si la hay.
+            purchase (Purchase): Pedido a proveedor que origina el movimiento, si lo hay.
+        """
+        if not delta:
+            return
+        if inspect(self).persistent:
+            # Igual que en record_sale: el UPDATE suma sobre el valor de la fila, sin perder
+            # movimientos concurrentes, y se encadena sobre un cambio pendiente de este flush
+            pending = self.__dict__.get('stock')
+            base = pending if isinstance(pending, ClauseElement) else Product.stock
+            self.stock = base + delta
+        else:
+            self.stock = (self.stock or 0) + delta
+        db.session.add(StockMovement(product=self, delta=delta, reason=reason, sale=sale, purchase=purchase))
+
+    def set_stock(self, stock, reason):
+        """
+        Fija el stock del producto anotando la diferencia como movimiento de stock.
+
+        La diferencia se calcula sobre el stock leído; si hay un cambio pendiente se hace
+        antes el flush para leer el valor actual.
+        """
+        if isinstance(self.__dict__.get('stock'), ClauseElement):
+            db.session.flush()
+        self.change_stock(stock - (self.stock or 0), reason)
+
+    @classmethod
+    def top_selling(cls, limit=10):
+        """
+        Devuelve una consulta con los productos activos más vendidos en unidades.
+        """
+        return cls.get_active().filter(cls.units_sold > 0).order_by(cls.units_sold.desc()).limit(limit)
+
+    @classmethod
+    def most_profitable(cls, limit=10):
+        """
+        Devuelve una consulta con los productos activos con mayores ingresos por ventas.
+        """
+        return cls.get_active().filter(cls.revenue > 0).order_by(cls.revenue.desc()).limit(limit)
+
+    @classmethod
+    def _release_relations(cls, ids):
+        """
+        Quita los productos de los carritos y de sus proveedores.
+        """
+        db.session.execute(db.delete(CartItem).where(CartItem.product_id.in_(ids)),
+                           execution_options={'synchronize_session': False})
+        db.session.execute(supplier_product.delete().where(supplier_product.c.product_id.in_(ids)))
 
 class Supplier(SoftDeleteMixin, db.Model):
     """
@@ -149,13 +298,17 @@ class Supplier(SoftDeleteMixin, db.Model):
     payment_method = db.Column(db.String(50), nullable=True)
     bank_account = db.Column(db.String(50), nullable=True)
     notes = db.Column(db.Text, nullable=True)
-    products = db.relationship('Product', secondary=supplier_product, back_populates='suppliers',
-                               primaryjoin="and_(Supplier.id==supplier_product.c.supplier_id, Product.is_deleted==False)")
+    products = db.relationship('Product', secondary=supplier_product, back_populates='suppliers')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     sales = db.relationship('Sale', back_populates='supplier')
     sale_items = db.relationship('SaleItem', back_populates='supplier')
 
+    # Índice parcial del listado de proveedores activos
+    __table_args__ = (
+        SoftDeleteMixin.active_index('ix_supplier_active_company_name', 'company_name'),
+    )
+
     @property
     def formatted_discount(self):
         """
@@ -170,15 +323,12 @@ class Supplier(SoftDeleteMixin, db.Model):
         """
         return f"{self.iva:.2f}%" if self.iva is not None else "N/A"
 
-    def soft_delete(self):
+    @classmethod
+    def _release_relations(cls, ids):
         """
-        Realiza un borrado lógico del proveedor y actualiza las relaciones necesarias.
+        Quita a los proveedores de los productos que suministraban.
         """
-        self.is_deleted = True
-        for product in list(self.products):  # Crear una copia de la lista
-            if self in product.suppliers:  # Verificar si el proveedor está en la lista del producto
-                product.suppliers.remove(self)
-        db.session.commit()
+        db.session.execute(supplier_product.delete().where(supplier_product.c.supplier_id.in_(ids)))
 
 class Sale(db.Model):
     """
@@ -195,6 +345,11 @@ class Sale(db.Model):
     shipping_address = db.Column(db.String(200), nullable=True)
     payment_method = db.Column(db.String(50), nullable=True)
 
+    # Índice para leer las compras recientes de un usuario sin recorrer toda la tabla
+    __table_args__ = (
+        db.Index('ix_sale_user_date', 'user_id', 'date'),
+    )
+
     @property
     def formatted_total(self):
         """
@@ -313,4 +468,259 @@ class CartItem(db.Model):
         """
         Devuelve el subtotal formateado como una cadena con el símbolo de euro.
         """
-        return f"€{self.subtotal:.2f}"
\ No newline at end of file
+        return f"€{self.subtotal:.2f}"
+
+class UserDailySpend(db.Model):
+    """
+    Modelo de resumen con el gasto diario de cada usuario, actualizado en el checkout.
+    """
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    total = db.Column(db.Float, nullable=False, default=0)
+
+class UserProductSummary(db.Model):
+    """
+    Modelo de resumen con las unidades y el importe comprados por cada usuario de cada producto.
+    """
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), primary_key=True)
+    quantity = db.Column(db.Integer, nullable=False, default=0)
+    total = db.Column(db.Float, nullable=False, default=0)
+
+    product = db.relationship('Product')
+
+    # Índice para obtener el top de productos de un usuario en orden de índice
+    __table_args__ = (
+        db.Index('ix_user_product_summary_user_quantity', 'user_id', 'quantity'),
+    )
+
+class DataVersion(db.Model):
+    """
+    Modelo con un contador de versión por ámbito de datos ('catalog', 'sales', ...).
+
+    Se incrementa en una transacción propia justo después de confirmar cualquier escritura
+    del ámbito (ver data_versions.py) y permite validar cachés y respuestas condicionales con
+    una única consulta barata. Entre la confirmación y el incremento hay un breve intervalo
+    en el que los datos ya han cambiado pero la versión todavía no.
+    """
+    name = db.Column(db.String(32), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+class ProductForecast(db.Model):
+    """
+    Modelo con los parámetros ajustados del pronóstico de demanda diaria de cada producto.
+
+    Guarda el estado de dos modelos (suavizado exponencial simple y estacional ingenuo
+    semanal) y sus errores acumulados, de modo que cada noche se actualiza solo con los
+    días nuevos en lugar de reajustarse desde cero.
+    """
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), primary_key=True)
+    alpha = db.Column(db.Float, nullable=False)
+    level = db.Column(db.Float, nullable=False)
+    # Unidades vendidas los últimos 7 días (de más antiguo a más reciente)
+    recent = db.Column(db.JSON, nullable=False)
+    ses_error = db.Column(db.Float, nullable=False, default=0)
+    ses_count = db.Column(db.Integer, nullable=False, default=0)
+    naive_error = db.Column(db.Float, nullable=False, default=0)
+    naive_count = db.Column(db.Integer, nullable=False, default=0)
+    last_day = db.Column(db.Date, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    @property
+    def method(self):
+        """
+        Modelo con menor error medio absoluto: 'seasonal_naive' o 'ses'.
+        """
+        if self.naive_count and self.ses_count and \
+                self.naive_error / self.naive_count < self.ses_error / self.ses_count:
+            return 'seasonal_naive'
+        return 'ses'
+
+    @property
+    def mae(self):
+        """
+        Error medio absoluto del modelo elegido.
+        """
+        if self.method == 'seasonal_naive':
+            return self.naive_error / self.naive_count
+        return self.ses_error / self.ses_count if self.ses_count else None
+
+    def predict(self, horizon):
+        """
+        Devuelve la demanda prevista para los próximos días a partir de last_day + 1.
+        """
+        if self.method == 'seasonal_naive':
+            return [float(self.recent[i % 7]) for i in range(horizon)]
+        return [self.level] * horizon
+
+class Watermark(db.Model):
+    """
+    Modelo con la última posición (id) procesada por cada tarea incremental.
+    """
+    name = db.Column(db.String(64), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+
+class SupplierScore(db.Model):
+    """
+    Modelo de resumen con las métricas de rendimiento de cada proveedor.
+
+    Lo mantiene la tarea supplier-scores sumando solo los pedidos y ventas nuevos desde
+    su última ejecución; las páginas de proveedores lo leen por clave primaria.
+    """
+    supplier_id = db.Column(db.Integer, db.ForeignKey('supplier.id'), primary_key=True)
+    purchase_count = db.Column(db.Integer, nullable=False, default=0)
+    purchase_units = db.Column(db.Integer, nullable=False, default=0)
+    purchase_total = db.Column(db.Float, nullable=False, default=0)
+    first_purchase_at = db.Column(db.DateTime, nullable=True)
+    last_purchase_at = db.Column(db.DateTime, nullable=True)
+    sales_units = db.Column(db.Integer, nullable=False, default=0)
+    sales_revenue = db.Column(db.Float, nullable=False, default=0)
+    revenue_share = db.Column(db.Float, nullable=False, default=0)
+    # Pedidos por cada 30 días desde el primer pedido
+    purchase_frequency = db.Column(db.Float, nullable=False, default=0)
+    discount = db.Column(db.Float, nullable=False, default=0)
+    # Puntuación 0-100 combinando los percentiles de las métricas anteriores
+    score = db.Column(db.Float, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    supplier = db.relationship('Supplier', backref=db.backref('score', uselist=False, lazy=True))
+
+class InventorySnapshot(db.Model):
+    """
+    Modelo de solo inserción con el stock y el valor de un producto en la fecha de una foto.
+
+    Solo se guarda una fila cuando el stock o el valor cambian respecto a la foto anterior
+    del producto: el estado en una fecha es la última fila con day <= fecha.
+    """
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    stock = db.Column(db.Integer, nullable=False)
+    value = db.Column(db.Float, nullable=False)
+
+class CategoryInventorySnapshot(db.Model):
+    """
+    Modelo de solo inserción con los totales de inventario de cada categoría en cada foto.
+    """
+    day = db.Column(db.Date, primary_key=True)
+    category_id = db.Column(db.Integer, db.ForeignKey('category.id'), primary_key=True)
+    products = db.Column(db.Integer, nullable=False)
+    stock = db.Column(db.Integer, nullable=False)
+    value = db.Column(db.Float, nullable=False)
+
+class StockMovement(db.Model):
+    """
+    Modelo de solo inserción con cada cambio del stock de un producto.
+
+    El stock de un producto en cualquier momento es el de su último punto de control
+    (StockCheckpoint) más la suma de los movimientos posteriores.
+    """
+    INITIAL = 'initial'
+    SALE = 'sale'
+    PURCHASE = 'purchase'
+    ADJUSTMENT = 'adjustment'
+
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
+    delta = db.Column(db.Integer, nullable=False)
+    reason = db.Column(db.String(20), nullable=False)
+    # Sin clave foránea: al archivar una venta o pedido su id se conserva en las tablas de archivo
+    sale_id = db.Column(db.Integer, nullable=True)
+    purchase_id = db.Column(db.Integer, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    product = db.relationship('Product')
+    sale = db.relationship('Sale', primaryjoin='foreign(StockMovement.sale_id) == Sale.id')
+    purchase = db.relationship('Purchase', primaryjoin='foreign(StockMovement.purchase_id) == Purchase.id')
+
+    # Índice para sumar los movimientos de un producto posteriores a un punto de control
+    __table_args__ = (
+        db.Index('ix_stock_movement_product_id', 'product_id', 'id'),
+    )
+
+class StockCheckpoint(db.Model):
+    """
+    Modelo con el stock de un producto tras aplicar todos sus movimientos hasta movement_id.
+    """
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), primary_key=True)
+    movement_id = db.Column(db.Integer, primary_key=True)
+    stock = db.Column(db.Integer, nullable=False)
+    # Fecha del último movimiento incluido en el punto de control
+    created_at = db.Column(db.DateTime, nullable=False)
+
+class IdempotencyKey(db.Model):
+    """
+    Modelo con la respuesta de una petición enviada con clave de idempotencia, para devolverla
+    sin repetir la operación cuando el cliente reintenta con la misma clave.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    endpoint = db.Column(db.String(64), nullable=False)
+    key = db.Column(db.String(64), nullable=False)
+    # Huella de los datos de la petición original: la misma clave con otros datos se rechaza
+    fingerprint = db.Column(db.String(64), nullable=False)
+    # None mientras la petición original se está procesando
+    status_code = db.Column(db.Integer, nullable=True)
+    response_body = db.Column(db.Text)
+    content_type = db.Column(db.String(100))
+    location = db.Column(db.String(500))
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'endpoint', 'key', name='uq_idempotency_key'),
+        db.Index('ix_idempotency_key_created_at', 'created_at'),
+    )
+
+class ArchivedSaleItem(db.Model):
+    """
+    Modelo desnormalizado de las líneas de venta archivadas (ver archive.py).
+
+    Cada fila conserva el id del SaleItem original junto con los datos de su venta, usuario,
+    producto y proveedor en el momento de archivarla, de modo que el historial se consulta
+    sin joins y puede guardarse en otra base de datos (bind 'archive').
+    """
+    __bind_key__ = 'archive'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    sale_id = db.Column(db.Integer, nullable=False)
+    date = db.Column(db.DateTime, nullable=False)
+    user_id = db.Column(db.Integer, nullable=False)
+    username = db.Column(db.String(64))
+    email = db.Column(db.String(120))
+    sale_total = db.Column(db.Float, nullable=False)
+    shipping_address = db.Column(db.String(200))
+    payment_method = db.Column(db.String(50))
+    product_id = db.Column(db.Integer, nullable=False)
+    product_name = db.Column(db.String(100))
+    category_id = db.Column(db.Integer)
+    supplier_id = db.Column(db.Integer)
+    supplier_name = db.Column(db.String(100))
+    quantity = db.Column(db.Integer, nullable=False)
+    price = db.Column(db.Float, nullable=False)
+    archived_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_archived_sale_item_user_date', 'user_id', 'date'),
+        db.Index('ix_archived_sale_item_date', 'date'),
+    )
+
+class ArchivedPurchaseItem(db.Model):
+    """
+    Modelo desnormalizado de las líneas de pedidos a proveedores archivadas (ver archive.py).
+    """
+    __bind_key__ = 'archive'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    purchase_id = db.Column(db.Integer, nullable=False)
+    date = db.Column(db.DateTime, nullable=False)
+    supplier_id = db.Column(db.Integer, nullable=False)
+    supplier_name = db.Column(db.String(100))
+    purchase_total = db.Column(db.Float, nullable=False)
+    product_id = db.Column(db.Integer, nullable=False)
+    product_name = db.Column(db.String(100))
+    quantity = db.Column(db.Integer, nullable=False)
+    price = db.Column(db.Float, nullable=False)
+    archived_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_archived_purchase_item_date', 'date'),
+    )
@@ -0,0 +1,94 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.security import generate_password_hash, check_password_hash
+
+
+class PasswordHashingBusy(Exception):
+    """
+    Se lanza cuando la cola de cálculo de hashes está llena y no se libera a tiempo.
+    """
+
+
+class PasswordHasher:
+    """
+    Servicio de hashing de contraseñas con método y coste configurables.
+
+    Los hashes se calculan en un pool de hilos acotado (PASSWORD_HASH_WORKERS): hashlib
+    libera el GIL durante PBKDF2, así que los hilos de las peticiones esperan sin consumir
+    CPU y una ráfaga de logins no puede ocupar más núcleos que los del pool. Si hay más de
+    PASSWORD_HASH_MAX_QUEUE peticiones esperando, las nuevas fallan con PasswordHashingBusy
+    tras PASSWORD_HASH_QUEUE_TIMEOUT segundos en lugar de acumularse.
+    """
+
+    def __init__(self):
+        self.method = 'pbkdf2:sha256'
+        self.salt_length = 16
+        self.prefix = None
+        self.executor = None
+        self.slots = None
+        self.queue_timeout = None
+        self.dummy_hash = None
+
+    def init_app(self, app):
+        self.method = app.config['PASSWORD_HASH_METHOD']
+        self.salt_length = app.config['PASSWORD_SALT_LENGTH']
+        # Prefijo normalizado del método (p. ej. 'pbkdf2:sha256' -> 'pbkdf2:sha256:260000')
+        self.dummy_hash = generate_password_hash('', self.method, self.salt_length)
+        self.prefix = self.dummy_hash.split('$', 1)[0]
+
+        workers = app.config['PASSWORD_HASH_WORKERS']
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+        self.slots = threading.BoundedSemaphore(workers + app.config['PASSWORD_HASH_MAX_QUEUE'])
+        self.queue_timeout = app.config['PASSWORD_HASH_QUEUE_TIMEOUT']
+        app.extensions['password_hasher'] = self
+
+    def _run(self, func, *args):
+        """
+        Ejecuta el cálculo en el pool (o en el hilo actual si el servicio no está inicializado).
+        """
+        if self.executor is None:
+            return func(*args)
+        if not self.slots.acquire(timeout=self.queue_timeout):
+            raise PasswordHashingBusy()
+        try:
+            return self.executor.submit(func, *args).result()
+        finally:
+            self.slots.release()
+
+    def hash(self, password):
+        """
+        Devuelve el hash de la contraseña con el método y la sal configurados.
+        """
+        return self._run(generate_password_hash, password, self.method, self.salt_length)
+
+    def hash_many(self, passwords):
+        """
+        Calcula en paralelo los hashes de varias contraseñas (para cargas masivas).
+        """
+        if self.executor is None:
+            return [generate_password_hash(p, self.method, self.salt_length) for p in passwords]
+        return list(self.executor.map(lambda p: generate_password_hash(p, self.method, self.salt_length), passwords))
+
+    def verify(self, password_hash, password):
+        """
+        Comprueba la contraseña frente al hash almacenado.
+
+        Si no hay hash (usuario inexistente) se verifica igualmente contra un hash ficticio
+        para que la respuesta tarde lo mismo y no revele qué usuarios existen.
+        """
+        if not password_hash:
+            self._run(check_password_hash, self.dummy_hash or generate_password_hash(''), password)
+            return False
+        return self._run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        """
+        Indica si el hash se generó con un método, coste o longitud de sal distintos de los actuales.
+        """
+        if not password_hash or '$' not in password_hash or self.prefix is None:
+            return False
+        prefix, salt = password_hash.split('$', 2)[:2]
+        return prefix != self.prefix or len(salt) != self.salt_length
+
+
+password_hasher = PasswordHasher()
@@ -1,9 +1,10 @@
 from main import create_app
 from extensions import db
-from models import User, Product, Supplier, Sale, Purchase, Category, SaleItem, PurchaseItem
+from models import User, Product, Supplier, Sale, Purchase, Category, SaleItem, PurchaseItem, StockMovement
 from datetime import datetime, timedelta, UTC
 import random
-from werkzeug.security import generate_password_hash
+from passwords import password_hasher
+from summaries import rebuild_user_summaries
 
 def create_realistic_suppliers():
     """
@@ -92,14 +93,16 @@ def populate_db():
 
     # Crear usuario administrador
     admin = User(username='admin', email='admin@example.com', is_admin=True)
-    admin.password_hash = generate_password_hash('admin123')
     db.session.add(admin)
 
     # Crear usuarios normales
-    for i in range(10):
-        user = User(username=f'user{i}', email=f'user{i}@example.com', is_admin=False)
-        user.password_hash = generate_password_hash(f'password{i}')
-        db.session.add(user)
+    users = [User(username=f'user{i}', email=f'user{i}@example.com', is_admin=False) for i in range(10)]
+    db.session.add_all(users)
+
+    # Los hashes se calculan en paralelo en el pool del servicio de contraseñas
+    hashes = password_hasher.hash_many(['admin123'] + [f'password{i}' for i in range(10)])
+    for user, password_hash in zip([admin] + users, hashes):
+        user.password_hash = password_hash
 
     db.session.commit()
     print("Usuarios creados.")
@@ -127,7 +130,7 @@ def populate_db():
             name=product_data['name'],
             description=product_data['description'],
             price=product_data['price'],
-            stock=product_data['stock'],
+            stock=0,
             min_stock=product_data['min_stock'],
             location=product_data['location'],
             reference_number=product_data['reference_number'],
@@ -137,6 +140,7 @@ def populate_db():
             dimensions=product_data['dimensions'],
             manufacturer=product_data['manufacturer']
         )
+        new_product.change_stock(product_data['stock'], StockMovement.INITIAL)
         db.session.add(new_product)
     db.session.commit()
     print("100 productos nuevos creados.")
@@ -153,8 +157,8 @@ def populate_db():
     # Modificar algunos productos existentes para tener stock bajo
     low_stock_products = random.sample(products, 20)  # Seleccionar 20 productos al azar
     for product in low_stock_products:
-        product.stock = random.randint(0,
-                                       int(product.min_stock * 0.9))  # Establecer stock por debajo del 90% del min_stock
+        product.set_stock(random.randint(0, int(product.min_stock * 0.9)),  # Establecer stock por debajo del 90% del min_stock
+                          StockMovement.ADJUSTMENT)
     db.session.commit()
     print("20 productos modificados para tener stock bajo.")
 
@@ -186,8 +190,11 @@ def populate_db():
             db.session.add(sale_item)
             sale.total += quantity * product.price
 
-            # Actualizar el stock del producto
-            product.stock = max(0, product.stock - quantity)
+            # Actualizar el stock y los contadores de ventas del producto (el flush deja
+            # leer el stock si el producto ya tenía un cambio pendiente en esta venta)
+            db.session.flush()
+            product.change_stock(-min(quantity, product.stock), StockMovement.SALE, sale=sale)
+            product.record_sale(quantity, product.price)
 
         db.session.add(sale)
 
@@ -212,13 +219,17 @@ def populate_db():
             purchase.total += quantity * purchase_item.price
 
             # Actualizar el stock del producto
-            product.stock += quantity
+            product.change_stock(quantity, StockMovement.PURCHASE, purchase=purchase)
 
         db.session.add(purchase)
 
     db.session.commit()
     print("Ventas y compras de ejemplo añadidas a la base de datos.")
 
+    # Generar los resúmenes de compras por usuario a partir de las ventas creadas
+    rebuild_user_summaries()
+    print("Resúmenes de compras por usuario generados.")
+
     print("Proceso de población de la base de datos completado.")
 
 
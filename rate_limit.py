@@ -0,0 +1,185 @@
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from math import ceil
+from flask import current_app, request, jsonify
+from flask_login import current_user
+from werkzeug.exceptions import TooManyRequests
+from werkzeug.utils import import_string
+
+
+class LocalBackend:
+    """
+    Almacén de cubetas de tokens en memoria del proceso.
+
+    Cada worker limita por separado, así que el límite efectivo se multiplica por el número
+    de procesos; para compartirlo debe sustituirse por un backend común (Redis...) que
+    implemente consume() y peek().
+    """
+
+    def __init__(self, app_config):
+        self.max_keys = app_config['RATE_LIMIT_MAX_KEYS']
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def consume(self, key, capacity, period, cost=1):
+        """
+        Gasta cost tokens de la cubeta de la clave, que se rellena a razón de capacity tokens
+        cada period segundos.
+
+        Returns:
+            float: 0 si había tokens suficientes, o los segundos que faltan para que los haya.
+        """
+        rate = capacity / period
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated = self.buckets.pop(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            if tokens >= cost:
+                tokens -= cost
+                wait = 0
+            else:
+                wait = (cost - tokens) / rate
+            self.buckets[key] = (tokens, now)
+            # Las cubetas menos usadas se descartan (equivale a dejarlas llenas)
+            while len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+        return wait
+
+    def peek(self, key, capacity, period):
+        """
+        Comprueba si la cubeta de la clave tiene al menos un token, sin gastarlo.
+
+        Returns:
+            float: 0 si hay un token disponible, o los segundos que faltan para que lo haya.
+        """
+        rate = capacity / period
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated = self.buckets.get(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - updated) * rate)
+        return 0 if tokens >= 1 else (1 - tokens) / rate
+
+    def reset(self):
+        with self.lock:
+            self.buckets.clear()
+
+
+BACKENDS = {
+    'local': LocalBackend
+}
+
+
+def _client_ip():
+    """
+    Dirección del cliente. Detrás de un proxy inverso debe aplicarse ProxyFix para que
+    remote_addr sea la del cliente y no la del proxy.
+    """
+    return request.remote_addr or 'unknown'
+
+
+def _form_username():
+    return (request.form.get('username') or '').strip().lower() or None
+
+
+def _user_id():
+    return str(current_user.id) if current_user.is_authenticated else None
+
+
+# Funciones que obtienen el valor de cada tipo de clave de la petición
+KEY_FUNCTIONS = {
+    'ip': _client_ip,
+    'username': _form_username,
+    'user': _user_id
+}
+
+
+def parse_limit(value):
+    """
+    Convierte un límite 'N/segundos' (p. ej. '20/60') en la tupla (capacidad, periodo).
+    """
+    capacity, period = value.split('/')
+    return int(capacity), float(period)
+
+
+class RateLimiter:
+    """
+    Limitador de peticiones con cubetas de tokens por IP, nombre de usuario o usuario
+    autenticado y un backend de almacenamiento intercambiable.
+    """
+
+    def __init__(self):
+        self.backend = None
+
+    def init_app(self, app):
+        """
+        Crea el backend indicado en RATE_LIMIT_BACKEND ('local' o ruta 'modulo.Clase').
+        """
+        backend = app.config['RATE_LIMIT_BACKEND']
+        backend_class = BACKENDS[backend] if backend in BACKENDS else import_string(backend)
+        self.backend = backend_class(app.config)
+        app.extensions['rate_limiter'] = self
+
+    def check(self, scope, keys, peek=False):
+        """
+        Gasta un token de cada cubeta aplicable a la petición actual.
+
+        Args:
+            scope (str): Ámbito del límite ('login', 'cart'...).
+            keys (tuple): Tipos de clave ('ip', 'username', 'user'); cada uno usa el límite
+                RATE_LIMITS['<ámbito>:<tipo>'].
+            peek (bool): Si es True solo comprueba que quedan tokens, sin gastarlos.
+
+        Returns:
+            float: 0 si la petición puede continuar, o los segundos que debe esperar el cliente.
+        """
+        if not current_app.config['RATE_LIMIT_ENABLED']:
+            return 0
+        limits = current_app.config['RATE_LIMITS']
+        for key_type in keys:
+            value = KEY_FUNCTIONS[key_type]()
+            limit = limits.get(f'{scope}:{key_type}')
+            if value is None or limit is None:
+                continue
+            capacity, period = parse_limit(limit)
+            bucket = f'{scope}:{key_type}:{value}'
+            wait = self.backend.peek(bucket, capacity, period) if peek else self.backend.consume(bucket, capacity, period)
+            if wait:
+                current_app.logger.warning(f"Límite de peticiones superado: {scope} por {key_type} {value}")
+                return wait
+        return 0
+
+    def limit(self, scope, keys, methods=('POST',), json=False):
+        """
+        Decorador que rechaza con 429 las peticiones que superan los límites del ámbito antes
+        de ejecutar la vista (y, por tanto, antes de cualquier hash o consulta).
+
+        Debe colocarse debajo de @login_required cuando se limite por usuario.
+
+        Args:
+            scope (str): Ámbito del límite.
+            keys (tuple): Tipos de clave a limitar.
+            methods (tuple): Métodos HTTP a los que se aplica el límite.
+            json (bool): Si es True la respuesta de rechazo es JSON en lugar de una página.
+        """
+        def decorator(view):
+            @wraps(view)
+            def wrapped(*args, **kwargs):
+                if current_app.config['RATE_LIMIT_ENABLED'] and request.method in methods:
+                    wait = self.check(scope, keys)
+                    if wait:
+                        retry_after = ceil(wait)
+                        if json:
+                            response = jsonify({'success': False,
+                                                'error': 'Demasiadas peticiones. Inténtalo de nuevo más tarde.'})
+                            response.status_code = 429
+                            response.headers['Retry-After'] = str(retry_after)
+                            return response
+                        raise TooManyRequests(retry_after=retry_after)
+                return view(*args, **kwargs)
+            return wrapped
+        return decorator
+
+
+limiter = RateLimiter()
@@ -1,23 +1,97 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify, abort, make_response, current_app
+from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify, abort, make_response, current_app, Response, g
 from flask_login import login_user, logout_user, login_required, current_user
 from sqlalchemy import func, or_, desc, extract
+from sqlalchemy.orm import joinedload
 from datetime import datetime, timedelta, date
-from models import User, Product, Supplier, Sale, Purchase, CartItem, Category, SaleItem, PurchaseItem
+from models import User, Product, Supplier, Sale, Purchase, Category, SaleItem, PurchaseItem, UserDailySpend, UserProductSummary, ProductForecast, SupplierScore, StockMovement, ArchivedSaleItem, ArchivedPurchaseItem, supplier_product
 from flask_wtf import FlaskForm
 from flask_wtf.csrf import generate_csrf
 from extensions import db, csrf
+from db_routing import read_only
+from summaries import record_user_sale, compute_category_sales
+from archive import HistoryPagination
+from analytics_export import start_export, export_status, ExportInProgress
+from analytics import cached_sales_trends, cached_abc_report
+from forecasting import product_forecast
+from inventory_snapshots import inventory_at, inventory_history, product_inventory_at
+from data_versions import get_versions
+from http_cache import conditional
+from streaming import stream_json, JsonArray
+from fragment_cache import product_fragment_key, listing_fragment_key
+from events import broker, format_sse, ADMIN_CHANNEL, CLIENTS_CHANNEL, user_channel, publish_sale, publish_purchase, publish_product_change
 from forms import LoginForm, RegistrationForm, ProductForm, SupplierForm, AddToCartForm, DeleteForm, RemoveFromCartForm, CheckoutForm
 from sqlalchemy.exc import IntegrityError
+from werkzeug.exceptions import TooManyRequests
 import random
 import string
+import time
 import traceback
-from werkzeug.security import check_password_hash, generate_password_hash
+from math import ceil
+from passwords import password_hasher, PasswordHashingBusy
+from rate_limit import limiter
+from cart_store import current_cart, CartFull
+from idempotency import idempotent, mark_completed
 import re
 
 # Definición de blueprints
 main_bp = Blueprint('main', __name__)
 auth_bp = Blueprint('auth', __name__)
 
+# Funciones de versión para las respuestas condicionales (ETag / Last-Modified)
+def dashboard_version(*args, **kwargs):
+    """
+    Versión de los datos del dashboard: ventas, compras y catálogo, más el día actual
+    porque la ventana de 30 días se desplaza cada día.
+    """
+    versions = get_versions('sales', 'purchases', 'catalog')
+    return (sorted(versions.items()), datetime.utcnow().date()), None
+
+def statistics_version(*args, **kwargs):
+    """
+    Versión de los datos de estadísticas.
+    """
+    versions = get_versions('sales', 'purchases', 'catalog', 'users')
+    return (sorted(versions.items()),), None
+
+def catalog_version(*args, **kwargs):
+    """
+    Versión del catálogo de productos, usada por el listado de productos.
+    """
+    return (get_versions('catalog')['catalog'],), None
+
+def product_version(product_id):
+    """
+    Versión de un producto a partir de su updated_at y del de sus proveedores activos.
+    """
+    row = db.session.query(
+        Product.updated_at,
+        func.max(Supplier.updated_at),
+        func.count(Supplier.id),
+        func.sum(Supplier.id)
+    ).outerjoin(supplier_product, Product.id == supplier_product.c.product_id) \
+        .outerjoin(Supplier, Supplier.id == supplier_product.c.supplier_id) \
+        .filter(Product.id == product_id).group_by(Product.id).first()
+    if row is None:
+        return None
+    updated_at, suppliers_updated_at = row[0], row[1]
+    last_modified = max(d for d in (updated_at, suppliers_updated_at) if d is not None) if updated_at else None
+    return tuple(row), last_modified
+
+def product_detail_version(product_id):
+    """
+    Versión del detalle de producto: la del producto más la de su pronóstico de demanda,
+    que se muestra a los administradores y se actualiza cada noche.
+
+    La versión del producto se guarda en g para que la vista la reutilice en la clave del
+    fragmento cacheado sin repetir la consulta.
+    """
+    version = product_version(product_id)
+    if version is None:
+        return None
+    g.product_version = version[0]
+    forecast_updated_at = db.session.query(ProductForecast.updated_at).filter_by(product_id=product_id).scalar()
+    return version[0] + (forecast_updated_at,), version[1]
+
 # Ruta principal
 @main_bp.route('/')
 def index():
@@ -31,20 +105,42 @@ def index():
 
 # Ruta de login
 @auth_bp.route('/login', methods=['GET', 'POST'])
+@limiter.limit('login', ('ip',))
 def login():
     """
     Maneja el proceso de inicio de sesión de usuarios.
+
+    El límite por IP se aplica a todas las peticiones; el límite por nombre de usuario solo
+    cuenta los intentos fallidos, para que nadie pueda bloquear una cuenta con peticiones
+    inválidas o inicios de sesión correctos.
     """
     if current_user.is_authenticated:
         return redirect(url_for('main.dashboard'))
 
     form = LoginForm()
     if form.validate_on_submit():
+        # Con la cubeta del usuario vacía se rechaza antes de comprobar la contraseña
+        wait = limiter.check('login', ('username',), peek=True)
+        if wait:
+            raise TooManyRequests(retry_after=ceil(wait))
         user = User.query.filter_by(username=form.username.data).first()
-        if user and check_password_hash(user.password_hash, form.password.data):
+        try:
+            valid = password_hasher.verify(user.password_hash if user else None, form.password.data)
+        except PasswordHashingBusy:
+            form.username.errors.append('El servidor está ocupado. Por favor, inténtalo de nuevo en unos segundos.')
+            return render_template('login.html', form=form), 503
+        if valid:
+            # Regenerar el hash si se creó con parámetros anteriores a los configurados
+            if password_hasher.needs_rehash(user.password_hash):
+                try:
+                    user.set_password(form.password.data)
+                    db.session.commit()
+                except PasswordHashingBusy:
+                    pass
             login_user(user)
             next_page = request.args.get('next')
             return redirect(next_page or url_for('main.dashboard'))
+        limiter.check('login', ('username',))
         form.username.errors.append('Usuario o contraseña inválidos')
     return render_template('login.html', form=form)
 
@@ -60,6 +156,7 @@ def logout():
 
 # Ruta de registro
 @auth_bp.route('/register', methods=['GET', 'POST'])
+@limiter.limit('register', ('ip',))
 def register():
     """
     Maneja el proceso de registro de nuevos usuarios.
@@ -83,8 +180,8 @@ def register():
                 return render_template('register.html', form=form)
 
             # Crear nuevo usuario
-            hashed_password = generate_password_hash(form.password.data)
-            new_user = User(username=form.username.data, email=form.email.data, password_hash=hashed_password)
+            new_user = User(username=form.username.data, email=form.email.data)
+            new_user.set_password(form.password.data)
             db.session.add(new_user)
             db.session.commit()
 
@@ -92,6 +189,9 @@ def register():
             flash('Registro exitoso. Por favor, inicia sesión.', 'success')
 
             return redirect(url_for('auth.login'))
+        except PasswordHashingBusy:
+            flash('El servidor está ocupado. Por favor, inténtalo de nuevo en unos segundos.', 'error')
+            return render_template('register.html', form=form), 503
         except Exception as e:
             db.session.rollback()
             current_app.logger.error(f"Error durante el registro de usuario: {str(e)}")
@@ -165,21 +265,19 @@ def admin_dashboard():
             purchases.append(data["purchases"])
             profits.append(data["sales"] - data["purchases"])
 
-        # Obtener productos más vendidos
-        top_selling_products = db.session.query(
+        # Obtener productos más vendidos (contadores acumulados, lectura ordenada por índice)
+        top_selling_products = Product.top_selling(10).with_entities(
             Product.id,
             Product.name,
-            func.sum(SaleItem.quantity).label('total_quantity')
-        ).join(SaleItem).filter(Product.is_deleted == False).group_by(Product.id, Product.name) \
-            .order_by(func.sum(SaleItem.quantity).desc()).limit(10).all()
+            Product.units_sold.label('total_quantity')
+        ).all()
 
         # Obtener productos más rentables
-        most_profitable_products = db.session.query(
+        most_profitable_products = Product.most_profitable(10).with_entities(
             Product.id,
             Product.name,
-            func.sum(SaleItem.quantity * SaleItem.price).label('total_sales')
-        ).join(SaleItem).filter(Product.is_deleted == False).group_by(Product.id, Product.name) \
-            .order_by(func.sum(SaleItem.quantity * SaleItem.price).desc()).limit(10).all()
+            Product.revenue.label('total_sales')
+        ).all()
 
         return render_template('admin_dashboard.html',
                                dates=dates,
@@ -214,48 +312,21 @@ def client_dashboard():
             .join(SaleItem, Sale.id == SaleItem.sale_id) \
             .join(Product, SaleItem.product_id == Product.id) \
             .filter(Sale.user_id == current_user.id) \
+            .execution_options(include_deleted=True) \
             .order_by(Sale.date.desc()).limit(50).all()
 
-        # Obtener datos de compras del usuario
-        user_purchases = db.session.query(
-            func.date(Sale.date).label('date'),
-            func.sum(SaleItem.quantity * SaleItem.price).label('total')
-        ).join(SaleItem).filter(Sale.user_id == current_user.id, Sale.date.between(start_date, end_date)) \
-            .group_by(func.date(Sale.date)).order_by(func.date(Sale.date)).all()
-
-        user_purchases_data = [
-            {'date': item.date.strftime('%Y-%m-%d') if isinstance(item.date, datetime) else str(item.date),
-             'total': float(item.total)} for item in user_purchases]
-
-        # Asegurar que haya datos para todos los días
-        all_dates = {(start_date + timedelta(days=x)).strftime('%Y-%m-%d'): 0 for x in range(31)}
-        for purchase in user_purchases_data:
-            all_dates[purchase['date']] = purchase['total']
-        user_purchases_data = [{'date': date, 'total': total} for date, total in all_dates.items()]
+        # Obtener el gasto diario del usuario (tabla de resumen, como máximo 31 filas)
+        user_purchases_data = get_user_daily_spend(current_user.id, start_date, end_date)
 
         # Top 10 productos comprados por el usuario
-        user_top_products = db.session.query(
-            Product.id,
-            Product.name,
-            func.sum(SaleItem.quantity).label('total_quantity'),
-            func.sum(SaleItem.quantity * SaleItem.price).label('total_sales')
-        ).join(SaleItem, Product.id == SaleItem.product_id) \
-            .join(Sale, SaleItem.sale_id == Sale.id) \
-            .filter(Sale.user_id == current_user.id, Product.is_deleted == False) \
-            .group_by(Product.id, Product.name) \
-            .order_by(func.sum(SaleItem.quantity).desc()) \
-            .limit(10).all()
+        user_top_products = get_user_top_products(current_user.id, active_only=True).all()
 
         # Top 10 productos más vendidos en general
-        top_sold_products = db.session.query(
+        top_sold_products = Product.top_selling(10).with_entities(
             Product.id,
             Product.name,
-            func.sum(SaleItem.quantity).label('total_quantity')
-        ).join(SaleItem, Product.id == SaleItem.product_id) \
-            .filter(Product.is_deleted == False) \
-            .group_by(Product.id, Product.name) \
-            .order_by(func.sum(SaleItem.quantity).desc()) \
-            .limit(10).all()
+            Product.units_sold.label('total_quantity')
+        ).all()
 
         return render_template('client_dashboard.html',
                                recent_purchases=recent_purchases,
@@ -267,9 +338,45 @@ def client_dashboard():
         return render_template('error.html',
                                error_message="Ocurrió un error al cargar el dashboard. Por favor, inténtalo de nuevo más tarde."), 500
 
+def get_user_daily_spend(user_id, start_date, end_date):
+    """
+    Devuelve el gasto diario del usuario entre dos fechas, con un valor para cada día.
+
+    Lee la tabla de resumen UserDailySpend, por lo que el coste no depende del número de
+    compras del usuario.
+    """
+    rows = UserDailySpend.query.filter(
+        UserDailySpend.user_id == user_id,
+        UserDailySpend.day.between(start_date.date(), end_date.date())
+    ).all()
+
+    # Asegurar que haya datos para todos los días
+    all_dates = {(start_date + timedelta(days=x)).strftime('%Y-%m-%d'): 0 for x in range(31)}
+    for row in rows:
+        all_dates[row.day.strftime('%Y-%m-%d')] = float(row.total)
+    return [{'date': date, 'total': total} for date, total in all_dates.items()]
+
+def get_user_top_products(user_id, limit=10, active_only=False):
+    """
+    Devuelve una consulta con los productos más comprados por el usuario, leída de la tabla
+    de resumen UserProductSummary en orden de índice.
+    """
+    query = db.session.query(
+        Product.id,
+        Product.name,
+        UserProductSummary.quantity.label('total_quantity'),
+        UserProductSummary.total.label('total_sales')
+    ).join(Product, UserProductSummary.product_id == Product.id) \
+        .filter(UserProductSummary.user_id == user_id)
+    if not active_only:
+        query = query.execution_options(include_deleted=True)
+    return query.order_by(UserProductSummary.quantity.desc()).limit(limit)
+
 # Ruta para refrescar datos del dashboard
 @main_bp.route('/api/refresh_dashboard_data')
 @login_required
+@read_only
+@conditional(dashboard_version)
 def refresh_dashboard_data():
     """
     API para refrescar los datos del dashboard según el tipo de usuario.
@@ -305,11 +412,11 @@ def refresh_admin_dashboard_data():
 
     # Llenar el diccionario con los datos reales
     for sale in sales_data:
-        date_str = sale.date.strftime('%Y-%m-%d')
+        date_str = sale.date.strftime('%Y-%m-%d') if isinstance(sale.date, datetime) else str(sale.date)
         all_dates[date_str]["sales"] = float(sale.total)
 
     for purchase in purchases_data:
-        date_str = purchase.date.strftime('%Y-%m-%d')
+        date_str = purchase.date.strftime('%Y-%m-%d') if isinstance(purchase.date, datetime) else str(purchase.date)
         all_dates[date_str]["purchases"] = float(purchase.total)
 
     # Calcular beneficios y preparar datos para los gráficos
@@ -322,29 +429,13 @@ def refresh_admin_dashboard_data():
             'profit': data["sales"] - data["purchases"]
         })
 
-    # Productos más vendidos
-    top_selling_products = db.session.query(
-        Product.id,
-        Product.name,
-        func.sum(SaleItem.quantity).label('total_quantity')
-    ).join(SaleItem).group_by(Product.id, Product.name) \
-        .order_by(func.sum(SaleItem.quantity).desc()).limit(10).all()
-
-    # Filtrar productos que ya no existen
-    top_selling_products = [{'id': p.id, 'name': p.name, 'total_quantity': p.total_quantity}
-                            for p in top_selling_products if p.name is not None]
+    # Productos más vendidos (contadores acumulados, lectura ordenada por índice)
+    top_selling_products = [{'id': p.id, 'name': p.name, 'total_quantity': p.units_sold}
+                            for p in Product.top_selling(10)]
 
     # Productos más rentables
-    most_profitable_products = db.session.query(
-        Product.id,
-        Product.name,
-        func.sum(SaleItem.quantity * SaleItem.price).label('total_sales')
-    ).join(SaleItem).group_by(Product.id, Product.name) \
-        .order_by(func.sum(SaleItem.quantity * SaleItem.price).desc()).limit(10).all()
-
-    # Filtrar productos que ya no existen
-    most_profitable_products = [{'id': p.id, 'name': p.name, 'total_sales': float(p.total_sales)}
-                                for p in most_profitable_products if p.name is not None]
+    most_profitable_products = [{'id': p.id, 'name': p.name, 'total_sales': float(p.revenue)}
+                                for p in Product.most_profitable(10)]
 
     return jsonify({
         'chart_data': chart_data,
@@ -373,6 +464,7 @@ def refresh_client_dashboard_data():
         .join(SaleItem, Sale.id == SaleItem.sale_id) \
         .join(Product, SaleItem.product_id == Product.id) \
         .filter(Sale.user_id == current_user.id) \
+        .execution_options(include_deleted=True) \
         .order_by(Sale.date.desc()).limit(50).all()
 
     recent_purchases_data = [{
@@ -385,35 +477,11 @@ def refresh_client_dashboard_data():
         'sale_total': float(purchase.sale_total)
     } for purchase in recent_purchases]
 
-    # Obtener datos de compras del usuario
-    user_purchases = db.session.query(
-        func.date(Sale.date).label('date'),
-        func.sum(SaleItem.quantity * SaleItem.price).label('total')
-    ).join(SaleItem).filter(Sale.user_id == current_user.id, Sale.date.between(start_date, end_date)) \
-        .group_by(func.date(Sale.date)).order_by(func.date(Sale.date)).all()
-
-    user_purchases_data = [
-        {'date': item.date.strftime('%Y-%m-%d'),
-         'total': float(item.total)} for item in user_purchases]
-
-    # Asegurarse de que haya datos para todos los días
-    all_dates = {(start_date + timedelta(days=x)).strftime('%Y-%m-%d'): 0 for x in range(31)}
-    for purchase in user_purchases_data:
-        all_dates[purchase['date']] = purchase['total']
-    user_purchases_data = [{'date': date, 'total': total} for date, total in all_dates.items()]
+    # Obtener el gasto diario del usuario (tabla de resumen, como máximo 31 filas)
+    user_purchases_data = get_user_daily_spend(current_user.id, start_date, end_date)
 
     # Top 10 productos comprados por el usuario
-    user_top_products = db.session.query(
-        Product.id,
-        Product.name,
-        func.sum(SaleItem.quantity).label('total_quantity'),
-        func.sum(SaleItem.quantity * SaleItem.price).label('total_sales')
-    ).join(SaleItem, Product.id == SaleItem.product_id) \
-        .join(Sale, SaleItem.sale_id == Sale.id) \
-        .filter(Sale.user_id == current_user.id) \
-        .group_by(Product.id, Product.name) \
-        .order_by(func.sum(SaleItem.quantity).desc()) \
-        .limit(10).all()
+    user_top_products = get_user_top_products(current_user.id).all()
 
     user_top_products_data = [{
         'id': product.id,
@@ -423,20 +491,11 @@ def refresh_client_dashboard_data():
     } for product in user_top_products]
 
     # Top 10 productos más vendidos en general
-    top_sold_products = db.session.query(
-        Product.id,
-        Product.name,
-        func.sum(SaleItem.quantity).label('total_quantity')
-    ).join(SaleItem, Product.id == SaleItem.product_id) \
-        .group_by(Product.id, Product.name) \
-        .order_by(func.sum(SaleItem.quantity).desc()) \
-        .limit(10).all()
-
     top_sold_products_data = [{
         'id': product.id,
         'name': product.name,
-        'total_quantity': product.total_quantity
-    } for product in top_sold_products]
+        'total_quantity': product.units_sold
+    } for product in Product.top_selling(10)]
 
     return jsonify({
         'recent_purchases': recent_purchases_data,
@@ -445,7 +504,102 @@ def refresh_client_dashboard_data():
         'top_sold_products': top_sold_products_data
     })
 
+# Función para publicar los cambios del dashboard sin afectar a la operación ya confirmada
+def publish_dashboard_event(publish, *args):
+    """
+    Publica eventos del dashboard tras un commit; los errores solo se registran en el log.
+    """
+    try:
+        publish(*args)
+    except Exception as e:
+        current_app.logger.error(f"Error al publicar eventos del dashboard: {str(e)}")
+
+# Ruta para recibir los cambios del dashboard en tiempo real
+@main_bp.route('/api/stream/dashboard')
+@login_required
+def stream_dashboard():
+    """
+    Envía por Server-Sent Events los cambios del dashboard (totales diarios, stock bajo y
+    rankings) a medida que se confirman ventas, pedidos y ediciones de productos.
+
+    Cada conexión ocupa un hilo o worker mientras está abierta, así que el servidor debe
+    usar workers multihilo o asíncronos (p. ej. gunicorn -k gthread o gevent). Se admiten
+    como mucho SSE_MAX_CONNECTIONS conexiones por proceso (las demás reciben 503) y cada una
+    se cierra a los SSE_MAX_SECONDS segundos; el navegador reconecta solo (retry).
+    """
+    if not broker.acquire_stream(current_app.config['SSE_MAX_CONNECTIONS']):
+        response = jsonify({'success': False, 'error': 'Demasiadas conexiones de eventos abiertas'})
+        response.status_code = 503
+        response.headers['Retry-After'] = '30'
+        return response
+
+    if current_user.is_admin:
+        channels = [ADMIN_CHANNEL]
+    else:
+        channels = [CLIENTS_CHANNEL, user_channel(current_user.id)]
+    heartbeat = current_app.config['SSE_HEARTBEAT_SECONDS']
+    deadline = time.monotonic() + current_app.config['SSE_MAX_SECONDS']
+    subscription = broker.subscribe(channels)
+
+    def generate():
+        yield 'retry: 5000\n\n'
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            message = subscription.get(timeout=min(heartbeat, remaining))
+            if message is None:
+                # Comentario para mantener viva la conexión a través de proxies
+                yield ': keep-alive\n\n'
+                continue
+            channel, event, data = message
+            yield format_sse(event, data)
+
+    def close():
+        subscription.close()
+        broker.release_stream()
+
+    response = Response(generate(), mimetype='text/event-stream')
+    # Se libera al cerrar la respuesta, aunque el cliente se desconecte antes del primer envío
+    response.call_on_close(close)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
 # Ruta de estadísticas
+def purchase_history_query():
+    """
+    Consulta de las líneas de pedidos a proveedores de las tablas activas, de la más reciente
+    a la más antigua.
+    """
+    return db.session.query(
+        Purchase.id,
+        Purchase.date,
+        Supplier.company_name.label('supplier'),
+        Product.name.label('product'),
+        PurchaseItem.price,
+        PurchaseItem.quantity,
+        (PurchaseItem.price * PurchaseItem.quantity).label('total')
+    ).join(Supplier, Purchase.supplier_id == Supplier.id) \
+        .join(PurchaseItem, Purchase.id == PurchaseItem.purchase_id) \
+        .join(Product, PurchaseItem.product_id == Product.id) \
+        .execution_options(include_deleted=True) \
+        .order_by(Purchase.date.desc(), Purchase.id.desc())
+
+def archived_purchase_history_query():
+    """
+    Consulta equivalente a purchase_history_query() sobre las líneas de pedidos archivadas.
+    """
+    return db.session.query(
+        ArchivedPurchaseItem.purchase_id.label('id'),
+        ArchivedPurchaseItem.date,
+        ArchivedPurchaseItem.supplier_name.label('supplier'),
+        ArchivedPurchaseItem.product_name.label('product'),
+        ArchivedPurchaseItem.price,
+        ArchivedPurchaseItem.quantity,
+        (ArchivedPurchaseItem.price * ArchivedPurchaseItem.quantity).label('total')
+    ).order_by(ArchivedPurchaseItem.date.desc(), ArchivedPurchaseItem.purchase_id.desc())
+
 @main_bp.route('/statistics')
 @login_required
 def statistics():
@@ -471,10 +625,10 @@ def statistics():
 
         # Obtener estadísticas generales
         try:
-            total_products = Product.query.filter(Product.is_deleted == False).count()
+            total_products = Product.query.count()
             current_app.logger.debug(f"Total de productos: {total_products}")
 
-            total_suppliers = Supplier.query.filter(Supplier.is_deleted == False).count()
+            total_suppliers = Supplier.query.count()
             current_app.logger.debug(f"Total de proveedores: {total_suppliers}")
 
             total_users = User.query.filter(User.is_admin == False).count()
@@ -484,14 +638,14 @@ def statistics():
 
         # Calcular valor total del inventario
         try:
-            total_inventory_value = db.session.query(func.sum(Product.price * Product.stock)).filter(Product.is_deleted == False).scalar() or 0
+            total_inventory_value = db.session.query(func.sum(Product.price * Product.stock)).scalar() or 0
             current_app.logger.debug(f"Valor total del inventario: {total_inventory_value}")
         except Exception as e:
             current_app.logger.error(f"Error al calcular el valor total del inventario: {str(e)}")
 
         # Obtener productos con bajo stock
         try:
-            low_stock_products = Product.query.filter(Product.stock <= Product.min_stock, Product.is_deleted == False).all()
+            low_stock_products = Product.query.filter(Product.stock <= Product.min_stock).all()
             low_stock_products = [
                 {'id': p.id, 'name': p.name, 'stock': p.stock, 'min_stock': p.min_stock} for p in low_stock_products
             ]
@@ -501,17 +655,7 @@ def statistics():
 
         # Obtener ventas por categoría (top 10)
         try:
-            sales_by_category = db.session.query(
-                Category.name,
-                func.sum(SaleItem.quantity * SaleItem.price).label('total_sales')
-            ).join(Product, SaleItem.product_id == Product.id) \
-                .join(Category, Product.category_id == Category.id) \
-                .filter(Product.is_deleted == False) \
-                .group_by(Category.name) \
-                .order_by(func.sum(SaleItem.quantity * SaleItem.price).desc()) \
-                .limit(10).all()
-
-            sales_by_category = [{'name': row.name, 'total_sales': float(row.total_sales)} for row in sales_by_category]
+            sales_by_category = compute_category_sales(limit=10)
             current_app.logger.debug(f"Número de categorías en top ventas: {len(sales_by_category)}")
         except Exception as e:
             current_app.logger.error(f"Error al consultar ventas por categoría: {str(e)}")
@@ -523,12 +667,14 @@ def statistics():
                 Supplier.company_name.label('name'),
                 func.sum(Product.stock).label('total_stock')
             ).join(Supplier.products) \
-                .filter(Supplier.is_deleted == False, Product.is_deleted == False) \
                 .group_by(Supplier.id, Supplier.company_name) \
                 .order_by(func.sum(Product.stock).desc()) \
                 .limit(5).all()
 
-            top_suppliers = [{'id': row.id, 'name': row.name, 'total_stock': row.total_stock} for row in top_suppliers]
+            scores = dict(db.session.query(SupplierScore.supplier_id, SupplierScore.score)
+                          .filter(SupplierScore.supplier_id.in_([row.id for row in top_suppliers])))
+            top_suppliers = [{'id': row.id, 'name': row.name, 'total_stock': row.total_stock, 'score': scores.get(row.id)}
+                             for row in top_suppliers]
             current_app.logger.debug(f"Número de proveedores principales: {len(top_suppliers)}")
         except Exception as e:
             current_app.logger.error(f"Error al consultar los proveedores más activos: {str(e)}")
@@ -538,20 +684,8 @@ def statistics():
             page = request.args.get('page', 1, type=int)
             per_page = 10
 
-            order_history = db.session.query(
-                Purchase.id,
-                Purchase.date,
-                Supplier.company_name.label('supplier'),
-                Product.name.label('product'),
-                PurchaseItem.price,
-                PurchaseItem.quantity,
-                (PurchaseItem.price * PurchaseItem.quantity).label('total')
-            ).join(Supplier, Purchase.supplier_id == Supplier.id) \
-                .join(PurchaseItem, Purchase.id == PurchaseItem.purchase_id) \
-                .join(Product, PurchaseItem.product_id == Product.id) \
-                .filter(Supplier.is_deleted == False, Product.is_deleted == False) \
-                .order_by(Purchase.date.desc(), Purchase.id.desc()) \
-                .paginate(page=page, per_page=per_page, error_out=False)
+            order_history = HistoryPagination(page=page, per_page=per_page, error_out=False,
+                                              hot=purchase_history_query(), archive=archived_purchase_history_query())
 
             current_app.logger.debug(f"Número de pedidos en la historia: {order_history.total}")
         except Exception as e:
@@ -577,6 +711,8 @@ def statistics():
 # Ruta para refrescar estadísticas
 @main_bp.route('/api/refresh_statistics')
 @login_required
+@read_only
+@conditional(statistics_version)
 def refresh_statistics():
     """
     API para refrescar las estadísticas (solo para administradores).
@@ -585,59 +721,35 @@ def refresh_statistics():
         abort(403)
 
     # Actualizar conteos para elementos activos
-    total_products = Product.query.filter(Product.is_deleted == False).count()
-    total_suppliers = Supplier.query.filter(Supplier.is_deleted == False).count()
+    total_products = Product.query.count()
+    total_suppliers = Supplier.query.count()
     total_users = User.query.filter(User.is_admin == False).count()
-    total_inventory_value = db.session.query(func.sum(Product.price * Product.stock)).filter(Product.is_deleted == False).scalar() or 0
-
-    low_stock_products = Product.query.filter(Product.stock <= Product.min_stock, Product.is_deleted == False).all()
-    low_stock_products = [
-        {'id': p.id, 'name': p.name, 'stock': p.stock, 'min_stock': p.min_stock} for p in low_stock_products
-    ]
+    total_inventory_value = db.session.query(func.sum(Product.price * Product.stock)).scalar() or 0
 
-    sales_by_category = db.session.query(
-        Category.name,
-        func.sum(SaleItem.quantity * SaleItem.price).label('total_sales')
-    ).join(Product, SaleItem.product_id == Product.id) \
-        .join(Category, Product.category_id == Category.id) \
-        .filter(Product.is_deleted == False) \
-        .group_by(Category.name) \
-        .order_by(func.sum(SaleItem.quantity * SaleItem.price).desc()) \
-        .limit(10).all()
+    # Productos con bajo stock: se leen por lotes y se serializan mientras se envía la respuesta
+    low_stock_products = db.session.query(Product.id, Product.name, Product.stock, Product.min_stock) \
+        .filter(Product.stock <= Product.min_stock) \
+        .order_by(Product.id) \
+        .execution_options(yield_per=current_app.config['STREAM_BATCH_SIZE'])
 
-    sales_by_category = [{'name': row.name, 'total_sales': float(row.total_sales)} for row in sales_by_category]
+    # Ventas por categoría (top 10), incluidas las líneas archivadas
+    sales_by_category = compute_category_sales(limit=10)
 
     top_suppliers = db.session.query(
         Supplier.id,
         Supplier.company_name.label('name'),
         func.sum(Product.stock).label('total_stock')
     ).join(Supplier.products) \
-        .filter(Supplier.is_deleted == False, Product.is_deleted == False) \
         .group_by(Supplier.id, Supplier.company_name) \
         .order_by(func.sum(Product.stock).desc()) \
         .limit(5).all()
 
     top_suppliers = [{'id': row.id, 'name': row.name, 'total_stock': row.total_stock} for row in top_suppliers]
 
-    order_history = db.session.query(
-        Purchase.id,
-        Purchase.date,
-        Supplier.company_name.label('supplier'),
-        Product.name.label('product'),
-        PurchaseItem.price,
-        PurchaseItem.quantity,
-        (PurchaseItem.price * PurchaseItem.quantity).label('total')
-    ).join(Supplier, Purchase.supplier_id == Supplier.id) \
-        .join(PurchaseItem, Purchase.id == PurchaseItem.purchase_id) \
-        .join(Product, PurchaseItem.product_id == Product.id) \
-        .order_by(Purchase.date.desc(), Purchase.id.desc()) \
-        .limit(50).all()
-
-    # Eliminar registros antiguos si hay más de 50
-    if len(order_history) > 50:
-        oldest_purchase_id = order_history[-1].id
-        Purchase.query.filter(Purchase.id <= oldest_purchase_id).delete()
-        db.session.commit()
+    # Últimas 50 líneas de pedidos (solo lectura: la retención del historial la aplica la
+    # tarea purchase-retention)
+    order_history = HistoryPagination(page=1, per_page=50, error_out=False, count=False,
+                                      hot=purchase_history_query(), archive=archived_purchase_history_query()).items
 
     order_history_data = [
         {
@@ -650,16 +762,18 @@ def refresh_statistics():
         } for order in order_history
     ]
 
-    return jsonify({
-        'total_products': total_products,
-        'total_suppliers': total_suppliers,
-        'total_users': total_users,
-        'total_inventory_value': total_inventory_value,
-        'low_stock_products': low_stock_products,
-        'sales_by_category': sales_by_category,
-        'top_suppliers': top_suppliers,
-        'order_history': order_history_data
-    })
+    return stream_json([
+        ('total_products', total_products),
+        ('total_suppliers', total_suppliers),
+        ('total_users', total_users),
+        ('total_inventory_value', total_inventory_value),
+        ('low_stock_products', JsonArray(low_stock_products, lambda p: {
+            'id': p.id, 'name': p.name, 'stock': p.stock, 'min_stock': p.min_stock
+        })),
+        ('sales_by_category', sales_by_category),
+        ('top_suppliers', top_suppliers),
+        ('order_history', order_history_data)
+    ])
 
 # Ruta para obtener el historial de compras del cliente
 @main_bp.route('/api/client_purchase_history')
@@ -684,8 +798,22 @@ def api_client_purchase_history():
     ).join(SaleItem, Sale.id == SaleItem.sale_id) \
         .join(Product, SaleItem.product_id == Product.id) \
         .filter(Sale.user_id == current_user.id) \
-        .order_by(Sale.date.desc(), Sale.id.desc()) \
-        .paginate(page=page, per_page=per_page, error_out=False)
+        .execution_options(include_deleted=True) \
+        .order_by(Sale.date.desc(), Sale.id.desc())
+
+    # Compras de meses ya archivados
+    archived_history = db.session.query(
+        ArchivedSaleItem.sale_id.label('id'),
+        ArchivedSaleItem.date,
+        ArchivedSaleItem.product_name.label('product'),
+        ArchivedSaleItem.quantity,
+        ArchivedSaleItem.price,
+        (ArchivedSaleItem.quantity * ArchivedSaleItem.price).label('total')
+    ).filter(ArchivedSaleItem.user_id == current_user.id) \
+        .order_by(ArchivedSaleItem.date.desc(), ArchivedSaleItem.sale_id.desc())
+
+    purchase_history = HistoryPagination(page=page, per_page=per_page, error_out=False,
+                                         hot=purchase_history, archive=archived_history)
 
     purchase_history_data = [
         {
@@ -707,6 +835,7 @@ def api_client_purchase_history():
 # Ruta para obtener ventas por fecha
 @main_bp.route('/api/sales_by_date/<date>')
 @login_required
+@read_only
 def sales_by_date(date):
     """
     API para obtener las ventas de una fecha específica (solo para administradores).
@@ -737,8 +866,25 @@ def sales_by_date(date):
         .join(Product, SaleItem.product_id == Product.id) \
         .outerjoin(Supplier, SaleItem.supplier_id == Supplier.id) \
         .filter(func.date(Sale.date) == selected_date) \
-        .order_by(Sale.date.desc()) \
-        .paginate(page=page, per_page=per_page, error_out=False)
+        .execution_options(include_deleted=True) \
+        .order_by(Sale.date.desc(), Sale.id.desc())
+
+    # Ventas de la fecha si pertenece a un mes ya archivado
+    day_start = datetime.combine(selected_date, datetime.min.time())
+    archived_sales = db.session.query(
+        ArchivedSaleItem.sale_id.label('id'),
+        ArchivedSaleItem.date,
+        ArchivedSaleItem.username,
+        ArchivedSaleItem.email,
+        ArchivedSaleItem.product_name.label('product'),
+        ArchivedSaleItem.supplier_name.label('supplier'),
+        ArchivedSaleItem.quantity,
+        ArchivedSaleItem.price,
+        (ArchivedSaleItem.quantity * ArchivedSaleItem.price).label('total')
+    ).filter(ArchivedSaleItem.date >= day_start, ArchivedSaleItem.date < day_start + timedelta(days=1)) \
+        .order_by(ArchivedSaleItem.date.desc(), ArchivedSaleItem.sale_id.desc())
+
+    sales = HistoryPagination(page=page, per_page=per_page, error_out=False, hot=sales, archive=archived_sales)
 
     sales_data = [
         {
@@ -763,6 +909,7 @@ def sales_by_date(date):
 # Ruta para obtener el historial de pedidos
 @main_bp.route('/api/order_history')
 @login_required
+@read_only
 def api_order_history():
     """
     API para obtener el historial de pedidos (solo para administradores).
@@ -773,19 +920,8 @@ def api_order_history():
     page = request.args.get('page', 1, type=int)
     per_page = 10
 
-    order_history = db.session.query(
-        Purchase.id,
-        Purchase.date,
-        Supplier.company_name.label('supplier'),
-        Product.name.label('product'),
-        PurchaseItem.price,
-        PurchaseItem.quantity,
-        (PurchaseItem.price * PurchaseItem.quantity).label('total')
-    ).join(Supplier, Purchase.supplier_id == Supplier.id) \
-        .join(PurchaseItem, Purchase.id == PurchaseItem.purchase_id) \
-        .join(Product, PurchaseItem.product_id == Product.id) \
-        .order_by(Purchase.date.desc(), Purchase.id.desc()) \
-        .paginate(page=page, per_page=per_page, error_out=False)
+    order_history = HistoryPagination(page=page, per_page=per_page, error_out=False,
+                                      hot=purchase_history_query(), archive=archived_purchase_history_query())
 
     order_history_data = [
         {
@@ -805,9 +941,124 @@ def api_order_history():
         'current_page': order_history.page
     })
 
+# Ruta para exportar el histórico de ventas en formato columnar
+@main_bp.route('/api/admin/export_sales', methods=['GET', 'POST'])
+@login_required
+def api_export_sales():
+    """
+    API para lanzar (POST) o consultar (GET) la exportación Parquet de ventas (solo para administradores).
+
+    La exportación se ejecuta en segundo plano (tarea sales-export): el POST responde 202 en
+    cuanto se lanza y el GET devuelve el manifiesto y si sigue en curso.
+    """
+    if not current_user.is_admin:
+        abort(403)
+
+    if request.method == 'GET':
+        return jsonify(export_status(current_app.config['EXPORT_DIR']))
+
+    try:
+        start_export(current_app._get_current_object(), full=request.args.get('full') == '1')
+    except ExportInProgress as e:
+        return jsonify({'success': False, 'error': str(e)}), 409
+    except RuntimeError as e:
+        return jsonify({'success': False, 'error': str(e)}), 503
+    return jsonify({'success': True, 'status': 'started'}), 202
+
+# Rutas de analítica de ventas
+@main_bp.route('/api/analytics/sales_trends')
+@login_required
+@read_only
+def api_sales_trends():
+    """
+    API con los ingresos semanales por categoría, su crecimiento y media móvil (solo para administradores).
+    """
+    if not current_user.is_admin:
+        abort(403)
+
+    weeks = min(max(request.args.get('weeks', 12, type=int), 1), 104)
+    window = min(max(request.args.get('window', 4, type=int), 1), weeks)
+    return jsonify(cached_sales_trends(weeks, window))
+
+@main_bp.route('/api/analytics/abc')
+@login_required
+@read_only
+def api_abc_classification():
+    """
+    API con la clasificación ABC de los productos por ingresos (solo para administradores).
+    """
+    if not current_user.is_admin:
+        abort(403)
+
+    return jsonify(cached_abc_report())
+
+# Ruta para obtener el pronóstico de demanda de un producto
+@main_bp.route('/api/forecast/<int:product_id>')
+@login_required
+@read_only
+def api_product_forecast(product_id):
+    """
+    API con la demanda diaria prevista de un producto (solo para administradores).
+    """
+    if not current_user.is_admin:
+        abort(403)
+
+    horizon = min(max(request.args.get('days', current_app.config['FORECAST_HORIZON_DAYS'], type=int), 1), 90)
+    forecast = product_forecast(product_id, horizon)
+    if forecast is None:
+        return jsonify({'error': 'No hay pronóstico para este producto'}), 404
+    return jsonify(forecast)
+
+# Rutas del histórico de inventario (a partir de las fotos diarias)
+@main_bp.route('/api/inventory/at/<date>')
+@login_required
+@read_only
+def api_inventory_at(date):
+    """
+    API con el valor y el stock del inventario en una fecha pasada (solo para administradores).
+
+    Con el parámetro product_id devuelve solo los datos de ese producto.
+    """
+    if not current_user.is_admin:
+        abort(403)
+
+    try:
+        selected_date = datetime.strptime(date, '%Y-%m-%d').date()
+    except ValueError:
+        return jsonify({'error': 'Formato de fecha inválido'}), 400
+
+    product_id = request.args.get('product_id', type=int)
+    data = product_inventory_at(product_id, selected_date) if product_id else inventory_at(selected_date)
+    if data is None:
+        return jsonify({'error': 'No hay fotos del inventario anteriores a esa fecha'}), 404
+    return jsonify(data)
+
+@main_bp.route('/api/inventory/history')
+@login_required
+@read_only
+def api_inventory_history():
+    """
+    API con la evolución del valor y el stock del inventario entre dos fechas (solo para administradores).
+    """
+    if not current_user.is_admin:
+        abort(403)
+
+    try:
+        end = datetime.strptime(request.args['end'], '%Y-%m-%d').date() if 'end' in request.args else datetime.utcnow().date()
+        start = datetime.strptime(request.args['start'], '%Y-%m-%d').date() if 'start' in request.args else end - timedelta(days=30)
+    except ValueError:
+        return jsonify({'error': 'Formato de fecha inválido'}), 400
+
+    return jsonify({
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'history': inventory_history(start, end, request.args.get('category_id', type=int))
+    })
+
 # Ruta para notificar a un proveedor
 @main_bp.route('/api/notify_supplier', methods=['POST'])
 @login_required
+@idempotent('notify_supplier', json=True)
 def notify_supplier():
     """
     API para notificar a un proveedor sobre un pedido (solo para administradores).
@@ -835,10 +1086,12 @@ def notify_supplier():
     db.session.add(purchase_item)
 
     # Actualizar el stock del producto
-    product.stock += int(quantity)
+    product.change_stock(int(quantity), StockMovement.PURCHASE, purchase=new_purchase)
 
     try:
         db.session.commit()
+        mark_completed()
+        publish_dashboard_event(publish_purchase, [product.id])
         return jsonify({'success': True, 'message': 'Notificación enviada y stock actualizado'})
     except Exception as e:
         db.session.rollback()
@@ -847,6 +1100,8 @@ def notify_supplier():
 # Ruta para mostrar productos
 @main_bp.route('/products')
 @login_required
+@read_only
+@conditional(catalog_version)
 def products():
     """
     Muestra la lista de productos con opciones de filtrado y paginación.
@@ -884,16 +1139,22 @@ def products():
         # Si la página actual está vacía y no es la primera página, redirigir a la última página válida
         return redirect(url_for('main.products', page=total_pages, search=search, category=category_id, low_stock='on' if low_stock else None))
 
+    # Clave del fragmento cacheado con las filas del listado (común a todos los clientes)
+    listing_cache_key = listing_fragment_key(get_versions('catalog')['catalog'], page, search,
+                                             category_id, low_stock, current_user.is_admin)
+
     return render_template('products.html',
                            products=products,
                            categories=Category.query.all(),
                            current_category=category_id,
                            low_stock=low_stock,
-                           search=search)
+                           search=search,
+                           listing_cache_key=listing_cache_key)
 
 # Ruta para obtener información de un producto
 @main_bp.route('/api/product_info/<int:product_id>')
 @login_required
+@conditional(product_version)
 def get_product_info(product_id):
     """
     API para obtener información detallada de un producto específico.
@@ -908,6 +1169,7 @@ def get_product_info(product_id):
 # Ruta para mostrar detalles de un producto
 @main_bp.route('/products/<int:product_id>')
 @login_required
+@conditional(product_detail_version)
 def product_detail(product_id):
     """
     Muestra los detalles de un producto específico.
@@ -916,7 +1178,11 @@ def product_detail(product_id):
         product = Product.query.get_or_404(product_id)
         form = AddToCartForm() if not current_user.is_admin else None
         show_stock = current_user.is_admin  # Only show stock info to admins
-        return render_template('product_detail.html', product=product, form=form, show_stock=show_stock)
+        forecast = product_forecast(product.id) if current_user.is_admin else None
+        # conditional no calcula la versión en las peticiones que no se pueden cachear
+        version = g.get('product_version') or product_version(product.id)[0]
+        return render_template('product_detail.html', product=product, form=form, show_stock=show_stock, forecast=forecast,
+                               fragment_cache_key=product_fragment_key(product.id, version, show_stock))
     except Exception as e:
         current_app.logger.error(f"Error en product_detail: {str(e)}")
         return "Ha ocurrido un error", 500
@@ -942,7 +1208,7 @@ def add_product():
             name=form.name.data,
             description=form.description.data,
             price=form.price.data,
-            stock=form.stock.data,
+            stock=0,
             min_stock=form.min_stock.data,
             category_id=form.category_id.data,
             location=form.location.data,
@@ -952,6 +1218,7 @@ def add_product():
             dimensions=form.dimensions.data,
             manufacturer=form.manufacturer.data
         )
+        new_product.change_stock(form.stock.data, StockMovement.INITIAL)
 
         if form.supplier.data == 'new':
             new_supplier = Supplier(
@@ -1020,9 +1287,14 @@ def edit_product(product_id):
         if product.suppliers:
             form.supplier.data = str(product.suppliers[0].id)
 
+    old_stock = product.stock
     if form.validate_on_submit():
         try:
+            # El cambio de stock se anota como ajuste en el registro de movimientos
+            new_stock = form.stock.data
             form.populate_obj(product)
+            product.stock = old_stock
+            product.set_stock(new_stock, StockMovement.ADJUSTMENT)
 
             # Actualizar el proveedor
             if form.supplier.data:
@@ -1033,6 +1305,7 @@ def edit_product(product_id):
                     product.suppliers = []
 
             db.session.commit()
+            publish_dashboard_event(publish_product_change, [product.id])
             if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
                 return jsonify({'success': True, 'message': 'Producto actualizado con éxito'})
             flash('Producto actualizado con éxito', 'success')
@@ -1060,6 +1333,7 @@ def delete_product(product_id):
     product = Product.query.get_or_404(product_id)
     try:
         product.soft_delete()
+        publish_dashboard_event(publish_product_change, [product_id])
         return jsonify({
             'success': True,
             'message': 'Producto eliminado con éxito',
@@ -1069,6 +1343,39 @@ def delete_product(product_id):
         db.session.rollback()
         return jsonify({'success': False, 'error': str(e)}), 400
 
+def _request_ids():
+    """
+    Lee la lista de ids del cuerpo JSON ({"ids": [1, 2, ...]}) o None si no es válida.
+    """
+    ids = (request.get_json(silent=True) or {}).get('ids')
+    if not isinstance(ids, list) or not ids or not all(isinstance(i, int) for i in ids):
+        return None
+    return ids
+
+# Ruta para eliminar varios productos a la vez
+@main_bp.route('/api/products/bulk_delete', methods=['POST'])
+@login_required
+def bulk_delete_products():
+    """
+    API para el borrado lógico de varios productos en una sola transacción (solo para
+    administradores). Cuerpo JSON: {"ids": [1, 2, ...]}.
+    """
+    if not current_user.is_admin:
+        return jsonify({'success': False, 'error': 'No tienes permiso para realizar esta acción'}), 403
+
+    ids = _request_ids()
+    if ids is None:
+        return jsonify({'success': False, 'error': 'Se esperaba una lista de ids'}), 400
+    try:
+        deleted = Product.soft_delete_many(ids)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Error al eliminar productos: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 400
+    publish_dashboard_event(publish_product_change, ids)
+    return jsonify({'success': True, 'message': f'{deleted} productos eliminados', 'deleted': deleted})
+
 # Ruta para mostrar proveedores
 @main_bp.route('/suppliers')
 @login_required
@@ -1093,7 +1400,9 @@ def suppliers():
             Supplier.email.ilike(f'%{search}%')
         ))
 
-    suppliers = query.order_by(Supplier.company_name).paginate(page=page, per_page=per_page, error_out=False)
+    # La puntuación se lee del resumen precalculado (SupplierScore) en la misma consulta
+    suppliers = query.options(joinedload(Supplier.score)) \
+        .order_by(Supplier.company_name).paginate(page=page, per_page=per_page, error_out=False)
     total_pages = suppliers.pages
 
     return render_template('suppliers.html', suppliers=suppliers, search=search, total_pages=total_pages)
@@ -1163,7 +1472,7 @@ def supplier_detail(supplier_id):
         return redirect(url_for('main.dashboard'))
 
     supplier = Supplier.query.get_or_404(supplier_id)
-    return render_template('supplier_detail.html', supplier=supplier)
+    return render_template('supplier_detail.html', supplier=supplier, score=supplier.score)
 
 # Ruta para editar un proveedor
 @main_bp.route('/suppliers/<int:supplier_id>/edit', methods=['GET', 'POST'])
@@ -1203,7 +1512,7 @@ def delete_supplier(supplier_id):
 
     supplier = Supplier.query.get_or_404(supplier_id)
     try:
-        supplier.soft_delete()
+        Supplier.soft_delete_many([supplier.id])
         db.session.commit()
         return jsonify({'success': True, 'message': 'Proveedor eliminado con éxito'})
     except Exception as e:
@@ -1211,6 +1520,29 @@ def delete_supplier(supplier_id):
         current_app.logger.error(f"Error al eliminar proveedor: {str(e)}")
         return jsonify({'success': False, 'error': str(e)}), 400
 
+# Ruta para eliminar varios proveedores a la vez
+@main_bp.route('/api/suppliers/bulk_delete', methods=['POST'])
+@login_required
+def bulk_delete_suppliers():
+    """
+    API para el borrado lógico de varios proveedores en una sola transacción (solo para
+    administradores). Cuerpo JSON: {"ids": [1, 2, ...]}.
+    """
+    if not current_user.is_admin:
+        return jsonify({'success': False, 'error': 'No tienes permiso para realizar esta acción'}), 403
+
+    ids = _request_ids()
+    if ids is None:
+        return jsonify({'success': False, 'error': 'Se esperaba una lista de ids'}), 400
+    try:
+        deleted = Supplier.soft_delete_many(ids)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Error al eliminar proveedores: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 400
+    return jsonify({'success': True, 'message': f'{deleted} proveedores eliminados', 'deleted': deleted})
+
 # Ruta para mostrar el carrito
 @main_bp.route('/cart')
 @login_required
@@ -1222,13 +1554,14 @@ def cart():
         flash('Los administradores no pueden acceder al carrito', 'error')
         return redirect(url_for('main.dashboard'))
 
-    cart_items = CartItem.query.filter_by(user_id=current_user.id).all()
-    total = sum(item.product.price * item.quantity for item in cart_items)
+    cart_items = current_cart().lines()
+    total = sum(item.subtotal for item in cart_items)
     return render_template('cart.html', cart_items=cart_items, total=total)
 
 # Ruta para añadir un producto al carrito
 @main_bp.route('/add-to-cart/<int:product_id>', methods=['POST'])
 @login_required
+@limiter.limit('cart', ('user', 'ip'), json=True)
 def add_to_cart(product_id):
     """
     Maneja la adición de un producto al carrito del usuario (solo para clientes).
@@ -1247,17 +1580,13 @@ def add_to_cart(product_id):
         if product.stock <= 0:
             return jsonify({'success': False, 'error': 'No hay stock disponible para este producto'}), 400
 
-        cart_item = CartItem.query.filter_by(user_id=current_user.id, product_id=product.id).first()
-
-        if cart_item:
-            cart_item.quantity += quantity
-        else:
-            cart_item = CartItem(user_id=current_user.id, product_id=product.id, quantity=quantity)
-            db.session.add(cart_item)
-
+        cart = current_cart()
         try:
-            db.session.commit()
+            cart.add(product.id, quantity)
+            cart.save()
             return jsonify({'success': True, 'message': 'Producto añadido al carrito'})
+        except CartFull as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
         except Exception as e:
             db.session.rollback()
             return jsonify({'success': False, 'error': str(e)}), 500
@@ -1266,6 +1595,7 @@ def add_to_cart(product_id):
 # Ruta para actualizar la cantidad de un producto en el carrito
 @main_bp.route('/update-cart/<int:product_id>', methods=['POST'])
 @login_required
+@limiter.limit('cart', ('user', 'ip'), json=True)
 def update_cart(product_id):
     """
     Maneja la actualización de la cantidad de un producto en el carrito (solo para clientes).
@@ -1273,7 +1603,9 @@ def update_cart(product_id):
     if current_user.is_admin:
         return jsonify({'success': False, 'error': 'Los administradores no pueden modificar el carrito'}), 403
 
-    cart_item = CartItem.query.filter_by(user_id=current_user.id, product_id=product_id).first_or_404()
+    cart = current_cart()
+    if not cart.quantity(product_id):
+        abort(404)
     form = AddToCartForm()
 
     if form.validate_on_submit():
@@ -1281,12 +1613,13 @@ def update_cart(product_id):
         if new_quantity <= 0:
             return jsonify({'success': False, 'error': 'La cantidad debe ser mayor que cero'}), 400
 
-        if cart_item.product.stock <= 0:
+        product = db.session.get(Product, product_id)
+        if product is None or product.stock <= 0:
             return jsonify({'success': False, 'error': 'No hay stock disponible para este producto'}), 400
 
-        cart_item.quantity = new_quantity
+        cart.set_quantity(product_id, new_quantity)
         try:
-            db.session.commit()
+            cart.save()
             return jsonify({'success': True, 'message': 'Cantidad actualizada'})
         except Exception as e:
             db.session.rollback()
@@ -1296,6 +1629,7 @@ def update_cart(product_id):
 # Ruta para eliminar un producto del carrito
 @main_bp.route('/remove-from-cart/<int:product_id>', methods=['POST'])
 @login_required
+@limiter.limit('cart', ('user', 'ip'), json=True)
 def remove_from_cart(product_id):
     """
     Maneja la eliminación de un producto del carrito (solo para clientes).
@@ -1303,19 +1637,106 @@ def remove_from_cart(product_id):
     if current_user.is_admin:
         return jsonify({'success': False, 'error': 'Los administradores no pueden modificar el carrito'}), 403
 
-    cart_item = CartItem.query.filter_by(user_id=current_user.id, product_id=product_id).first_or_404()
+    cart = current_cart()
+    if not cart.quantity(product_id):
+        abort(404)
 
     try:
-        db.session.delete(cart_item)
-        db.session.commit()
+        cart.remove(product_id)
+        cart.save()
         return jsonify({'success': True, 'message': 'Producto eliminado del carrito'})
     except Exception as e:
         db.session.rollback()
         return jsonify({'success': False, 'error': str(e)}), 500
 
+# Ruta para aplicar varios cambios al carrito en una sola petición
+@main_bp.route('/api/cart/batch', methods=['POST'])
+@login_required
+@limiter.limit('cart', ('user', 'ip'), json=True)
+def cart_batch():
+    """
+    API que aplica una lista de operaciones sobre el carrito en una sola transacción (solo
+    para clientes).
+
+    Cuerpo JSON: {"operations": [{"op": "add" | "update" | "remove", "product_id": 1,
+    "quantity": 2}, ...]}. Las operaciones se validan como en add-to-cart, update-cart y
+    remove-from-cart, con una sola consulta de stock para todos los productos; si alguna no es
+    válida no se aplica ninguna. Devuelve el carrito resultante y su total.
+    """
+    if current_user.is_admin:
+        return jsonify({'success': False, 'error': 'Los administradores no pueden modificar el carrito'}), 403
+
+    data = request.get_json(silent=True) or {}
+    operations = data.get('operations')
+    if not isinstance(operations, list) or not operations:
+        return jsonify({'success': False, 'error': 'Se esperaba una lista de operaciones'}), 400
+    if len(operations) > current_app.config['CART_BATCH_MAX_OPERATIONS']:
+        return jsonify({'success': False, 'error': 'Demasiadas operaciones en una sola petición'}), 400
+
+    errors = []
+    for index, operation in enumerate(operations):
+        if not isinstance(operation, dict) or operation.get('op') not in ('add', 'update', 'remove') \
+                or not isinstance(operation.get('product_id'), int):
+            errors.append({'index': index, 'error': 'Operación no válida'})
+        elif operation['op'] != 'remove' and (not isinstance(operation.get('quantity'), int) or operation['quantity'] <= 0):
+            errors.append({'index': index, 'error': 'La cantidad debe ser mayor que cero'})
+    if errors:
+        return jsonify({'success': False, 'errors': errors}), 400
+
+    # Productos de las operaciones y del carrito, con una sola consulta
+    cart = current_cart()
+    product_ids = {operation['product_id'] for operation in operations} | set(cart.items)
+    products = {product.id: product for product in Product.query.filter(Product.id.in_(product_ids))}
+
+    try:
+        for index, operation in enumerate(operations):
+            product_id = operation['product_id']
+            product = products.get(product_id)
+            if operation['op'] != 'add' and not cart.quantity(product_id):
+                errors.append({'index': index, 'error': 'El producto no está en el carrito'})
+            elif operation['op'] == 'remove':
+                cart.remove(product_id)
+            elif product is None:
+                errors.append({'index': index, 'error': 'Producto no encontrado'})
+            elif product.stock <= 0:
+                errors.append({'index': index, 'error': 'No hay stock disponible para este producto'})
+            elif operation['op'] == 'add':
+                cart.add(product_id, operation['quantity'])
+            else:
+                cart.set_quantity(product_id, operation['quantity'])
+    except CartFull as e:
+        errors.append({'index': index, 'error': str(e)})
+    if errors:
+        # Sin cart.save() no se guarda ninguno de los cambios hechos en memoria
+        return jsonify({'success': False, 'errors': errors}), 400
+
+    # La respuesta se prepara antes de guardar: el commit de cart.save() expira los productos
+    # y leerlos después volvería a consultarlos uno a uno
+    lines = cart.lines(products)
+    result = {
+        'success': True,
+        'items': [{
+            'product_id': line.product_id,
+            'name': line.product.name,
+            'price': line.product.price,
+            'quantity': line.quantity,
+            'subtotal': line.subtotal
+        } for line in lines],
+        'total': cart.total(lines)
+    }
+
+    try:
+        cart.save()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+    return jsonify(result)
+
 # Ruta para obtener el total del carrito
 @main_bp.route('/api/cart-total')
 @login_required
+@limiter.limit('cart', ('user', 'ip'), methods=('GET',), json=True)
 def get_cart_total():
     """
     API para obtener el total actual del carrito del usuario (solo para clientes).
@@ -1323,13 +1744,13 @@ def get_cart_total():
     if current_user.is_admin:
         return jsonify({'success': False, 'error': 'Los administradores no pueden acceder al carrito'}), 403
 
-    cart_items = CartItem.query.filter_by(user_id=current_user.id).all()
-    total = sum(item.product.price * item.quantity for item in cart_items)
-    return jsonify({'total': total})
+    return jsonify({'total': current_cart().total()})
 
 # Ruta para el proceso de checkout
 @main_bp.route('/checkout', methods=['GET', 'POST'])
 @login_required
+@limiter.limit('checkout', ('user',))
+@idempotent('checkout')
 def checkout():
     """
     Maneja el proceso de checkout para finalizar una compra (solo para clientes).
@@ -1338,12 +1759,13 @@ def checkout():
         flash('Los administradores no pueden realizar compras', 'error')
         return redirect(url_for('main.dashboard'))
 
-    cart_items = CartItem.query.filter_by(user_id=current_user.id).all()
+    cart = current_cart()
+    cart_items = cart.lines()
     if not cart_items:
         flash('Tu carrito está vacío', 'error')
         return redirect(url_for('main.cart'))
 
-    total = sum(item.product.price * item.quantity for item in cart_items)
+    total = sum(item.subtotal for item in cart_items)
     form = CheckoutForm()
 
     if form.validate_on_submit():
@@ -1369,13 +1791,22 @@ def checkout():
                 )
                 db.session.add(sale_item)
 
-                # Actualizar el stock del producto
-                cart_item.product.stock -= cart_item.quantity
+                # Actualizar el stock y los contadores de ventas del producto
+                cart_item.product.change_stock(-cart_item.quantity, StockMovement.SALE, sale=sale)
+                cart_item.product.record_sale(cart_item.quantity, cart_item.product.price)
+
+            # Actualizar los resúmenes de compras del usuario
+            record_user_sale(current_user.id, sale.date,
+                             [(item.product_id, item.quantity, item.product.price) for item in cart_items])
+            sold_product_ids = [item.product_id for item in cart_items]
 
-            # Eliminar items del carrito
-            CartItem.query.filter_by(user_id=current_user.id).delete()
+            # Vaciar el carrito (sus filas CartItem se borran en esta misma transacción)
+            cart.clear()
 
             db.session.commit()
+            mark_completed()
+            cart.forget()
+            publish_dashboard_event(publish_sale, sale, sold_product_ids)
             flash('Compra realizada con éxito', 'success')
             return redirect(url_for('main.order_confirmation', order_id=sale.id))
         except ValueError as e:
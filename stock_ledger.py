@@ -0,0 +1,157 @@
+from datetime import datetime, timedelta
+from sqlalchemy import func, and_
+from extensions import db
+from models import Product, StockMovement, StockCheckpoint
+from jobs import job
+
+# Los movimientos más recientes que este margen no entran en un punto de control, para no
+# adelantarse a transacciones que aún no han confirmado movimientos con ids menores
+CHECKPOINT_DELAY = timedelta(minutes=5)
+
+
+def _latest_checkpoints(product_id=None, until_date=None):
+    """
+    Subconsulta con el último punto de control de cada producto (opcionalmente, el último
+    anterior a una fecha).
+    """
+    latest = db.session.query(
+        StockCheckpoint.product_id,
+        func.max(StockCheckpoint.movement_id).label('movement_id')
+    )
+    if product_id is not None:
+        latest = latest.filter(StockCheckpoint.product_id == product_id)
+    if until_date is not None:
+        latest = latest.filter(StockCheckpoint.created_at <= until_date)
+    return latest.group_by(StockCheckpoint.product_id).subquery()
+
+
+def _checkpoint_rows(latest):
+    """
+    Devuelve {product_id: (movement_id, stock)} de los puntos de control de la subconsulta.
+    """
+    rows = db.session.query(StockCheckpoint.product_id, StockCheckpoint.movement_id, StockCheckpoint.stock) \
+        .join(latest, and_(StockCheckpoint.product_id == latest.c.product_id,
+                           StockCheckpoint.movement_id == latest.c.movement_id))
+    return {product_id: (movement_id, stock) for product_id, movement_id, stock in rows}
+
+
+def stock_balance(product_id, at=None):
+    """
+    Reconstruye el stock de un producto en un momento dado a partir del registro.
+
+    Parte del último punto de control anterior y suma solo los movimientos posteriores,
+    por lo que el coste depende de los cambios desde ese punto de control.
+
+    Args:
+        product_id (int): Id del producto.
+        at (datetime): Momento de la consulta (por defecto, el actual).
+
+    Returns:
+        int: Stock del producto en ese momento según el registro.
+    """
+    checkpoint = _checkpoint_rows(_latest_checkpoints(product_id, until_date=at)).get(product_id)
+    movement_id, stock = checkpoint if checkpoint else (0, 0)
+
+    query = db.session.query(func.sum(StockMovement.delta)) \
+        .filter(StockMovement.product_id == product_id, StockMovement.id > movement_id)
+    if at is not None:
+        query = query.filter(StockMovement.created_at <= at)
+    return stock + (query.scalar() or 0)
+
+
+def ledger_balances():
+    """
+    Stock actual de todos los productos según el registro, con dos consultas agregadas.
+
+    Returns:
+        dict: {product_id: stock}
+    """
+    checkpoints = _checkpoint_rows(_latest_checkpoints())
+    balances = {product_id: stock for product_id, (_, stock) in checkpoints.items()}
+
+    latest = _latest_checkpoints().alias('latest_checkpoint')
+    rows = db.session.query(StockMovement.product_id, func.sum(StockMovement.delta)) \
+        .outerjoin(latest, StockMovement.product_id == latest.c.product_id) \
+        .filter(StockMovement.id > func.coalesce(latest.c.movement_id, 0)) \
+        .group_by(StockMovement.product_id)
+    for product_id, delta in rows:
+        balances[product_id] = balances.get(product_id, 0) + int(delta)
+    return balances
+
+
+def find_stock_drift():
+    """
+    Compara Product.stock con el registro de movimientos de todos los productos.
+
+    Returns:
+        list: Tuplas (product_id, stock en Product, stock según el registro) que no coinciden.
+    """
+    balances = ledger_balances()
+    return [(product_id, stock, balances.get(product_id, 0))
+            for product_id, stock in db.session.query(Product.id, Product.stock)
+                .execution_options(include_deleted=True).order_by(Product.id)
+            if (stock or 0) != balances.get(product_id, 0)]
+
+
+def adjust_stock_drift():
+    """
+    Anota un movimiento de ajuste por cada producto cuyo registro no coincide con su stock.
+
+    Sirve también para abrir el registro de una base de datos existente: los productos sin
+    movimientos reciben un ajuste igual a su stock actual.
+
+    Returns:
+        int: Número de productos ajustados.
+    """
+    drift = find_stock_drift()
+    if drift:
+        db.session.execute(db.insert(StockMovement), [
+            {'product_id': product_id, 'delta': (stock or 0) - ledger, 'reason': StockMovement.ADJUSTMENT,
+             'created_at': datetime.utcnow()}
+            for product_id, stock, ledger in drift
+        ])
+    db.session.commit()
+    return len(drift)
+
+
+def create_checkpoints():
+    """
+    Crea un punto de control para cada producto con movimientos desde el anterior.
+
+    Returns:
+        int: Número de puntos de control creados.
+    """
+    until_id = db.session.query(func.max(StockMovement.id)) \
+        .filter(StockMovement.created_at <= datetime.utcnow() - CHECKPOINT_DELAY).scalar()
+    if until_id is None:
+        return 0
+
+    checkpoints = _checkpoint_rows(_latest_checkpoints())
+    latest = _latest_checkpoints().alias('latest_checkpoint')
+    rows = db.session.query(
+        StockMovement.product_id,
+        func.sum(StockMovement.delta),
+        func.max(StockMovement.id),
+        func.max(StockMovement.created_at)
+    ).outerjoin(latest, StockMovement.product_id == latest.c.product_id) \
+        .filter(StockMovement.id > func.coalesce(latest.c.movement_id, 0), StockMovement.id <= until_id) \
+        .group_by(StockMovement.product_id).all()
+
+    new_checkpoints = [{
+        'product_id': product_id,
+        'movement_id': movement_id,
+        'stock': checkpoints.get(product_id, (0, 0))[1] + int(delta),
+        'created_at': created_at
+    } for product_id, delta, movement_id, created_at in rows]
+    if new_checkpoints:
+        db.session.execute(db.insert(StockCheckpoint), new_checkpoints)
+    db.session.commit()
+    return len(new_checkpoints)
+
+
+@job('stock-checkpoints', hour=1)
+def daily_stock_checkpoints():
+    """
+    Tarea diaria: crea los puntos de control del registro de stock.
+    """
+    return create_checkpoints()
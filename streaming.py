@@ -0,0 +1,140 @@
+import json
+import zlib
+from flask import Response, request, stream_with_context
+from http_cache import encoded_etag
+
+try:
+    import brotli
+except ImportError:  # brotli es opcional: sin él solo se usa gzip
+    brotli = None
+
+
+class JsonArray:
+    """
+    Marca un iterable para serializarlo como array JSON elemento a elemento.
+    """
+
+    def __init__(self, iterable, serialize=None):
+        self.iterable = iterable
+        self.serialize = serialize or (lambda item: item)
+
+
+def iter_json(fields):
+    """
+    Genera un objeto JSON por trozos a partir de pares (clave, valor).
+
+    Los valores JsonArray se serializan a medida que se recorre su iterable, de modo que
+    nunca se construye la lista completa en memoria.
+
+    Args:
+        fields (iterable): Pares (clave, valor) en el orden en que deben aparecer.
+
+    Yields:
+        str: Fragmentos del documento JSON.
+    """
+    yield '{'
+    for index, (key, value) in enumerate(fields):
+        yield (',' if index else '') + json.dumps(key) + ':'
+        if isinstance(value, JsonArray):
+            yield '['
+            for item_index, item in enumerate(value.iterable):
+                yield (',' if item_index else '') + json.dumps(value.serialize(item))
+            yield ']'
+        else:
+            yield json.dumps(value)
+    yield '}'
+
+
+def stream_json(fields):
+    """
+    Devuelve una respuesta JSON generada de forma incremental.
+
+    El generador conserva el contexto de la petición para poder seguir leyendo de la base
+    de datos (por ejemplo, consultas con yield_per) mientras se envía la respuesta.
+
+    Args:
+        fields (iterable): Pares (clave, valor) del objeto JSON; ver iter_json().
+
+    Returns:
+        Response: Respuesta application/json en streaming.
+    """
+    return Response(stream_with_context(iter_json(fields)), mimetype='application/json')
+
+
+def _choose_encoding():
+    """
+    Elige la codificación de compresión a partir de Accept-Encoding (brotli si está disponible).
+    """
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+
+def _compressor(encoding, level):
+    """
+    Crea un compresor incremental.
+
+    Returns:
+        tuple: Funciones (comprimir_trozo, finalizar) del compresor.
+    """
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=min(level, 11))
+        return compressor.process, compressor.finish
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return compressor.compress, compressor.flush
+
+
+def _compress_stream(chunks, encoding, level):
+    """
+    Comprime una respuesta en streaming trozo a trozo.
+    """
+    compress, finish = _compressor(encoding, level)
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        data = compress(chunk)
+        if data:
+            yield data
+    yield finish()
+
+
+def init_compression(app):
+    """
+    Registra la compresión gzip/brotli de las respuestas JSON.
+
+    Las respuestas completas se comprimen si superan COMPRESS_MIN_SIZE bytes; las respuestas
+    en streaming se comprimen a medida que se generan.
+
+    Args:
+        app (Flask): La instancia de la aplicación Flask.
+    """
+    @app.after_request
+    def compress_response(response):
+        if (not app.config['COMPRESS_ENABLED'] or response.status_code != 200
+                or response.mimetype not in app.config['COMPRESS_MIMETYPES']
+                or 'Content-Encoding' in response.headers):
+            return response
+
+        encoding = _choose_encoding()
+        response.vary.add('Accept-Encoding')
+        if encoding is None:
+            return response
+
+        level = app.config['COMPRESS_LEVEL']
+        if response.is_streamed:
+            response.response = _compress_stream(response.response, encoding, level)
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < app.config['COMPRESS_MIN_SIZE']:
+                return response
+            compress, finish = _compressor(encoding, level)
+            response.set_data(compress(data) + finish())
+        response.headers['Content-Encoding'] = encoding
+        etag, weak = response.get_etag()
+        if etag is not None:
+            response.set_etag(encoded_etag(etag, encoding), weak=weak)
+        return response
@@ -0,0 +1,216 @@
+from collections import defaultdict
+from datetime import date
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from extensions import db
+from models import Product, Category, Sale, SaleItem, UserDailySpend, UserProductSummary, ArchivedSaleItem
+
+_UPSERT_INSERTS = {'sqlite': sqlite_insert, 'postgresql': postgresql_insert}
+
+
+def compute_product_sales():
+    """
+    Calcula desde SaleItem y las líneas de venta archivadas las unidades vendidas y los
+    ingresos de cada producto.
+
+    Returns:
+        dict: {product_id: (units_sold, revenue)} para los productos con ventas.
+    """
+    totals = defaultdict(lambda: [0, 0.0])
+    for item in (SaleItem, ArchivedSaleItem):
+        rows = db.session.query(
+            item.product_id,
+            func.sum(item.quantity),
+            func.sum(item.quantity * item.price)
+        ).group_by(item.product_id).all()
+        for product_id, units, revenue in rows:
+            totals[product_id][0] += int(units or 0)
+            totals[product_id][1] += float(revenue or 0)
+    return {product_id: (units, revenue) for product_id, (units, revenue) in totals.items()}
+
+
+def compute_category_sales(limit=10):
+    """
+    Calcula desde SaleItem y las líneas de venta archivadas los ingresos de cada categoría.
+
+    Las líneas activas se asignan a la categoría actual de su producto y las archivadas a la
+    categoría guardada al archivarlas.
+
+    Args:
+        limit (int): Número máximo de categorías devueltas.
+
+    Returns:
+        list: Diccionarios {'name', 'total_sales'} ordenados de mayor a menor ingreso.
+    """
+    totals = defaultdict(float)
+    hot_rows = db.session.query(
+        Product.category_id,
+        func.sum(SaleItem.quantity * SaleItem.price)
+    ).join(Product, SaleItem.product_id == Product.id) \
+        .group_by(Product.category_id) \
+        .execution_options(include_deleted=True).all()
+    archived_rows = db.session.query(
+        ArchivedSaleItem.category_id,
+        func.sum(ArchivedSaleItem.quantity * ArchivedSaleItem.price)
+    ).group_by(ArchivedSaleItem.category_id).all()
+    for category_id, revenue in hot_rows + archived_rows:
+        totals[category_id] += float(revenue or 0)
+
+    # Las estadísticas muestran los ingresos por nombre de categoría
+    names = dict(db.session.query(Category.id, Category.name))
+    by_name = defaultdict(float)
+    for category_id, revenue in totals.items():
+        if category_id in names:
+            by_name[names[category_id]] += revenue
+    ranking = sorted(by_name.items(), key=lambda item: item[1], reverse=True)[:limit]
+    return [{'name': name, 'total_sales': total} for name, total in ranking]
+
+
+def find_product_counter_drift(tolerance=0.01):
+    """
+    Compara los contadores de ventas de Product con los totales reales de las ventas
+    (activas y archivadas).
+
+    Args:
+        tolerance (float): Diferencia máxima admitida en los ingresos (redondeo de coma flotante).
+
+    Returns:
+        list: Tuplas (product_id, (units_sold, revenue) almacenados, (units_sold, revenue) reales)
+        de los productos cuyos contadores no coinciden.
+    """
+    expected = compute_product_sales()
+    drift = []
+    for product_id, units_sold, revenue in db.session.query(Product.id, Product.units_sold, Product.revenue) \
+            .execution_options(include_deleted=True):
+        real_units, real_revenue = expected.get(product_id, (0, 0.0))
+        if units_sold != real_units or abs((revenue or 0) - real_revenue) > tolerance:
+            drift.append((product_id, (units_sold, revenue), (real_units, real_revenue)))
+    return drift
+
+
+def rebuild_product_counters():
+    """
+    Recalcula los contadores de ventas de todos los productos a partir de las ventas
+    (activas y archivadas).
+
+    Returns:
+        int: Número de productos actualizados.
+    """
+    expected = compute_product_sales()
+    updates = [
+        {'id': product_id, 'units_sold': expected.get(product_id, (0, 0.0))[0],
+         'revenue': expected.get(product_id, (0, 0.0))[1]}
+        for product_id, in db.session.query(Product.id).execution_options(include_deleted=True)
+    ]
+    if updates:
+        db.session.execute(db.update(Product), updates)
+    db.session.commit()
+    return len(updates)
+
+
+def _increment(model, keys, increments):
+    """
+    Suma los incrementos a la fila de resumen identificada por keys, creándola si no existe.
+
+    En SQLite y PostgreSQL se usa INSERT ... ON CONFLICT DO UPDATE para que dos checkouts
+    concurrentes no compitan por crear la misma fila.
+    """
+    insert = _UPSERT_INSERTS.get(db.session.get_bind(mapper=model).dialect.name)
+    if insert is not None:
+        statement = insert(model).values(**keys, **increments)
+        statement = statement.on_conflict_do_update(
+            index_elements=list(keys),
+            set_={name: getattr(model, name) + getattr(statement.excluded, name) for name in increments}
+        )
+        db.session.execute(statement)
+        return
+
+    row = db.session.get(model, tuple(keys.values()))
+    if row is None:
+        db.session.add(model(**keys, **increments))
+    else:
+        for name, value in increments.items():
+            setattr(row, name, getattr(model, name) + value)
+
+
+def record_user_sale(user_id, sale_date, items):
+    """
+    Actualiza los resúmenes de compras del usuario con una venta nueva.
+
+    Debe llamarse dentro de la transacción del checkout, antes del commit.
+
+    Args:
+        user_id (int): El ID del usuario que compra.
+        sale_date (datetime): Fecha de la venta.
+        items (iterable): Pares (product_id, quantity, price) de los items vendidos.
+    """
+    per_product = defaultdict(lambda: [0, 0.0])
+    for product_id, quantity, price in items:
+        per_product[product_id][0] += quantity
+        per_product[product_id][1] += quantity * price
+
+    day_total = sum(total for _, total in per_product.values())
+    _increment(UserDailySpend, {'user_id': user_id, 'day': sale_date.date()}, {'total': day_total})
+    for product_id, (quantity, total) in per_product.items():
+        _increment(UserProductSummary, {'user_id': user_id, 'product_id': product_id},
+                   {'quantity': quantity, 'total': total})
+
+
+def rebuild_user_summaries():
+    """
+    Recalcula desde Sale/SaleItem y las líneas de venta archivadas los resúmenes de compras
+    de todos los usuarios.
+
+    Returns:
+        tuple: Número de filas (gasto diario, productos por usuario) generadas.
+    """
+    daily_rows = db.session.query(
+        Sale.user_id,
+        func.date(Sale.date),
+        func.sum(SaleItem.quantity * SaleItem.price)
+    ).join(SaleItem, Sale.id == SaleItem.sale_id).group_by(Sale.user_id, func.date(Sale.date)).all()
+    daily_rows += db.session.query(
+        ArchivedSaleItem.user_id,
+        func.date(ArchivedSaleItem.date),
+        func.sum(ArchivedSaleItem.quantity * ArchivedSaleItem.price)
+    ).group_by(ArchivedSaleItem.user_id, func.date(ArchivedSaleItem.date)).all()
+
+    product_rows = db.session.query(
+        Sale.user_id,
+        SaleItem.product_id,
+        func.sum(SaleItem.quantity),
+        func.sum(SaleItem.quantity * SaleItem.price)
+    ).join(SaleItem, Sale.id == SaleItem.sale_id).group_by(Sale.user_id, SaleItem.product_id).all()
+    product_rows += db.session.query(
+        ArchivedSaleItem.user_id,
+        ArchivedSaleItem.product_id,
+        func.sum(ArchivedSaleItem.quantity),
+        func.sum(ArchivedSaleItem.quantity * ArchivedSaleItem.price)
+    ).group_by(ArchivedSaleItem.user_id, ArchivedSaleItem.product_id).all()
+
+    # Las ventas activas y las archivadas de un mismo día o producto se suman
+    daily_totals = defaultdict(float)
+    for user_id, day, total in daily_rows:
+        daily_totals[user_id, day if not isinstance(day, str) else date.fromisoformat(day)] += float(total)
+    product_totals = defaultdict(lambda: [0, 0.0])
+    for user_id, product_id, quantity, total in product_rows:
+        product_totals[user_id, product_id][0] += int(quantity)
+        product_totals[user_id, product_id][1] += float(total)
+
+    UserDailySpend.query.delete()
+    UserProductSummary.query.delete()
+    daily = [
+        {'user_id': user_id, 'day': day, 'total': total}
+        for (user_id, day), total in daily_totals.items()
+    ]
+    products = [
+        {'user_id': user_id, 'product_id': product_id, 'quantity': quantity, 'total': total}
+        for (user_id, product_id), (quantity, total) in product_totals.items()
+    ]
+    if daily:
+        db.session.execute(db.insert(UserDailySpend), daily)
+    if products:
+        db.session.execute(db.insert(UserProductSummary), products)
+    db.session.commit()
+    return len(daily), len(products)
@@ -0,0 +1,183 @@
+from bisect import bisect_left
+from datetime import datetime
+from sqlalchemy import func
+from extensions import db
+from models import (Supplier, Purchase, PurchaseItem, SaleItem, SupplierScore, Watermark,
+                    ArchivedPurchaseItem, ArchivedSaleItem)
+from jobs import job
+
+PURCHASES_WATERMARK = 'supplier_scores.purchase'
+SALES_WATERMARK = 'supplier_scores.sale_item'
+
+# Peso de cada métrica en la puntuación (suman 1)
+SCORE_WEIGHTS = {
+    'revenue_share': 0.35,
+    'purchase_total': 0.25,
+    'purchase_frequency': 0.2,
+    'discount': 0.2
+}
+
+
+def _watermark(name):
+    """
+    Devuelve el registro de marca de agua indicado, creándolo si no existe.
+    """
+    mark = db.session.get(Watermark, name)
+    if mark is None:
+        mark = Watermark(name=name, value=0)
+        db.session.add(mark)
+    return mark
+
+
+def _get_score(scores, supplier_id):
+    score = scores.get(supplier_id)
+    if score is None:
+        score = SupplierScore(supplier_id=supplier_id, purchase_count=0, purchase_units=0, purchase_total=0,
+                              sales_units=0, sales_revenue=0, purchase_frequency=0)
+        db.session.add(score)
+        scores[supplier_id] = score
+    return score
+
+
+def _percentile_ranks(values):
+    """
+    Percentil (0-1) de cada valor dentro de la lista; los empates comparten percentil.
+    """
+    if len(values) < 2:
+        return [1.0] * len(values)
+    ordered = sorted(values)
+    return [bisect_left(ordered, v) / (len(values) - 1) for v in values]
+
+
+def update_supplier_scores(rebuild=False):
+    """
+    Suma a los resúmenes de proveedores los pedidos y ventas posteriores a las marcas de agua
+    y recalcula las métricas derivadas (cuota de ingresos, frecuencia, puntuación).
+
+    Args:
+        rebuild (bool): Si es True vacía los resúmenes y los recalcula desde el principio.
+
+    Returns:
+        dict: Pedidos nuevos procesados y proveedores puntuados.
+    """
+    if rebuild:
+        SupplierScore.query.delete()
+        Watermark.query.filter(Watermark.name.in_([PURCHASES_WATERMARK, SALES_WATERMARK])).delete()
+        db.session.flush()
+
+    purchases_mark = _watermark(PURCHASES_WATERMARK)
+    sales_mark = _watermark(SALES_WATERMARK)
+    # Sin filas activas (todo archivado) la marca se mantiene
+    purchases_until = db.session.query(func.max(Purchase.id)).scalar() or purchases_mark.value
+    sales_until = db.session.query(func.max(SaleItem.id)).scalar() or sales_mark.value
+
+    scores = {score.supplier_id: score for score in SupplierScore.query.all()}
+    if rebuild:
+        _add_archived_history(scores)
+
+    # Pedidos nuevos: número, fechas e importe por proveedor (con el total de la cabecera)
+    purchase_rows = db.session.query(
+        Purchase.supplier_id, func.count(Purchase.id), func.sum(Purchase.total),
+        func.min(Purchase.date), func.max(Purchase.date)
+    ).filter(Purchase.id > purchases_mark.value, Purchase.id <= purchases_until) \
+        .group_by(Purchase.supplier_id).all()
+    for supplier_id, count, total, first_date, last_date in purchase_rows:
+        score = _get_score(scores, supplier_id)
+        score.purchase_count += count
+        score.purchase_total += float(total or 0)
+        score.first_purchase_at = min(d for d in (score.first_purchase_at, first_date) if d is not None)
+        score.last_purchase_at = max(d for d in (score.last_purchase_at, last_date) if d is not None)
+
+    unit_rows = db.session.query(Purchase.supplier_id, func.sum(PurchaseItem.quantity)) \
+        .join(PurchaseItem, Purchase.id == PurchaseItem.purchase_id) \
+        .filter(Purchase.id > purchases_mark.value, Purchase.id <= purchases_until) \
+        .group_by(Purchase.supplier_id).all()
+    for supplier_id, units in unit_rows:
+        _get_score(scores, supplier_id).purchase_units += int(units or 0)
+
+    # Ventas nuevas atribuidas a cada proveedor
+    sale_rows = db.session.query(
+        SaleItem.supplier_id, func.sum(SaleItem.quantity), func.sum(SaleItem.quantity * SaleItem.price)
+    ).filter(SaleItem.id > sales_mark.value, SaleItem.id <= sales_until, SaleItem.supplier_id.isnot(None)) \
+        .group_by(SaleItem.supplier_id).all()
+    for supplier_id, units, revenue in sale_rows:
+        score = _get_score(scores, supplier_id)
+        score.sales_units += int(units or 0)
+        score.sales_revenue += float(revenue or 0)
+
+    purchases_mark.value = purchases_until
+    sales_mark.value = sales_until
+
+    _update_derived_metrics(scores)
+    db.session.commit()
+    return {'purchases': sum(row[1] for row in purchase_rows), 'suppliers': len(scores)}
+
+
+def _add_archived_history(scores):
+    """
+    Suma a los resúmenes los pedidos y ventas de las tablas de archivo.
+
+    Solo se usa al reconstruir: en las actualizaciones incrementales los pedidos y ventas se
+    incorporaron antes de archivarse.
+    """
+    # Una fila por pedido archivado: fecha, importe de la cabecera y unidades
+    per_purchase = db.session.query(
+        ArchivedPurchaseItem.purchase_id,
+        func.min(ArchivedPurchaseItem.supplier_id).label('supplier_id'),
+        func.min(ArchivedPurchaseItem.date).label('date'),
+        func.max(ArchivedPurchaseItem.purchase_total).label('total'),
+        func.sum(ArchivedPurchaseItem.quantity).label('units')
+    ).group_by(ArchivedPurchaseItem.purchase_id).subquery()
+    purchase_rows = db.session.query(
+        per_purchase.c.supplier_id, func.count(), func.sum(per_purchase.c.total),
+        func.min(per_purchase.c.date), func.max(per_purchase.c.date), func.sum(per_purchase.c.units)
+    ).group_by(per_purchase.c.supplier_id).all()
+    for supplier_id, count, total, first_date, last_date, units in purchase_rows:
+        score = _get_score(scores, supplier_id)
+        score.purchase_count += count
+        score.purchase_total += float(total or 0)
+        score.purchase_units += int(units or 0)
+        score.first_purchase_at = min(d for d in (score.first_purchase_at, first_date) if d is not None)
+        score.last_purchase_at = max(d for d in (score.last_purchase_at, last_date) if d is not None)
+
+    sale_rows = db.session.query(
+        ArchivedSaleItem.supplier_id, func.sum(ArchivedSaleItem.quantity),
+        func.sum(ArchivedSaleItem.quantity * ArchivedSaleItem.price)
+    ).filter(ArchivedSaleItem.supplier_id.isnot(None)).group_by(ArchivedSaleItem.supplier_id).all()
+    for supplier_id, units, revenue in sale_rows:
+        score = _get_score(scores, supplier_id)
+        score.sales_units += int(units or 0)
+        score.sales_revenue += float(revenue or 0)
+
+
+def _update_derived_metrics(scores):
+    """
+    Recalcula cuota de ingresos, frecuencia, descuento y puntuación de todos los proveedores.
+
+    Trabaja sobre las filas de resumen ya cargadas: no vuelve a leer pedidos ni ventas.
+    """
+    discounts = dict(db.session.query(Supplier.id, Supplier.discount).execution_options(include_deleted=True))
+    for supplier_id in discounts:
+        _get_score(scores, supplier_id)
+    now = datetime.utcnow()
+    total_revenue = sum(score.sales_revenue for score in scores.values())
+
+    for supplier_id, score in scores.items():
+        score.discount = discounts.get(supplier_id) or 0
+        score.revenue_share = score.sales_revenue / total_revenue if total_revenue else 0
+        if score.first_purchase_at is not None:
+            days = max((now - score.first_purchase_at).days, 30)
+            score.purchase_frequency = score.purchase_count * 30 / days
+
+    ordered = list(scores.values())
+    ranks = {metric: _percentile_ranks([getattr(score, metric) for score in ordered]) for metric in SCORE_WEIGHTS}
+    for index, score in enumerate(ordered):
+        score.score = round(100 * sum(weight * ranks[metric][index] for metric, weight in SCORE_WEIGHTS.items()), 1)
+
+
+@job('supplier-scores', interval=900)
+def refresh_supplier_scores():
+    """
+    Tarea periódica: incorpora a los resúmenes los pedidos y ventas nuevos.
+    """
+    return update_supplier_scores()
@@ -0,0 +1,65 @@
+import pytest
+import error_handlers
+import routes
+from main import create_app
+from extensions import db
+from models import User, Category, Product, Supplier, StockMovement
+
+
+@pytest.fixture
+def app(monkeypatch):
+    """
+    Aplicación con la configuración de pruebas (SQLite en memoria, sin CSRF ni límites).
+
+    Las pruebas comprueban el comportamiento y no el HTML: render_template devuelve el
+    nombre de la plantilla.
+    """
+    app = create_app('testing')
+    monkeypatch.setattr(routes, 'render_template', lambda template, **context: template)
+    monkeypatch.setattr(error_handlers, 'render_template', lambda template, **context: template)
+    with app.app_context():
+        yield app
+        db.session.remove()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def customer(app):
+    user = User(username='cliente', email='cliente@example.com')
+    user.set_password('secreto')
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+@pytest.fixture
+def admin(app):
+    user = User(username='admin', email='admin@example.com', is_admin=True)
+    user.set_password('secreto')
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+@pytest.fixture
+def product(app):
+    category = Category(name='Portátiles')
+    supplier = Supplier(company_name='Proveedor', contact_name='Contacto', email='proveedor@example.com',
+                        phone='600000000', address='Calle 1', city='Madrid', country='España',
+                        postal_code='28001', cif='B00000001')
+    product = Product(name='Portátil', price=10.0, stock=0, min_stock=1, reference_number='REF-1',
+                      category=category, suppliers=[supplier])
+    product.change_stock(20, StockMovement.ADJUSTMENT)
+    db.session.add_all([category, supplier, product])
+    db.session.commit()
+    return product
+
+
+def login(client, username, password='secreto'):
+    response = client.post('/login', data={'username': username, 'password': password})
+    assert response.status_code == 302
+    return response
@@ -0,0 +1,49 @@
+import time
+from datetime import datetime, timedelta
+import pytest
+from extensions import db
+from models import Sale, SaleItem
+from analytics_export import export_sales, read_manifest
+from jobs import is_running
+from conftest import login
+
+pytest.importorskip('pyarrow')
+
+
+def _sale(user, product, date):
+    sale = Sale(user_id=user.id, total=product.price, date=date)
+    item = SaleItem(sale=sale, product_id=product.id, quantity=1, price=product.price)
+    db.session.add_all([sale, item])
+    db.session.commit()
+    return item
+
+
+def test_recent_sales_wait_for_the_next_export(tmp_path, customer, product):
+    old = _sale(customer, product, datetime.utcnow() - timedelta(days=1))
+    recent = _sale(customer, product, datetime.utcnow())
+
+    result = export_sales(str(tmp_path))
+    assert result['rows'] == 1
+    assert result['high_water_mark'] == old.id
+
+    recent.sale.date = datetime.utcnow() - timedelta(hours=1)
+    db.session.commit()
+    result = export_sales(str(tmp_path))
+    assert result['rows'] == 1
+    assert result['high_water_mark'] == recent.id
+
+
+def test_endpoint_runs_export_in_background(app, client, admin, customer, product, tmp_path):
+    app.config['EXPORT_DIR'] = str(tmp_path)
+    _sale(customer, product, datetime.utcnow() - timedelta(days=1))
+    login(client, admin.username)
+
+    response = client.post('/api/admin/export_sales')
+    assert response.status_code == 202
+
+    deadline = time.monotonic() + 10
+    while is_running('sales-export') and time.monotonic() < deadline:
+        time.sleep(0.05)
+    status = client.get('/api/admin/export_sales').get_json()
+    assert status['running'] is False
+    assert status['high_water_mark'] == read_manifest(str(tmp_path))['high_water_mark'] > 0
@@ -0,0 +1,80 @@
+from datetime import datetime, timedelta
+from extensions import db
+from models import Sale, SaleItem, ArchivedSaleItem
+from archive import archive_history
+from analytics import load_sale_facts
+from summaries import compute_category_sales
+from conftest import login
+
+
+def _create_sales(user, product, count=23):
+    """
+    Ventas con una o dos líneas; una de cada tres es reciente y el resto anteriores a la
+    fecha límite, de modo que las activas y las archivadas se intercalan por fecha.
+    """
+    now = datetime.utcnow()
+    for number in range(1, count + 1):
+        days = number if number % 3 == 0 else 40 + 7 * number
+        sale = Sale(user_id=user.id, total=0, date=now - timedelta(days=days))
+        lines = 2 if number % 2 else 1
+        for line in range(lines):
+            db.session.add(SaleItem(sale=sale, product_id=product.id, quantity=number * 10 + line,
+                                    price=product.price))
+        db.session.add(sale)
+    db.session.commit()
+    return now - timedelta(days=30)
+
+
+def _history(client, page):
+    response = client.get('/api/client_purchase_history', query_string={'page': page})
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def test_archive_moves_old_sales_to_archive_bind(customer, product):
+    cutoff = _create_sales(customer, product)
+    total_lines = SaleItem.query.count()
+
+    metrics = archive_history('sales', cutoff=cutoff, batch_size=4)
+
+    # La venta con el id más alto es antigua pero se queda en las tablas activas
+    last_sale = Sale.query.order_by(Sale.id.desc()).first()
+    assert last_sale.date < cutoff
+    assert metrics['batches'] > 1
+    assert ArchivedSaleItem.query.count() == metrics['items']
+    assert SaleItem.query.count() + ArchivedSaleItem.query.count() == total_lines
+    assert Sale.query.filter(Sale.date < cutoff, Sale.id != last_sale.id).count() == 0
+
+
+def test_history_pages_merge_hot_and_archived_rows(client, customer, product):
+    cutoff = _create_sales(customer, product)
+    total_lines = SaleItem.query.count()
+    archive_history('sales', cutoff=cutoff)
+    login(client, customer.username)
+
+    first = _history(client, 1)
+    rows = first['purchases']
+    for page in range(2, first['total_pages'] + 1):
+        rows += _history(client, page)['purchases']
+
+    assert first['total_pages'] == -(-total_lines // 10)
+    assert len(rows) == total_lines
+    assert len({(row['id'], row['quantity']) for row in rows}) == total_lines
+    order = [(row['date'], row['id']) for row in rows]
+    assert order == sorted(order, reverse=True)
+    # La venta antigua que sigue activa aparece entre las archivadas, no al principio
+    last_id = db.session.query(db.func.max(Sale.id)).scalar()
+    assert rows[0]['id'] != last_id
+
+
+def test_archive_keeps_sales_totals(customer, product):
+    cutoff = _create_sales(customer, product)
+    categories = compute_category_sales()
+    facts = load_sale_facts()
+
+    archive_history('sales', cutoff=cutoff)
+
+    assert compute_category_sales() == categories
+    archived_facts = load_sale_facts()
+    assert len(archived_facts) == len(facts)
+    assert archived_facts.revenues.sum() == facts.revenues.sum()
@@ -0,0 +1,88 @@
+from datetime import datetime, timedelta
+from extensions import db
+from models import Sale, Purchase, IdempotencyKey
+from conftest import login
+
+CHECKOUT_DATA = {
+    'name': 'Juan Pérez',
+    'email': 'juan.perez@example.com',
+    'address': 'Calle Principal 123, Ciudad',
+    'card_number': '4111111111111111',
+    'expiration_date': '12/25',
+    'cvv': '123',
+    'idempotency_key': 'clave-checkout'
+}
+
+
+def _checkout(client, **changes):
+    return client.post('/checkout', data=dict(CHECKOUT_DATA, **changes))
+
+
+def _fill_cart(client, customer, product):
+    login(client, customer.username)
+    response = client.post(f'/add-to-cart/{product.id}', data={'quantity': 2})
+    assert response.status_code == 200
+
+
+def test_invalid_submit_releases_key_for_corrected_submit(client, customer, product):
+    _fill_cart(client, customer, product)
+
+    response = _checkout(client, cvv='')
+    assert response.status_code == 200
+    assert Sale.query.count() == 0
+    assert IdempotencyKey.query.count() == 0
+
+    response = _checkout(client)
+    assert response.status_code == 302
+    assert 'Idempotent-Replayed' not in response.headers
+    assert Sale.query.count() == 1
+
+    retry = _checkout(client)
+    assert retry.status_code == 302
+    assert retry.headers['Idempotent-Replayed'] == 'true'
+    assert retry.headers['Location'] == response.headers['Location']
+    assert Sale.query.count() == 1
+
+
+def test_double_submit_creates_one_sale(client, customer, product):
+    _fill_cart(client, customer, product)
+
+    first = _checkout(client)
+    second = _checkout(client)
+
+    assert first.status_code == second.status_code == 302
+    assert second.headers['Idempotent-Replayed'] == 'true'
+    assert second.headers['Location'] == first.headers['Location']
+    assert Sale.query.count() == 1
+    db.session.refresh(product)
+    assert product.stock == 18
+
+
+def test_key_reused_with_other_data_is_rejected(client, customer, product):
+    _fill_cart(client, customer, product)
+
+    assert _checkout(client).status_code == 302
+    assert _checkout(client, address='Otra dirección 1').status_code == 422
+    assert Sale.query.count() == 1
+
+
+def test_stale_reservation_is_executed_again(client, admin, product):
+    login(client, admin.username)
+    data = {'productId': product.id, 'supplier': product.suppliers[0].id, 'quantity': 5, 'message': ''}
+    headers = {'Idempotency-Key': 'clave-pedido'}
+
+    # Reserva de una petición cuyo worker murió antes de guardar la respuesta
+    client.application.config['IDEMPOTENCY_PROCESSING_TIMEOUT'] = 60
+    assert client.post('/api/notify_supplier', data=data, headers=headers).status_code == 200
+    record = IdempotencyKey.query.one()
+    record.status_code = None
+    record.created_at = datetime.utcnow() - timedelta(seconds=30)
+    db.session.commit()
+    assert client.post('/api/notify_supplier', data=data, headers=headers).status_code == 409
+
+    record.created_at = datetime.utcnow() - timedelta(seconds=120)
+    db.session.commit()
+    response = client.post('/api/notify_supplier', data=data, headers=headers)
+    assert response.status_code == 200
+    assert 'Idempotent-Replayed' not in response.headers
+    assert Purchase.query.count() == 2
@@ -0,0 +1,62 @@
+from extensions import db
+from models import Product, Supplier, Sale, SaleItem, CartItem, supplier_product
+
+
+def _second_product(product):
+    other = Product(name='Tablet', price=5.0, stock=3, min_stock=1, reference_number='REF-2',
+                    category=product.category)
+    db.session.add(other)
+    db.session.commit()
+    return other
+
+
+def test_deleted_products_are_excluded_from_queries(product):
+    other = _second_product(product)
+    product_id, other_id = product.id, other.id
+    product.soft_delete()
+    # Sesión nueva, como en cada petición: get() no encuentra el objeto en el mapa de identidad
+    db.session.remove()
+
+    assert [row.id for row in Product.query] == [other_id]
+    assert Product.get_active().count() == 1
+    assert db.session.get(Product, product_id) is None
+    other = db.session.get(Product, other_id)
+    assert other.category.products.all() == [other]
+    # Los JOIN también aplican el criterio
+    joined = db.session.query(Supplier.id).join(Product, Supplier.products).all()
+    assert joined == []
+
+
+def test_include_deleted_still_sees_deleted_products(product):
+    product.soft_delete()
+
+    rows = Product.query.execution_options(include_deleted=True).all()
+    assert [row.id for row in rows] == [product.id]
+    assert rows[0].is_deleted is True
+
+
+def test_sale_item_keeps_loading_deleted_product(customer, product):
+    sale = Sale(user_id=customer.id, total=product.price)
+    db.session.add_all([sale, SaleItem(sale=sale, product_id=product.id, quantity=1, price=product.price)])
+    db.session.commit()
+    product.soft_delete()
+    db.session.expire_all()
+
+    item = SaleItem.query.one()
+    assert item.product is not None
+    assert item.product.is_deleted is True
+
+
+def test_soft_delete_many_releases_relations(customer, product):
+    other = _second_product(product)
+    db.session.add(CartItem(user_id=customer.id, product_id=product.id, quantity=1))
+    db.session.commit()
+
+    assert Product.soft_delete_many([product.id, other.id, product.id]) == 2
+    db.session.commit()
+
+    assert CartItem.query.count() == 0
+    assert db.session.execute(db.select(supplier_product)).all() == []
+    assert Product.query.count() == 0
+    # Volver a borrarlos no cuenta los que ya estaban borrados
+    assert Product.soft_delete_many([product.id]) == 0
@@ -0,0 +1,80 @@
+from datetime import datetime, timedelta
+from extensions import db
+from models import Product, StockMovement, StockCheckpoint
+from stock_ledger import find_stock_drift, adjust_stock_drift, create_checkpoints, stock_balance, ledger_balances
+
+
+def _movement(product, delta, created_at):
+    db.session.add(StockMovement(product_id=product.id, delta=delta, reason=StockMovement.ADJUSTMENT,
+                                 created_at=created_at))
+    db.session.execute(db.update(Product).where(Product.id == product.id).values(stock=Product.stock + delta))
+    db.session.commit()
+
+
+def _backdate_movements(delta):
+    for movement in StockMovement.query:
+        movement.created_at -= delta
+    db.session.commit()
+
+
+def test_change_stock_keeps_ledger_in_sync(product):
+    product.change_stock(-3, StockMovement.SALE)
+    product.change_stock(-2, StockMovement.SALE)
+    db.session.commit()
+    db.session.refresh(product)
+
+    assert product.stock == 15
+    assert find_stock_drift() == []
+    assert ledger_balances() == {product.id: 15}
+
+
+def test_drift_is_detected_and_adjusted(product):
+    # Cambio directo de la columna sin pasar por el registro
+    db.session.execute(db.update(Product).where(Product.id == product.id).values(stock=12))
+    db.session.commit()
+
+    assert find_stock_drift() == [(product.id, 12, 20)]
+    assert adjust_stock_drift() == 1
+    assert find_stock_drift() == []
+    assert stock_balance(product.id) == 12
+
+
+def test_checkpoints_skip_recent_movements(product):
+    # El movimiento inicial es más reciente que CHECKPOINT_DELAY
+    assert create_checkpoints() == 0
+
+    _backdate_movements(timedelta(hours=1))
+    assert create_checkpoints() == 1
+    checkpoint = StockCheckpoint.query.one()
+    assert checkpoint.stock == 20
+
+    # Sin movimientos nuevos no se crea otro punto de control
+    assert create_checkpoints() == 0
+
+
+def test_balance_after_checkpoint_adds_later_movements(product):
+    _backdate_movements(timedelta(hours=1))
+    create_checkpoints()
+    product.change_stock(-4, StockMovement.SALE)
+    db.session.commit()
+    db.session.refresh(product)
+
+    assert stock_balance(product.id) == product.stock == 16
+    assert find_stock_drift() == []
+
+
+def test_balance_at_point_in_time(product):
+    now = datetime.utcnow()
+    _backdate_movements(timedelta(days=10))
+    _movement(product, -5, now - timedelta(days=5))
+    _movement(product, 8, now - timedelta(days=2))
+    _movement(product, 3, now)
+    # El punto de control cubre los tres primeros movimientos
+    assert create_checkpoints() == 1
+
+    assert stock_balance(product.id, at=now - timedelta(days=20)) == 0
+    assert stock_balance(product.id, at=now - timedelta(days=7)) == 20
+    assert stock_balance(product.id, at=now - timedelta(days=3)) == 15
+    assert stock_balance(product.id, at=now - timedelta(days=1)) == 23
+    assert stock_balance(product.id) == 26
+    assert find_stock_drift() == []